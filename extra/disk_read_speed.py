@@ -1,7 +1,8 @@
 #!/usr/bin/env python3
 import os, ctypes, ctypes.util, io, mmap, pathlib
 from tinygrad import Tensor, dtypes, Device
-from tinygrad.helpers import Timing, from_mv
+from tinygrad.helpers import Timing, from_mv, getenv, mv_address
+from tinygrad.runtime.ops_disk import DiskReader
 libc = ctypes.CDLL(ctypes.util.find_library("c"))
 
 #from extra.hip_gpu_driver import hip_ioctl
@@ -72,10 +73,29 @@ def read_to_gpu_pingpong(fd, sz, gpubuf):
         dev.allocator._copyin_async(gpubuf, hst2, psz)
     dev.synchronize()
 
+def read_disk_reader(fn, sz):
+  # the mmap memcpy of DISK copyout against the batched reads of DiskReader at a few queue depths and segment sizes
+  t = Tensor.empty(sz, dtype=dtypes.uint8, device=f"disk:{fn}")
+  src = t.lazydata.buffer.ensure_allocated()
+  dest = memoryview(bytearray(sz))
+  with Timing("mmap memcpy:               ", lambda x: f", {sz/x:.2f} GB/s"): dest[:] = src._buf._buf()
+  for depth in [1, 4, 16, 64]:
+    for seg in [256*1024, 2*1024*1024, 16*1024*1024]:
+      DiskReader._reader, free = DiskReader(depth), [(mv_address(b), b) for b in src.allocator._bounce_bufs(seg, depth)]
+      with Timing(f"depth {depth:3d} seg {seg//1024:6d} KB: ", lambda x: f", {sz/x:.2f} GB/s"):
+        for (addr, buf), dst_off, src_off, copy_size in src.allocator._copyout_sharded(src._buf, sz, lambda: free.pop() if free else None, seg):
+          dest[dst_off:dst_off+copy_size] = buf[src_off:src_off+copy_size]
+          free.append((addr, buf))
+
 MAP_LOCKED = 0x2000
 MAP_HUGETLB = 0x40000
 
 if __name__ == "__main__":
+  if getenv("DISK_READER"):
+    # DISK_READER=1 FN=<big file> python3 extra/disk_read_speed.py, drop the page cache before for cold reads
+    read_disk_reader(fn:=getenv("FN", ""), os.stat(fn).st_size)
+    exit(0)
+
   dev = Device[Device.DEFAULT]
 
   warm = (Tensor.ones(1024, device=Device.DEFAULT).contiguous() + Tensor.ones(1024, device=Device.DEFAULT).contiguous()).realize()
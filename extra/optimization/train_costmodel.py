@@ -0,0 +1,27 @@
+# fit the BEAM cost model on the candidates timed by beam_search and time_linearizer, load it with BEAM_COST_MODEL=/tmp/costmodel.json
+import sys, random
+from tinygrad import Device
+from tinygrad.helpers import getenv
+from tinygrad.engine.search import LinearCostModel, cost_model_samples
+
+def topk_recall(mdl:LinearCostModel, samples, k:int) -> float:
+  # the fraction of kernels where the fastest candidate is in the top k predicted ones
+  hits = 0
+  for rows in samples.values():
+    best = min(range(len(rows)), key=lambda i: rows[i][1])
+    hits += best in sorted(range(len(rows)), key=lambda i: mdl.predict(rows[i][0]))[:k]
+  return hits / max(len(samples), 1)
+
+if __name__ == "__main__":
+  samples = cost_model_samples(getenv("DEVICE", Device.DEFAULT))
+  print(f"{len(samples)} kernels with {sum(len(v) for v in samples.values())} timed candidates")
+  if not samples: sys.exit("nothing to train on, run BEAM with CACHELEVEL=2 first")
+  keys = list(samples.keys())
+  random.Random(getenv("SEED", 1337)).shuffle(keys)
+  test_keys, train_keys = keys[:len(keys)//5], keys[len(keys)//5:]
+  mdl = LinearCostModel.fit({k:samples[k] for k in train_keys}, l2=getenv("L2", 1e-2))
+  train, test = {k:samples[k] for k in train_keys}, {k:samples[k] for k in test_keys}
+  for k in [1, 4, 16]: print(f"top-{k:2d} recall  train {topk_recall(mdl, train, k):.3f}  test {topk_recall(mdl, test, k):.3f}")
+  # the saved model is fit on everything
+  LinearCostModel.fit(samples, l2=getenv("L2", 1e-2)).save(fn:=sys.argv[1] if len(sys.argv) > 1 else "/tmp/costmodel.json")
+  print(f"saved to {fn}")
@@ -0,0 +1,48 @@
+# export, import and inspect the BEAM tuning databases TUNING_DB loads, without a file the local CACHEDB is used
+# python3 extra/optimization/tuning_db.py export /tmp/tuning.json
+import argparse, math
+from tinygrad.helpers import colored
+from tinygrad.engine.tuning import TuningEntry, load, save, merge, from_cache, to_cache
+
+def _fmt(e:TuningEntry) -> str:
+  return f"{e.ast[:16]} {e.device+e.suffix:12s} amt={e.amt:<3d} {e.tm*1e6:12.2f} us  {', '.join(f'{o.op.name}({o.axis},{o.arg})' for o in e.opts)}"
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="Export, import and inspect BEAM tuning databases. Without a file, the local CACHEDB is used.")
+  sub = parser.add_subparsers(dest="cmd", required=True)
+  sub.add_parser("list").add_argument("file", nargs="?")
+  sub.add_parser("export", help="write the local BEAM results to a file").add_argument("file")
+  sub.add_parser("import", help="merge a file into the local cache, keeping the fastest entries").add_argument("file")
+  (p:=sub.add_parser("merge", help="merge files into one, keeping the fastest entries")).add_argument("out")
+  p.add_argument("files", nargs="+")
+  (p:=sub.add_parser("diff")).add_argument("a")
+  p.add_argument("b", nargs="?")
+  (p:=sub.add_parser("prune", help="drop entries from a file")).add_argument("file")
+  p.add_argument("--device", action="append", default=[], help="drop the entries of a device")
+  p.add_argument("--untimed", action="store_true", help="drop the entries without a time")
+  p.add_argument("--slower", type=float, help="drop the entries slower than this many us")
+  args = parser.parse_args()
+
+  if args.cmd == "list":
+    for e in sorted((load(args.file) if args.file else from_cache()).values(), key=lambda e: e.key): print(_fmt(e))
+  elif args.cmd == "export":
+    save(args.file, db:=from_cache())
+    print(f"exported {len(db)} entries to {args.file}")
+  elif args.cmd == "import": print(f"imported {to_cache(db:=load(args.file))} of {len(db)} entries from {args.file}")
+  elif args.cmd == "merge":
+    save(args.out, db:=merge(*[load(fn) for fn in args.files]))
+    print(f"merged {len(args.files)} files into {len(db)} entries in {args.out}")
+  elif args.cmd == "diff":
+    a, b = load(args.a), (load(args.b) if args.b else from_cache())
+    for k in sorted(a.keys() | b.keys()):
+      if k not in b: print(colored("-", "red"), _fmt(a[k]))
+      elif k not in a: print(colored("+", "green"), _fmt(b[k]))
+      elif a[k].opts != b[k].opts:
+        print(colored("-", "red"), _fmt(a[k]))
+        print(colored("+", "green"), _fmt(b[k]))
+  elif args.cmd == "prune":
+    db = load(args.file)
+    keep = {k:e for k,e in db.items() if e.device not in args.device and not (args.untimed and not math.isfinite(e.tm)) and
+            not (args.slower is not None and e.tm*1e6 > args.slower)}
+    save(args.file, keep)
+    print(f"pruned {len(db)-len(keep)} of {len(db)} entries from {args.file}")
@@ -0,0 +1,20 @@
+# latency of a small jitted MLP on CLANG, every kernel run from python (JIT=2) vs the whole jit as one native call of the ClangGraph (JIT=1)
+import time
+from tinygrad import Tensor, TinyJit, nn
+from tinygrad.helpers import Context, getenv
+
+if __name__ == "__main__":
+  W, L, CNT = getenv("W", 16), getenv("L", 32), getenv("CNT", 300)
+  layers = [nn.Linear(W, W) for _ in range(L)]
+  def model(x:Tensor) -> Tensor: return x.sequential([f for l in layers for f in (l, Tensor.relu)]).realize()
+  x = Tensor.rand(1, W).realize()
+  for jit in [2, 1]:
+    with Context(JIT=jit):
+      jf = TinyJit(model)
+      for _ in range(3): jf(Tensor.rand(1, W).realize())
+      tms = []
+      for _ in range(CNT):
+        st = time.perf_counter()
+        jf(x)
+        tms.append(time.perf_counter() - st)
+      print(f"JIT={jit} {len(jf.captured.jit_cache)} kernels in {len(jf.captured._jit_cache)} calls: {sorted(tms)[CNT//2]*1e6:8.2f} us")
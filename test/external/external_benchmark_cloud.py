@@ -0,0 +1,21 @@
+# round-trip latency and copy throughput of the CLOUD device, run with CLOUD=1 (and CLOUDDEV) or with HOST of a running cloud server
+import time
+import numpy as np
+from tinygrad import Tensor, Device
+from tinygrad.helpers import getenv
+
+def bench(name:str, fxn, cnt:int, nbytes:int=0):
+  fxn()
+  st = time.perf_counter()
+  for _ in range(cnt): fxn()
+  tm = (time.perf_counter() - st) / cnt
+  print(f"{name:10s} {tm*1e3:8.2f} ms" + (f"  {nbytes/tm*1e-9:6.2f} GB/s" if nbytes else ""))
+
+if __name__ == "__main__":
+  assert Device.DEFAULT == "CLOUD", "run with CLOUD=1"
+  cnt, big = getenv("CNT", 20), np.random.default_rng(0).standard_normal(getenv("N", 1<<24), dtype=np.float32)
+  x = Tensor.ones(16).contiguous().realize()
+  bench("roundtrip", lambda: (x+1).tolist(), cnt*5)
+  bench("copyin", lambda: (Tensor(big).realize(), Device[Device.DEFAULT].synchronize()), cnt, big.nbytes)
+  y = Tensor(big).realize()
+  bench("copyout", lambda: y.numpy(), cnt, big.nbytes)
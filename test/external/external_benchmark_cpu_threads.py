@@ -0,0 +1,32 @@
+# scaling of the CLANG/LLVM kernels with CPU_THREADS, every thread count has to give the same bits as one thread
+import os
+import numpy as np
+from tinygrad import Tensor, Device
+from tinygrad.helpers import Context, getenv
+from tinygrad.engine.realize import lower_schedule, method_cache
+
+def bench(fxn, threads:int, cnt:int) -> tuple[float, np.ndarray]:
+  method_cache.clear()
+  with Context(CPU_THREADS=threads):
+    eis = list(lower_schedule((out:=fxn()).schedule()))
+    tms = []
+    for _ in range(cnt): tms.append(sum(ei.run(wait=True) or 0 for ei in eis))
+  return min(tms), out.numpy()
+
+if __name__ == "__main__":
+  N = getenv("N", 1024)
+  a, b = Tensor.randn(N, N).realize(), Tensor.randn(N, N).realize()
+  img, w = Tensor.randn(16, 64, 56, 56).realize(), Tensor.randn(64, 64, 3, 3).realize()
+  x = Tensor.randn(64, 1 << 16).realize()
+  cases = {"matmul": lambda: a@b, "conv": lambda: img.conv2d(w, padding=1), "elementwise": lambda: (x*2+1).relu(), "reduce": lambda: x.exp().sum(1)}
+  max_threads = getenv("MAX_THREADS", os.cpu_count() or 1)
+  thread_counts = [t for t in [1, 2, 4, 8, 16, 32, 64] if t <= max_threads]
+  print(f"{Device.DEFAULT} with {thread_counts} threads")
+  for name, fxn in cases.items():
+    base, ref = bench(fxn, 1, getenv("CNT", 5))
+    print(f"{name:12s}", end="")
+    for threads in thread_counts:
+      tm, out = bench(fxn, threads, getenv("CNT", 5))
+      np.testing.assert_equal(out, ref)
+      print(f"  {threads:2d}: {tm*1e3:8.2f} ms {base/tm:5.2f}x", end="")
+    print()
@@ -0,0 +1,20 @@
+# python overhead of replaying a JIT of many small kernels, like a decode step. run with JIT=2 to replay without graphs, and JIT_STATS=0
+import time
+from tinygrad import Tensor, TinyJit, Variable
+from tinygrad.helpers import getenv
+
+@TinyJit
+def step(x:Tensor, y:Tensor) -> tuple[Tensor, Tensor]:
+  # half the kernels have a symbolic size
+  for _ in range(getenv("KERNELS", 500)//2): x, y = (x * 1.01 + 1).contiguous(), (y * 1.01 + 1).contiguous()
+  return x.realize(), y.realize()
+
+if __name__ == "__main__":
+  x, y = Tensor.ones(64).contiguous().realize(), Tensor.ones(64).contiguous().realize()
+  tms = []
+  for i in range(getenv("CNT", 20)):
+    pos = Variable("pos", 1, 64).bind(i % 32 + 1)
+    st = time.perf_counter()
+    step(x[:i % 32 + 1].reshape(pos), y)
+    tms.append(time.perf_counter() - st)
+  print(f"{min(tms[3:])*1e3:7.2f} ms per call")
@@ -0,0 +1,27 @@
+# time to run the schedule of a data parallel train step on N devices, with and without OVERLAP of the gradient copies and the backward pass
+import time
+from tinygrad import Tensor, nn, Device
+from tinygrad.helpers import Context, getenv
+from tinygrad.nn.state import get_parameters
+from tinygrad.engine.realize import run_schedule
+
+if __name__ == "__main__":
+  GPUS = tuple(f"{Device.DEFAULT}:{i}" for i in range(getenv("GPUS", 4)))
+  BS, D, LAYERS = getenv("BS", 256), getenv("D", 1024), getenv("LAYERS", 8)
+  layers = [nn.Linear(D, D) for _ in range(LAYERS)]
+  for p in (params:=get_parameters(layers)): p.to_(GPUS).realize()
+  opt = nn.optim.SGD(params, lr=1e-4)
+  x, y = Tensor.randn(BS, D).shard(GPUS, 0).realize(), Tensor.randn(BS, D).shard(GPUS, 0).realize()
+  for overlap in [0, 1]:
+    with Tensor.train(), Context(OVERLAP=overlap):
+      tms = []
+      for _ in range(getenv("CNT", 5)):
+        h = x
+        for l in layers: h = l(h).relu()
+        opt.zero_grad()
+        ((h-y)**2).mean().backward()
+        sched = Tensor.schedule(*opt.schedule_step())
+        st = time.perf_counter()
+        run_schedule(sched)
+        tms.append(time.perf_counter() - st)
+    print(f"OVERLAP={overlap}: {min(tms[1:])*1e3:8.2f} ms per step on {len(GPUS)} devices")
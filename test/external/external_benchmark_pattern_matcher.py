@@ -0,0 +1,40 @@
+# compare graph_rewrite throughput of the compiled PatternMatcher dispatch against the linear scan over the patterns of an op
+import time
+from extra.models.resnet import ResNet50
+from tinygrad import Tensor, nn
+from tinygrad.helpers import getenv
+from tinygrad.ops import Ops, PatternMatcher, UOp
+from tinygrad.codegen.kernel import Kernel
+from tinygrad.codegen.lowerer import rewrite_shapetracker_with_index
+from tinygrad.codegen.rewriter import full_graph_rewrite
+
+compiled_rewrite = PatternMatcher.rewrite
+def linear_rewrite(self:PatternMatcher, uop:UOp, ctx=None) -> UOp|None:
+  ler = {u.op for u in uop.src}
+  for p,fxn,early_reject,has_ctx in self.pdict.get(uop.op, []):
+    if not early_reject.issubset(ler): continue
+    for match in p.match(uop, {}):
+      if (ret:=(fxn(ctx=ctx, **match) if has_ctx else fxn(**match))) is not None: return ret
+  return None
+
+if __name__ == "__main__":
+  mdl = ResNet50()
+  for p in nn.state.get_parameters(mdl): p.replace(Tensor.empty(p.shape))
+  img = Tensor.empty(getenv("BS", 8), 3, 224, 224)
+  asts = list({x.ast.key:x.ast for x in mdl(img).schedule() if x.ast.op is Ops.SINK}.values())
+  kernels = [Kernel(ast) for ast in asts]
+  for k in kernels: k.hand_coded_optimizations()
+  uops = [rewrite_shapetracker_with_index(k.get_optimized_ast(), k.opts) for k in kernels]
+
+  cnt = getenv("CNT", 3)
+  for name,rewrite in [("linear", linear_rewrite), ("compiled", compiled_rewrite)]*2:
+    PatternMatcher.rewrite = rewrite  # type: ignore
+    st = time.perf_counter()
+    for _ in range(cnt): mdl(img).schedule()
+    tm_sched = (time.perf_counter() - st) / cnt
+    st = time.perf_counter()
+    for _ in range(cnt): rewritten = [full_graph_rewrite(u, k.opts) for k,u in zip(kernels, uops)]
+    tm_rewrite = (time.perf_counter() - st) / cnt
+    print(f"{name:8s} schedule {tm_sched*1e3:8.2f} ms   rewrite {len(uops)} kernels {tm_rewrite*1e3:8.2f} ms", end="   ")
+    print(f"{sum(len(u.toposort) for u in rewritten)} uops")
+  PatternMatcher.rewrite = compiled_rewrite  # type: ignore
@@ -0,0 +1,25 @@
+# compare loading a safetensors file with safe_load+load_state_dict against the batched reads of safe_load_into
+import time
+from tinygrad import Tensor, Device
+from tinygrad.helpers import getenv, temp
+from tinygrad.nn.state import safe_save, safe_load, load_state_dict, safe_load_into
+
+class Model:
+  def __init__(self, n:int, sz:int):
+    self.layers = [Tensor.empty(sz, sz) for _ in range(n)]
+    self.norms = [Tensor.empty(sz) for _ in range(n)]
+
+if __name__ == "__main__":
+  N, SZ = getenv("N", 64), getenv("SZ", 1024)
+  fn = getenv("FN", temp("benchmark.safetensors"))
+  if not getenv("NOSAVE"):
+    safe_save({f"layers.{i}": Tensor.ones(SZ, SZ).contiguous() for i in range(N)} | {f"norms.{i}": Tensor.ones(SZ) for i in range(N)}, fn)
+  nbytes = N*(SZ*SZ+SZ)*4
+  print(f"{nbytes/1e9:.2f} GB in {2*N} tensors to {Device.DEFAULT}")
+  for name,load in [("load_state_dict", lambda m: load_state_dict(m, safe_load(fn), verbose=False)),
+                    ("safe_load_into", lambda m: safe_load_into(m, fn, verbose=False))]*2:
+    m = Model(N, SZ)
+    st = time.perf_counter()
+    load(m)
+    Device[Device.DEFAULT].synchronize()
+    print(f"{name:16s} {(et:=time.perf_counter()-st):7.3f} s  {nbytes/1e9/et:6.2f} GB/s")
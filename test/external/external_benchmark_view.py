@@ -0,0 +1,71 @@
+# benchmark View merge/reshape/invert on the views that show up in test_symbolic_shapetracker and while scheduling real models
+import time, unittest, functools
+from tinygrad import Tensor, Variable, nn
+from tinygrad.helpers import getenv
+from tinygrad.shape import view
+from tinygrad.shape.view import View
+from extra.models.resnet import ResNet50
+from extra.models.llama import Transformer
+
+def record(calls:dict[str, list]):
+  patched = {name:getattr(View, name) for name in ("__add__", "reshape", "invert")}
+  def wrap(name, fxn):
+    @functools.wraps(fxn)
+    def _wrapped(*args):
+      ret = fxn(*args)
+      calls[name].append(args)   # only the calls that didn't raise
+      return ret
+    return _wrapped
+  for name,fxn in patched.items(): setattr(View, name, wrap(name, fxn))
+  return lambda: [setattr(View, name, fxn) for name,fxn in patched.items()]
+
+def collect() -> dict[str, list]:
+  calls: dict[str, list] = {"__add__": [], "reshape": [], "invert": []}
+  restore = record(calls)
+  try:
+    unittest.TextTestRunner(verbosity=0).run(unittest.defaultTestLoader.loadTestsFromName("test.test_symbolic_shapetracker"))
+    mdl = ResNet50()
+    for p in nn.state.get_parameters(mdl): p.replace(Tensor.empty(p.shape))
+    mdl(Tensor.empty(getenv("BS", 8), 3, 224, 224)).schedule()
+    llama = Transformer(dim=512, hidden_dim=1024, n_heads=8, n_layers=2, norm_eps=1e-5, vocab_size=1000, max_context=128, jit=False)
+    for p in nn.state.get_parameters(llama): p.replace(Tensor.empty(p.shape, dtype=p.dtype))
+    start_pos = Variable("start_pos", 1, 127).bind(3)
+    Tensor.schedule(llama.forward(Tensor.empty(1, 1), start_pos, 0.0, 0, 0.8, 0.0, 0.0))
+  finally: restore()
+  return {k:list(dict.fromkeys(v)) for k,v in calls.items()}
+
+def bench(name:str, fxn, args:list, cnt:int) -> float:
+  st = time.perf_counter()
+  for _ in range(cnt):
+    fxn.cache_clear()
+    for a in args: fxn(*a)
+  return (time.perf_counter() - st) / cnt
+
+if __name__ == "__main__":
+  calls = collect()
+  cnt = getenv("CNT", 10)
+  for name,args in calls.items():
+    fxn = getattr(View, name)
+    cold = bench(name, fxn, args, cnt)
+    st = time.perf_counter()
+    for _ in range(cnt):
+      for a in args: fxn(*a)
+    warm = (time.perf_counter() - st) / cnt
+    print(f"{name:10s} {len(args):6d} unique calls  cold {cold*1e3:9.2f} ms  warm {warm*1e3:7.2f} ms  cache {fxn.cache_info()}")
+
+  # the merge of two all-int views is done without UOps, compare to the symbolic path on the same inputs
+  merges = []
+  for vm2,vm1 in calls["__add__"]:
+    if vm2.contiguous or vm1.contiguous or vm1.mask or not all(isinstance(x, int) for x in vm1.shape+vm1.strides+vm2.shape+(vm1.offset,)): continue
+    origin = view.unravel(vm2.shape, vm1.offset)
+    terms: list[list[tuple[int, int]]] = [[] for _ in vm2.shape]
+    for d1, st in enumerate(vm1.strides):
+      if st == 0: continue
+      for d2, (o, s1) in enumerate(zip(origin, view.unravel(vm2.shape, vm1.offset + st))):
+        if (s1 := s1 - o) != 0: terms[d2].append((d1, s1))
+    merges.append((vm1.shape, vm2.shape, terms, origin))
+  for fxn in (view._merge_extents, view._merge_extents_int):
+    st = time.perf_counter()
+    for _ in range(cnt):
+      for a in merges: fxn(*a)
+    print(f"{fxn.__name__:18s} {len(merges):6d} merges  {(time.perf_counter() - st) / cnt * 1e3:9.2f} ms")
@@ -6,6 +6,8 @@ from tinygrad.tensor import Tensor, _to_np_dtype
 from tinygrad.helpers import Context, CI, dedup, from_mv
 from tinygrad.dtype import dtypes
 from tinygrad.engine.realize import ExecItem, BufferXfer, get_runner, CompiledRunner
+from tinygrad import TinyJit, Variable
+from tinygrad.runtime.graph.clang import ClangGraph
 
 np.random.seed(1337)
 Tensor.manual_seed(1337)
@@ -229,5 +231,34 @@ class TestGraph(unittest.TestCase):
 
     helper_test_graphs(Device[d0].graph, graphs)
 
+@unittest.skipUnless(Device.DEFAULT == "CLANG", "CLANG graph")
+class TestClangGraph(unittest.TestCase):
+  def _jit(self, f, *shapes):
+    jf = TinyJit(f)
+    for _ in range(3):
+      args = [Tensor.rand(*s).realize() for s in shapes]
+      np.testing.assert_allclose(jf(*args).numpy(), f(*args).numpy(), rtol=1e-6)
+    return jf
+
+  def test_one_call(self):
+    jf = self._jit(lambda a,b: ((a+1).contiguous()*b).contiguous().sum(1).realize(), (4, 8), (4, 8))
+    self.assertEqual(len(jf.captured._jit_cache), 1)
+    self.assertEqual(len((graph:=jf.captured._jit_cache[0].prg).steps), 1)
+    self.assertIsInstance(graph, ClangGraph)
+
+  def test_symbolic(self):
+    def f(a): return ((a+1).contiguous()*2).sum(1).realize()
+    jf = TinyJit(f)
+    for i in range(1, 6):
+      a = Tensor.rand(3, i).realize()
+      np.testing.assert_allclose(jf(a.reshape(3, Variable("i", 1, 10).bind(i))).numpy(), f(a).numpy(), rtol=1e-6)
+    self.assertIsInstance(jf.captured._jit_cache[0].prg, ClangGraph)
+
+  def test_threads(self):
+    with Context(CPU_THREADS=4):
+      jf = self._jit(lambda a,b: ((a@b).contiguous()+1).sum(0).realize(), (128, 128), (128, 128))
+      # the threaded matmul and the sum that isn't split are two calls
+      self.assertEqual([threads for _,threads in jf.captured._jit_cache[0].prg.steps], [4, 1])
+
 if __name__ == '__main__':
   unittest.main()
@@ -8,6 +8,7 @@ from tinygrad.tensor import Tensor
 from tinygrad.engine.jit import TinyJit
 from tinygrad.device import Device
 from tinygrad.helpers import CI, Context, JIT, GlobalCounters
+from tinygrad import Variable
 from tinygrad.dtype import dtypes
 from extra.models.unet import ResBlock
 
@@ -571,5 +572,74 @@ class TestJitFree(unittest.TestCase):
     fxn(Tensor([2]))
     self.assertEqual(x.item(), 8)
 
+class TestJitSignatures(unittest.TestCase):
+  def test_shapes(self):
+    jf = TinyJit(lambda a,b: (a@b).relu().realize(), max_captures=4)
+    b = Tensor.randn(8, 4).realize()
+    captured = {}
+    for bs in [1, 2, 3]*3 + [1]:
+      a = Tensor.randn(bs, 8).realize()
+      np.testing.assert_allclose(jf(a, b).numpy(), np.maximum(a.numpy() @ b.numpy(), 0), atol=1e-5, rtol=1e-5)
+      if jf.captured is not None: self.assertIs(captured.setdefault(bs, jf.captured), jf.captured)
+    self.assertEqual(len(jf.captures), 3)
+    self.assertEqual(sorted(captured), [1, 2, 3])
+
+  def test_evict_least_recently_used(self):
+    jf = TinyJit(lambda a: (a+1).realize(), max_captures=2)
+    for n in [1, 2, 1, 3]: jf(Tensor.ones(n).contiguous())
+    self.assertEqual([k[1][0][0].shape for k in jf.captures], [(1,), (3,)])
+    for _ in range(3): np.testing.assert_equal(jf(Tensor.ones(2).contiguous()).numpy(), [2, 2])
+
+  def test_dtype(self):
+    jf = TinyJit(lambda a: (a*2).realize(), max_captures=2)
+    for _ in range(3):
+      np.testing.assert_equal(jf(Tensor([1, 2], dtype=dtypes.int32)).numpy(), [2, 4])
+      np.testing.assert_equal(jf(Tensor([1, 2], dtype=dtypes.float32)).numpy(), [2, 4])
+    self.assertEqual(len(jf.captures), 2)
+
+  def test_buckets(self):
+    w = Tensor.randn(4, 3).realize()
+    jf = TinyJit(lambda x,w: (x@w).realize(), max_captures=2, buckets=(4, 8))
+    for bs in [1, 3, 4, 2, 5, 8, 7, 1]:
+      x = Tensor.randn(bs, 4).realize()
+      np.testing.assert_allclose(out:=jf(x, w).numpy(), x.numpy() @ w.numpy(), atol=1e-5, rtol=1e-5)
+      self.assertEqual(out.shape, (bs, 3))
+    self.assertEqual([k[1][0][0].shape for k in jf.captures], [(8, 4), (4, 4)])
+
+  def test_buckets_bigger_batch(self):
+    jf = TinyJit(lambda x: (x+1).realize(), buckets=(2,))
+    for _ in range(3): np.testing.assert_equal(jf(Tensor.zeros(3).contiguous()).numpy(), [1, 1, 1])
+
+class TestJitReplay(unittest.TestCase):
+  def setUp(self):
+    @TinyJit
+    def f(x:Tensor, y:Tensor) -> Tensor: return ((x+1).contiguous()*2).sum().realize() + (y*3).realize()
+    self.f = f
+    self.vi = Variable("i", 1, 10)
+
+  def _call(self, i:int, reset=False):
+    x, y = Tensor.arange(10).contiguous().realize()[:i].reshape(self.vi.bind(i)), Tensor.ones(4).contiguous().realize()
+    if reset: GlobalCounters.reset()
+    out = self.f(x, y)
+    stats = (GlobalCounters.kernel_count, GlobalCounters.global_ops, GlobalCounters.global_mem)
+    return out.numpy(), stats
+
+  def test_symbolic(self):
+    for i in [3, 5, 3, 7, 10, 1, 7]: np.testing.assert_equal(self._call(i)[0], (np.arange(i)+1).sum()*2 + 3)
+    self.assertIsNotNone(self.f.captured._replay)
+
+  def test_stats(self):
+    stats = [self._call(5, reset=True)[1] for _ in range(4)]
+    # the first run of the capture goes through ExecItem.run, the replays count the same
+    self.assertEqual(stats[2], stats[3])
+    self.assertGreater(stats[3][1], 0)
+    with Context(JIT_STATS=0): self.assertEqual(self._call(5, reset=True)[1], (0, 0, 0))
+
+  def test_inputs_cleared(self):
+    for _ in range(4): self._call(5)
+    c = self.f.captured
+    self.assertTrue(all(c._jit_cache[j].bufs[i] is None for j,i in c._input_replace))
+    self.assertTrue(all(lst[i] is None for lst,i,_,_ in c._patches))
+
 if __name__ == '__main__':
   unittest.main()
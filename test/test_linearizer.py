@@ -5,14 +5,14 @@ from dataclasses import replace
 
 from test.helpers import ast_const
 from tinygrad.codegen.kernel import Opt, OptOps, KernelOptError, Kernel
-from tinygrad.codegen.lowerer import get_grouped_dims
+from tinygrad.codegen.lowerer import get_grouped_dims, get_threaded_idx
 from tinygrad.ops import UOp, Ops, GroupOp
 from tinygrad.device import Device, Buffer, is_dtype_supported
 from tinygrad.shape.shapetracker import ShapeTracker
 from tinygrad.shape.view import View
 # from tinygrad.ops import Variable
 from tinygrad.tensor import Tensor, _to_np_dtype
-from tinygrad.engine.realize import run_schedule, lower_schedule, CompiledRunner
+from tinygrad.engine.realize import run_schedule, lower_schedule, CompiledRunner, method_cache
 from tinygrad.helpers import prod, Context, getenv, CI, flatten, dedup, AMX
 from tinygrad.dtype import DType, dtypes
 
@@ -2169,5 +2169,44 @@ class TestKernelOpts(unittest.TestCase):
     ]
     helper_linearizer_opt(r, [x[0] for x in opts_shapes], color_sizes=[x[1] for x in opts_shapes])
 
+@unittest.skipUnless(Device[Device.DEFAULT].renderer.has_threads, "test requires threads")
+class TestThreads(unittest.TestCase):
+  def tearDown(self): method_cache.clear()
+
+  def _run(self, fxn, threads:int):
+    # the method cache doesn't key on CPU_THREADS
+    method_cache.clear()
+    with Context(CPU_THREADS=threads):
+      eis = list(lower_schedule((out:=fxn()).schedule()))
+      for ei in eis: ei.run()
+      return out.numpy(), [ei.prg.p.global_size for ei in eis if isinstance(ei.prg, CompiledRunner)]
+
+  def test_threaded_is_deterministic(self):
+    a, b, c = Tensor.randn(256, 257).realize(), Tensor.randn(257, 300).realize(), Tensor.randn(1001, 131).realize()
+    # the matmul splits evenly, 1001 is split in chunks of 126 with a shorter last one and the sum over axis 0 threads the second axis
+    for fxn in [lambda: a@b, lambda: (c.exp()+1).sum(1), lambda: c.sum(0), lambda: c.T.contiguous()*2]:
+      ref, gs = self._run(fxn, 1)
+      self.assertTrue(all(g[0] == 1 for g in gs if g is not None))
+      for threads in [3, 8]:
+        out, gs = self._run(fxn, threads)
+        self.assertEqual(max(g[0] for g in gs), threads)
+        np.testing.assert_equal(out, ref)
+
+  def test_small_kernel_not_threaded(self):
+    _, gs = self._run(lambda: Tensor.ones(16, 16).contiguous()+1, 8)
+    self.assertTrue(all(g[0] == 1 for g in gs if g is not None))
+
+  def test_threaded_idx(self):
+    self.assertIsNone(get_threaded_idx((64, 64), 2, 1))
+    # the first global loop with enough iterations for all the threads
+    axis, idx = get_threaded_idx((2, 1000, 64), 2, 8)
+    self.assertEqual(axis, 1)
+    core = [u for u in idx.toposort if u.op is Ops.SPECIAL][0]
+    self.assertEqual(core.arg, ("core0", 8))
+    # else the biggest one
+    axis, idx = get_threaded_idx((3, 5, 8192), 2, 8)
+    self.assertEqual(axis, 1)
+    self.assertEqual([u for u in idx.toposort if u.op is Ops.SPECIAL][0].arg, ("core0", 5))
+
 if __name__ == '__main__':
   unittest.main()
@@ -1,5 +1,11 @@
-import unittest
+import unittest, random
+from unittest.mock import patch
 from tinygrad import Tensor, Device, Variable
+from tinygrad.helpers import Context
+from tinygrad.engine import realize
+from tinygrad.engine.realize import method_cache, program_cache_stats, lower_schedule_item
+from tinygrad.codegen.kernel import Kernel
+from tinygrad.ops import Ops
 from examples.gpt2 import Transformer
 from tinygrad.nn.state import get_state_dict
 
@@ -41,6 +47,81 @@ class TestMethodCache(unittest.TestCase):
     Device[Device.DEFAULT].compiler = None
     for i in range(3): model(Tensor([[1,2,3,4]]), Variable("start_pos", 0, 10).bind(i)).realize()
 
+class TestProgramCache(unittest.TestCase):
+  def setUp(self): self.backup_method_cache = method_cache.copy()
+  def tearDown(self):
+    method_cache.clear()
+    method_cache.update(self.backup_method_cache)
+
+  def test_program_cache_hit(self):
+    if Device[Device.DEFAULT].compiler.cachekey is None: self.skipTest("device has no compiler cache")
+    unique_const = random.random()
+    with Context(PROGRAM_CACHE=1):
+      hits, misses = program_cache_stats["hits"], program_cache_stats["misses"]
+      (Tensor([1.,2.,3.]) + unique_const).realize()
+      self.assertEqual(program_cache_stats["misses"], misses+1)
+      # a fresh process doesn't have the method cache, and doesn't need to optimize, render or compile
+      method_cache.clear()
+      with patch("tinygrad.engine.realize.get_kernel", side_effect=AssertionError("get_kernel called")), \
+           patch.object(Device[Device.DEFAULT].compiler, "compile", side_effect=AssertionError("compile called")):
+        out = (Tensor([1.,2.,3.]) + unique_const).realize()
+      self.assertEqual(program_cache_stats["hits"], hits+1)
+    for x,y in zip(out.tolist(), [1.,2.,3.]): self.assertAlmostEqual(x, y+unique_const, places=5)
+
+  def test_program_cache_codegen_change(self):
+    if Device[Device.DEFAULT].compiler.cachekey is None: self.skipTest("device has no compiler cache")
+    unique_const = random.random()
+    with Context(PROGRAM_CACHE=1):
+      (Tensor([1.,2.,3.]) + unique_const).realize()
+      method_cache.clear()
+      misses = program_cache_stats["misses"]
+      with patch("tinygrad.engine.realize.codegen_version", lambda device: "changed"): (Tensor([1.,2.,3.]) + unique_const).realize()
+      self.assertEqual(program_cache_stats["misses"], misses+1)
+
+class TestParallelLower(unittest.TestCase):
+  def setUp(self): self.backup_method_cache = method_cache.copy()
+  def tearDown(self):
+    method_cache.clear()
+    method_cache.update(self.backup_method_cache)
+
+  def test_parallel_lower_matches_serial(self):
+    unique_const = random.random()
+    def f():
+      Tensor.manual_seed(0)
+      a = Tensor.rand(8, 8)
+      return ((a @ a.T + unique_const).relu().sum(1) * 3 + (a.exp() + unique_const).max(0)).realize()
+    # all the kernels are optimized, rendered and compiled in the workers
+    with Context(PARALLEL_LOWER=2), patch.object(Kernel, "to_program", side_effect=AssertionError("to_program called")), \
+         patch.object(realize, "get_kernel", side_effect=AssertionError("get_kernel called")):
+      out = f().tolist()
+    self.assertEqual(len(realize.optimizing), 0)
+    self.assertEqual(len(realize.precompiling), 0)
+    method_cache.clear()
+    self.assertEqual(out, f().tolist())
+
+  def test_parallel_lower_duplicate_names(self):
+    unique_const = random.random()
+    a = Tensor.empty(64).realize()
+    def srcs(parallel:int) -> list[tuple]:
+      method_cache.clear()
+      Kernel.kernel_cnt.clear()
+      with Context(PARALLEL_LOWER=parallel):
+        # the three kernels have the same name, the serial path numbers them
+        sched = Tensor.schedule(a + unique_const, a * unique_const, a - unique_const)
+        if parallel: realize.precompile_schedule(sched)
+        # the PYTHON src is a pickle of the uops, which isn't byte for byte the same when made in another process
+        return [(p.function_name, p.uops, p.src if Device.DEFAULT != "PYTHON" else None)
+                for si in sched if si.ast.op is Ops.SINK and (p:=lower_schedule_item(si).prg.p)]
+    backup_cnt = Kernel.kernel_cnt.copy()
+    try:
+      serial, parallel = srcs(0), srcs(2)
+    finally:
+      Kernel.kernel_cnt.clear()
+      Kernel.kernel_cnt.update(backup_cnt)
+    self.assertEqual(len(serial), 3)
+    self.assertTrue(serial[2][0].endswith("n2"))
+    self.assertEqual(serial, parallel)
+
 if __name__ == '__main__':
   unittest.main()
 
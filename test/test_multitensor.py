@@ -1,14 +1,15 @@
-import unittest, functools, random
+import unittest, functools, random, threading, contextlib
+from unittest.mock import patch
 from typing import List
 from tinygrad import Tensor, Device, nn, GlobalCounters, TinyJit, dtypes, Variable
 from tinygrad.ops import Ops, UOp
 from tinygrad.helpers import CI, getenv, prod, Context
 from tinygrad.nn.state import get_parameters, get_state_dict
-from tinygrad.engine.realize import lower_schedule, BufferCopy, CompiledRunner, run_schedule
+from tinygrad.engine.realize import lower_schedule, BufferCopy, CompiledRunner, run_schedule, Streams
 from tinygrad.engine.multi import all_reduce
 import numpy as np
 from hypothesis import given, strategies as strat, settings
-from tinygrad.device import is_dtype_supported
+from tinygrad.device import is_dtype_supported, _MallocAllocator
 
 settings.register_profile("my_profile", max_examples=200, deadline=None, derandomize=getenv("DERANDOMIZE_CI", False))
 settings.load_profile("my_profile")
@@ -1097,5 +1098,67 @@ class TestTensorOps(unittest.TestCase):
   def test_bitcast(self):
     helper_test_shard_op([(256,), (256,)], lambda x: x.bitcast(dtypes.int))
 
+@unittest.skipUnless(isinstance(Device[Device.DEFAULT].allocator, _MallocAllocator), "streams are for host devices")
+class TestOverlap(unittest.TestCase):
+  def _train_step(self, overlap:int, ctx=contextlib.nullcontext()):
+    Tensor.manual_seed(0)
+    layers = [nn.Linear(32, 32) for _ in range(3)]
+    for p in (params:=get_parameters(layers)): p.to_(devices_4).realize()
+    opt = nn.optim.SGD(params, lr=0.1)
+    x, y = Tensor.randn(16, 32).shard(devices_4, 0).realize(), Tensor.randn(16, 32).shard(devices_4, 0).realize()
+    with Tensor.train(), Context(OVERLAP=overlap):
+      h = x
+      for l in layers: h = l(h).relu()
+      opt.zero_grad()
+      ((h-y)**2).mean().backward()
+      sched = Tensor.schedule(*opt.schedule_step())
+      with ctx: run_schedule(sched[:])
+    return sched, [p.numpy() for p in params]
+
+  def test_data_parallel(self):
+    _, ref = self._train_step(0)
+    _, out = self._train_step(1)
+    for a,b in zip(ref, out): np.testing.assert_equal(a, b)
+
+  def test_copies_first(self):
+    sched, _ = self._train_step(1)
+    copies = [i for i,si in enumerate(sched) if si.ast.op is Ops.COPY]
+    self.assertGreater(len(copies), 0)
+    # a copy runs right after the item it waited for
+    for i in copies:
+      if i == 0 or sched[i-1].ast.op is Ops.COPY: continue
+      self.assertTrue(set(sched[i-1].outputs) & set(sched[i].inputs), f"{i} isn't after its source")
+
+  def test_streams(self):
+    threads: dict[type, set[str]] = {BufferCopy: set(), CompiledRunner: set()}
+    def record(fxn):
+      def wrapper(self, rawbufs, *args, **kwargs):
+        # the lr comes from a python const on another device
+        if all(b.device in devices_4 for b in rawbufs): threads[type(self)].add(threading.current_thread().name.rsplit("_", 1)[0])
+        return fxn(self, rawbufs, *args, **kwargs)
+      return wrapper
+    @contextlib.contextmanager
+    def recording():
+      with patch.object(BufferCopy, "__call__", record(BufferCopy.__call__)):
+        with patch.object(CompiledRunner, "__call__", record(CompiledRunner.__call__)): yield
+    self._train_step(1, recording())
+    self.assertEqual(threads[BufferCopy], {"stream copy"})
+    self.assertEqual(threads[CompiledRunner], {f"stream {d}" for d in devices_4})
+
+  def test_buckets(self):
+    for bucket in [1, 1 << 30]:
+      submits = []
+      @contextlib.contextmanager
+      def recording():
+        with patch.object(Streams, "_submit", autospec=True, side_effect=Streams._submit) as submit:
+          yield
+          submits.extend(c.args for c in submit.call_args_list)
+      with patch("tinygrad.engine.realize.OVERLAP_BUCKET", bucket): sched, _ = self._train_step(1, recording())
+      buckets = [len(eis) for _,stream,eis in submits if stream == "copy"]
+      self.assertEqual(sum(buckets), len([si for si in sched if si.ast.op is Ops.COPY and
+                                        all(isinstance(Device[b.device].allocator, _MallocAllocator) for b in si.bufs)]))
+      if bucket == 1: self.assertEqual(set(buckets), {1})
+      else: self.assertGreater(max(buckets), 1)
+
 if __name__ == '__main__':
   unittest.main()
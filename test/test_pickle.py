@@ -1,6 +1,7 @@
-import unittest, pickle, types
+import unittest, pickle, types, pathlib, tempfile, struct
+from unittest.mock import patch
 import numpy as np
-from tinygrad import Tensor, TinyJit, Variable, dtypes
+from tinygrad import Tensor, TinyJit, Variable, dtypes, Device
 from tinygrad.helpers import GlobalCounters, ContextVar, Context
 from tinygrad.ops import PatternMatcher, UPat, UOp
 
@@ -166,5 +167,51 @@ class TestPickleJIT(unittest.TestCase):
     # confirm no intermediate buffers are saved
     self.assertLess(len(self.st), 1_000_000)
 
+class TestSaveJIT(unittest.TestCase):
+  def setUp(self):
+    self.fn = pathlib.Path(tempfile.mkdtemp()) / "model.jit"
+    Tensor.manual_seed(0)
+    self.w, self.b = Tensor.randn(64, 64).realize(), Tensor.randn(64).realize()
+    @TinyJit
+    def f(x:Tensor) -> Tensor: return layer(layer(x).contiguous()).realize()
+    def layer(x:Tensor) -> Tensor: return (x @ self.w + self.b).relu()
+    self.x = [Tensor.randn(4, 64).realize() for _ in range(4)]
+    self.ref = [f(x).numpy() for x in self.x]
+    f.save(self.fn)
+
+  def _header(self):
+    with open(self.fn, "rb") as f:
+      self.assertEqual(f.read(8), b"TINYJIT1")
+      header_len, data_start = struct.unpack("<QQ", f.read(16))
+      return pickle.loads(f.read(header_len)), data_start
+
+  def test_round_trip(self):
+    f = TinyJit.load(self.fn)
+    for x,ref in zip(self.x, self.ref): np.testing.assert_allclose(f(x).numpy(), ref, atol=1e-4, rtol=1e-4)
+    # the weights are copies, changing them doesn't change the loaded jit
+    self.w.assign(Tensor.zeros(64, 64)).realize()
+    np.testing.assert_allclose(f(self.x[0]).numpy(), self.ref[0], atol=1e-4, rtol=1e-4)
+
+  def test_no_compile(self):
+    with patch.object(Device[Device.DEFAULT].compiler, "compile", side_effect=AssertionError("compiled")), Context(JIT=2):
+      f = TinyJit.load(self.fn)
+      np.testing.assert_allclose(f(self.x[0]).numpy(), self.ref[0], atol=1e-4, rtol=1e-4)
+
+  def test_layout(self):
+    (libs, runners, layout), data_start = self._header()
+    # both layers are the same kernel, it's saved once
+    self.assertEqual(len(libs), 1)
+    self.assertEqual(len(runners), 1)
+    self.assertEqual(data_start % 64, 0)
+    saved = [l for l in layout if l[-1] is not None]
+    self.assertTrue(all(off % 64 == 0 for *_,off in saved))
+    # the weights and the bias are in the data, not in the pickle
+    self.assertGreaterEqual(sum(size*dtype.itemsize for _,size,dtype,*_ in saved), 64*64*4 + 64*4)
+    self.assertLess(data_start, 64*64*4)
+
+  def test_not_a_jit(self):
+    self.fn.write_bytes(b"NOTAJIT!" + b"\0"*64)
+    with self.assertRaises(ValueError): TinyJit.load(self.fn)
+
 if __name__ == '__main__':
   unittest.main()
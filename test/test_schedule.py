@@ -6,6 +6,7 @@
 import unittest
 import numpy as np
 import functools
+from unittest.mock import patch
 from typing import List, Optional, Union, cast
 
 from tinygrad import nn, dtypes, Device, Tensor
@@ -16,7 +17,7 @@ from tinygrad.shape.view import View
 from tinygrad.ops import PatternMatcher, UOp, Ops, UPat, graph_rewrite, track_rewrites, symbolic_simple, merge_views
 from tinygrad.spec import type_verify, shape_spec
 from tinygrad.helpers import CI, DEBUG, FUSE_ARANGE, SPLIT_REDUCEOP, GlobalCounters, Context, getenv, unwrap, prod, all_same, temp
-from tinygrad.engine.schedule import ScheduleItem, create_schedule_with_vars, view_right, view_left, remove_movement_ops, sym
+from tinygrad.engine.schedule import ScheduleItem, create_schedule_with_vars, view_right, view_left, remove_movement_ops, sym, schedule_cache
 from tinygrad.engine.realize import CompiledRunner, run_schedule, lower_schedule
 from extra.models.llama import precompute_freqs_cis
 
@@ -2520,5 +2521,51 @@ class TestUOpBecome(unittest.TestCase):
     check_schedule(const_add, 0)
     assert UPat(Ops.CONST, arg=3).match(const_add.lazydata.base, {})
 
+class TestScheduleCache(unittest.TestCase):
+  def setUp(self):
+    schedule_cache.clear()
+    self.ctx = Context(SCHEDULE_CACHE=1)
+    self.ctx.__enter__()
+  def tearDown(self): self.ctx.__exit__(None, None, None)
+
+  def test_hit_rebinds_buffers(self):
+    w = Tensor.arange(16).reshape(4, 4).float().realize()
+    xs = [Tensor.full((2, 4), i).contiguous().realize() for i in range(3)]
+    def f(x): return ((x @ w).relu() + 1).sum(axis=1)
+    self.assertEqual(f(xs[0]).tolist(), [4., 4.])
+    cnt = len(schedule_cache)
+    with patch("tinygrad.engine.schedule.create_schedule_with_vars", side_effect=AssertionError("schedule cache miss")):
+      self.assertEqual(f(xs[1]).tolist(), [124., 124.])
+      self.assertEqual(f(xs[2]).tolist(), [244., 244.])
+    self.assertEqual(len(schedule_cache), cnt)
+
+  def test_hit_assign(self):
+    a, b = Tensor.zeros(4).contiguous().realize(), Tensor.ones(4).contiguous().realize()
+    for _ in range(3):
+      a.assign(a + b).realize()
+      b.assign(b * 2).realize()
+    self.assertEqual(a.tolist(), [7.]*4)
+    self.assertEqual(b.tolist(), [8.]*4)
+
+  def test_miss_on_structure(self):
+    a = Tensor.ones(4).contiguous().realize()
+    (a + 1).realize()
+    cnt = len(schedule_cache)
+    self.assertEqual((a + 2).tolist(), [3.]*4)
+    self.assertEqual(((a + 1) * 2).tolist(), [4.]*4)
+    self.assertGreater(len(schedule_cache), cnt)
+
+  def test_miss_on_context(self):
+    a = Tensor.ones(4).contiguous().realize()
+    (a + 1).realize()
+    cnt = len(schedule_cache)
+    with Context(OVERLAP=1): (a + 1).realize()
+    self.assertGreater(len(schedule_cache), cnt)
+
+  def test_aliased_inputs(self):
+    a, b = Tensor.ones(4).contiguous().realize(), Tensor.full((4,), 2.).contiguous().realize()
+    self.assertEqual((a + b).tolist(), [3.]*4)
+    self.assertEqual((a + a).tolist(), [2.]*4)
+
 if __name__ == '__main__':
   unittest.main(verbosity=2)
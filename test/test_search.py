@@ -1,14 +1,16 @@
-import unittest
+import unittest, random, math, tempfile
+from unittest.mock import patch
 
 from test.helpers import ast_const
 from tinygrad.codegen.kernel import Opt, OptOps
 from tinygrad.codegen.kernel import Kernel
 from tinygrad.ops import UOp, Ops
-from tinygrad.engine.search import time_linearizer, bufs_from_lin, actions, beam_search
+from tinygrad.engine import search
+from tinygrad.engine.search import time_linearizer, bufs_from_lin, actions, beam_search, LinearCostModel
 from tinygrad.device import Device, Buffer
 from tinygrad.tensor import Tensor
 from tinygrad.dtype import dtypes
-from tinygrad.helpers import Context, GlobalCounters
+from tinygrad.helpers import Context, GlobalCounters, diskcache_get
 from tinygrad.engine.realize import capturing
 from tinygrad.shape.shapetracker import ShapeTracker
 from tinygrad.shape.view import View
@@ -155,5 +157,92 @@ class TestBEAM(unittest.TestCase):
     beam_search(lin, bufs, 3, disable_cache=True)
     self.assertEqual(kcount, len(Kernel.kernel_cnt))
 
+  def test_cpu_devices_compile_before_timing(self):
+    # the candidates would be timed on the cores the workers compile on
+    si = (Tensor.empty(33, 31)@Tensor.empty(31, 17)+random.random()).schedule()[-1]
+    lin = Kernel(si.ast)
+    bufs = bufs_from_lin(lin)
+    events = []
+    class Pool:
+      def imap_unordered(self, fn, it): return (events.append("compile") or fn(x) for x in it)
+    with patch.object(search, "_get_beam_pool", lambda device: Pool()), patch.object(search, "_host", lambda device: True), \
+         patch.object(search, "_time_program", lambda *args, **kwargs: events.append("time") or [1e-3]*3):
+      beam_search(lin, bufs, 1, disable_cache=True)
+    first_round = events[:events.index("compile", events.index("time"))]
+    self.assertGreater(first_round.count("time"), 1)
+    self.assertEqual(first_round, sorted(first_round))
+
+  def test_beam_checkpoints_full_timings(self):
+    si = (Tensor.empty(33, 31)@Tensor.empty(31, 17)+random.random()).schedule()[-1]
+    lin = Kernel(si.ast)
+    bufs = bufs_from_lin(lin)
+    tms = iter([[1e-3]*3, [1e-3], [math.inf]*3])
+    def _time_program(*args, **kwargs):
+      if (tm:=next(tms, None)) is None: raise RuntimeError("failed")
+      return tm
+    with patch.object(search, "_time_program", _time_program):
+      beam_search(lin, bufs, 1, disable_cache=False)
+    # only the first candidate was timed in full, cut short, inf and failed timings can be different next time
+    acted = search.get_kernel_actions(lin, include_0=False).values()
+    timings = [diskcache_get("beam_timing", search._beam_timing_key(k, True)) for k in acted]
+    self.assertEqual(sum(x is not None for x in timings), 1)
+    self.assertEqual([x[2] for x in timings if x is not None], [1e-3])
+
+  def test_beam_resumes_from_checkpoint(self):
+    # a new constant every run, so nothing is in the cache yet
+    si = (Tensor.empty(33, 31)@Tensor.empty(31, 17)+random.random()).schedule()[-1]
+    lin = Kernel(si.ast)
+    bufs = bufs_from_lin(lin)
+    time_program, timed, resumed = search._time_program, [], []
+    def _time_program(p, *args, **kwargs):
+      if len(timed) == 5: raise KeyboardInterrupt
+      timed.append(p.src)
+      return time_program(p, *args, **kwargs)
+    with patch.object(search, "_time_program", _time_program):
+      with self.assertRaises(KeyboardInterrupt): beam_search(lin, bufs, 2, disable_cache=False)
+    with patch.object(search, "_time_program", lambda p, *args, **kwargs: resumed.append(p.src) or time_program(p, *args, **kwargs)):
+      beam_search(lin, bufs, 2, disable_cache=False)
+    # the candidates that were timed before the interrupt are not timed again
+    self.assertEqual(len(timed), 5)
+    self.assertGreater(len(resumed), 0)
+    self.assertFalse(set(timed) & set(resumed))
+
+class TestCostModel(unittest.TestCase):
+  def test_fit_recovers_ranking(self):
+    rng = random.Random(0)
+    w = [rng.uniform(-1, 1) for _ in range(5)]
+    # every kernel has its own offset, only the ranking within a kernel is learned
+    samples = {}
+    for k in range(10):
+      feats = [[rng.uniform(0, 10) for _ in range(5)] for _ in range(20)]
+      samples[bytes([k])] = [(f, 2**(k+sum(wi*fi for wi,fi in zip(w, f)))) for f in feats]
+    mdl = LinearCostModel.fit(samples, l2=1e-6)
+    for wi,mi in zip(w, mdl.weights): self.assertAlmostEqual(wi, mi, places=3)
+    for rows in samples.values():
+      self.assertEqual(sorted(range(20), key=lambda i: rows[i][1]), sorted(range(20), key=lambda i: mdl.predict(rows[i][0])))
+
+  def test_save_load(self):
+    mdl = LinearCostModel([1.0, -2.5, math.pi])
+    with tempfile.NamedTemporaryFile(suffix=".json") as f:
+      mdl.save(f.name)
+      self.assertEqual(LinearCostModel.load(f.name).weights, mdl.weights)
+
+  def test_beam_compiles_topk(self):
+    si = (Tensor.empty(33, 31)@Tensor.empty(31, 17)+random.random()).schedule()[-1]
+    lin = Kernel(si.ast)
+    bufs = bufs_from_lin(lin)
+    timed, actions_cnt = [], []
+    time_program, get_kernel_actions = search._time_program, search.get_kernel_actions
+    def _get_kernel_actions(*args, **kwargs):
+      actions_cnt.append(len(ret:=get_kernel_actions(*args, **kwargs)))
+      return ret
+    with patch.object(search, "cost_model", LinearCostModel([0.0]*15)), patch.object(search, "BEAM_TOPK", 3), \
+         patch.object(search, "get_kernel_actions", _get_kernel_actions), \
+         patch.object(search, "_time_program", lambda p, *args, **kwargs: timed.append(p) or time_program(p, *args, **kwargs)):
+      beam_search(lin, bufs, 1, disable_cache=True)
+    # one beam, so every step only compiles and times 3 of its candidates
+    self.assertGreater(max(actions_cnt), 3)
+    self.assertLessEqual(len(timed), 3*len(actions_cnt))
+
 if __name__ == '__main__':
   unittest.main()
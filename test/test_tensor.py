@@ -1,7 +1,8 @@
 import subprocess
 import numpy as np
 import torch
-import unittest, copy, mmap, random, math, array
+import unittest, copy, mmap, random, math, array, threading
+from unittest.mock import patch
 from tinygrad import Tensor, Device, dtypes
 from tinygrad.helpers import getenv, temp, _METADATA, mv_address
 from extra.gradcheck import numerical_jacobian, jacobian, gradcheck
@@ -786,6 +787,54 @@ class TestTensorMetadata(unittest.TestCase):
     self.assertEqual(len(bw), 1)
     self.assertEqual(bw[0].name, "sigmoid")
 
+class TestRealizeAsync(unittest.TestCase):
+  def test_realize_async(self):
+    a = Tensor.arange(8).float()
+    fut = (b:=a*2+1).realize_async()
+    fut.result()
+    self.assertEqual(b.tolist(), [x*2+1. for x in range(8)])
+
+  def test_chain(self):
+    w = Tensor.ones(4, 4).contiguous().realize()
+    x, futs = Tensor.ones(2, 4).contiguous().realize(), []
+    for _ in range(5):
+      x = (x @ w).contiguous()
+      futs.append(x.realize_async())
+    # data waits for the last schedule without waiting on the futures
+    self.assertEqual(x.tolist(), [[1024.]*4]*2)
+    self.assertTrue(all(f.done() for f in futs))
+
+  def test_write_after_async_read(self):
+    a = Tensor.ones(4).contiguous().realize()
+    (b:=(a+1)).realize_async()
+    a.assign(Tensor.full((4,), 5.)).realize()
+    self.assertEqual(b.tolist(), [2.]*4)
+    self.assertEqual(a.tolist(), [5.]*4)
+
+  def test_realize_on_worker_while_pending(self):
+    from tinygrad.engine import realize
+    threads, started, release = [], threading.Event(), threading.Event()
+    def lower_schedule(schedule):
+      threads.append(threading.current_thread().name)
+      # the first schedule holds the worker, so the second realize comes while it's pending
+      if len(threads) == 1: started.set(), release.wait(5)
+      return lower_schedule_orig(schedule)
+    lower_schedule_orig = realize.lower_schedule
+    with patch("tinygrad.engine.realize.lower_schedule", lower_schedule):
+      fut = (Tensor.ones(4).contiguous()+2).realize_async()
+      started.wait(5)
+      threading.Timer(0.1, release.set).start()
+      (b:=Tensor.ones(4).contiguous()*3).realize()
+      fut.result()
+    self.assertEqual(len(threads), 2)
+    self.assertTrue(all(t.startswith("realize") for t in threads), threads)
+    self.assertEqual(b.tolist(), [3.]*4)
+
+  def test_exception(self):
+    with patch("tinygrad.engine.realize.lower_schedule", side_effect=RuntimeError("lower failed")):
+      fut = (Tensor.ones(4).contiguous()+2).realize_async()
+      with self.assertRaises(RuntimeError): fut.result()
+
 class TestIdxUpcast(unittest.TestCase):
   def _find_op(self, ast: UOp, op: Ops):
     if ast.op is op: return ast
@@ -0,0 +1,81 @@
+import unittest, random, tempfile, os, math, subprocess, sys, pathlib
+from tinygrad import Tensor, Device
+from tinygrad.codegen.kernel import Kernel, Opt, OptOps
+from tinygrad.engine import tuning
+from tinygrad.engine.tuning import TuningEntry, merge, save, load, from_cache, to_cache
+from tinygrad.engine.search import beam_search, bufs_from_lin
+from tinygrad.engine.realize import get_kernel, program_cache_key
+from tinygrad.helpers import Context
+
+def _entry(ast="ab"*32, opts=(Opt(OptOps.UPCAST, 0, 4),), tm=1e-3, device="CLANG", amt=2):
+  return TuningEntry(ast, device, "", amt, True, tuple(opts), tm)
+
+class TestTuningDB(unittest.TestCase):
+  def setUp(self):
+    self.fn = tempfile.NamedTemporaryFile(suffix=".json", delete=False).name
+    tuning._tuning_db.cache_clear()
+  def tearDown(self): os.unlink(self.fn)
+
+  def test_save_load(self):
+    db = {(e:=_entry(opts=(Opt(OptOps.TC, 0, (-1, 2)), Opt(OptOps.LOCAL, 1, 8)))).key:e, (e2:=_entry(ast="cd"*32, tm=math.inf)).key:e2}
+    save(self.fn, db)
+    self.assertEqual(load(self.fn), db)
+
+  def test_merge_keeps_fastest(self):
+    slow, fast, other = _entry(tm=2e-3), _entry(opts=(Opt(OptOps.LOCAL, 0, 16),), tm=1e-3), _entry(ast="cd"*32)
+    merged = merge({slow.key:slow, other.key:other}, {fast.key:fast})
+    self.assertEqual(merged, {fast.key:fast, other.key:other})
+    self.assertEqual(merge({fast.key:fast}, {slow.key:slow}), {fast.key:fast})
+
+  def test_export_import(self):
+    si = (Tensor.empty(33, 31)@Tensor.empty(31, 17)+random.random()).schedule()[-1]
+    lin = Kernel(si.ast)
+    best = beam_search(lin, bufs_from_lin(lin), 2)
+    exported = {k:e for k,e in from_cache().items() if e.ast == si.ast.key.hex()}
+    self.assertEqual(len(exported), 1)
+    self.assertEqual(list(exported.values())[0].opts, tuple(best.applied_opts))
+    # a slower entry doesn't replace the local one, a faster one does
+    e = list(exported.values())[0]
+    self.assertEqual(to_cache({e.key:TuningEntry(e.ast, e.device, e.suffix, e.amt, e.allow_test_size, (), e.tm*2)}), 0)
+    self.assertEqual(to_cache({e.key:TuningEntry(e.ast, e.device, e.suffix, e.amt, e.allow_test_size, (), e.tm/2)}), 1)
+    self.assertEqual(beam_search(lin, bufs_from_lin(lin), 2).applied_opts, [])
+
+  def test_get_kernel_uses_tuning_db(self):
+    si = (Tensor.empty(64, 64)+random.random()).schedule()[-1]
+    opts = (Opt(OptOps.UPCAST, 0, 16),)
+    save(self.fn, {(e:=_entry(ast=si.ast.key.hex(), opts=opts, device=Device.DEFAULT)).key:e})
+    with Context(TUNING_DB=self.fn):
+      self.assertEqual(get_kernel(Device[Device.DEFAULT].renderer, si.ast).applied_opts, list(opts))
+    # opts that don't apply are ignored
+    tuning._tuning_db.cache_clear()
+    save(self.fn, {(e:=_entry(ast=si.ast.key.hex(), opts=(Opt(OptOps.UPCAST, 0, 7),), device=Device.DEFAULT)).key:e})
+    with Context(TUNING_DB=self.fn):
+      self.assertNotEqual(get_kernel(Device[Device.DEFAULT].renderer, si.ast).applied_opts, [Opt(OptOps.UPCAST, 0, 7)])
+
+  def test_program_cache_key(self):
+    si = (Tensor.empty(64, 64)+random.random()).schedule()[-1]
+    save(self.fn, {(e:=_entry(ast=si.ast.key.hex(), opts=(Opt(OptOps.UPCAST, 0, 16),), device=Device.DEFAULT)).key:e})
+    with Context(PROGRAM_CACHE=1, CACHELEVEL=2):
+      if (key:=program_cache_key(Device.DEFAULT, si.ast)) is None: self.skipTest("device has no program cache")
+      with Context(TUNING_DB=self.fn): self.assertNotEqual(program_cache_key(Device.DEFAULT, si.ast), key)
+
+  def test_cli(self):
+    save(a:=self.fn, {(e:=_entry(tm=2e-3)).key:e, (e2:=_entry(ast="cd"*32, device="GPU")).key:e2})
+    save(b:=self.fn+".b", {(e3:=_entry(tm=1e-3, opts=())).key:e3})
+    root = pathlib.Path(__file__).parents[1]
+    def cli(*args):
+      return subprocess.check_output([sys.executable, root/"extra"/"optimization"/"tuning_db.py", *args], text=True,
+                                     env={**os.environ, "PYTHONPATH": str(root)})
+    try:
+      cli("merge", out:=self.fn+".out", a, b)
+      self.assertEqual(load(out), {e3.key:e3, e2.key:e2})
+      self.assertEqual(len(cli("diff", a, out).splitlines()), 2)
+      self.assertEqual(len(cli("list", out).splitlines()), 2)
+      cli("prune", out, "--device", "GPU")
+      self.assertEqual(load(out), {e3.key:e3})
+    finally:
+      for fn in [b, out]:
+        if os.path.exists(fn): os.unlink(fn)
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,75 @@
+import unittest, io, socket, queue, threading, contextlib
+import numpy as np
+from tinygrad import Tensor, Device, dtypes
+from tinygrad.device import BufferSpec
+from tinygrad.runtime.ops_cloud import BatchRequest, BufferAlloc, CopyIn, CopyOut, ProgramAlloc, ProgramExec, pack, unpack, cloud_address, CloudDevice
+
+def roundtrip(x): return unpack(io.BufferedReader(io.BytesIO(b"".join(pack(x, [])))))
+
+class TestCloudFraming(unittest.TestCase):
+  def test_values(self):
+    for x in [None, True, False, 0, -3, 1<<40, 1.5, "", "E_3", (), (1, (2, None), "x")]: self.assertEqual(roundtrip(x), x)
+
+  def test_requests(self):
+    for x in [BufferAlloc(1, 12, BufferSpec(cpu_access=True)), BufferAlloc(2, 64, BufferSpec(image=dtypes.imagef((2, 4)))), CopyOut(3),
+              ProgramExec("E_3", "ab", (2, 1), (4,), (1, 1, 1), None, False)]:
+      self.assertEqual(roundtrip(x), x)
+    self.assertEqual(bytes(roundtrip(CopyIn(1, b"\0\1"*100)).data), b"\0\1"*100)
+
+  def test_payload_not_copied(self):
+    lib = b"void E_3() {}"
+    self.assertTrue(any(x is lib for x in pack(ProgramAlloc("E_3", "ab", lib), [])))
+
+  def test_batch(self):
+    req = BatchRequest()
+    for x in (reqs:=[BufferAlloc(1, 4, BufferSpec()), CopyIn(1, b"abcd"), CopyOut(1)]): req.q(x)
+    self.assertEqual(req.nbytes, 4)
+    self.assertEqual(list(BatchRequest.deserialize(io.BufferedReader(io.BytesIO(b"".join(req.serialize()))))), reqs)
+
+  def test_rejects(self):
+    with self.assertRaises(TypeError): pack(Tensor, [])
+    with self.assertRaises(ValueError): unpack(io.BufferedReader(io.BytesIO(b"X")))
+    with self.assertRaises(ConnectionError): unpack(io.BufferedReader(io.BytesIO(b"b"+(100).to_bytes(8, "little"))))
+
+class TestCloudConnection(unittest.TestCase):
+  def test_address(self):
+    self.assertEqual(cloud_address("127.0.0.1:6667"), ("127.0.0.1", 6667))
+    self.assertEqual(cloud_address("example.com"), ("example.com", 80))
+    self.assertEqual(cloud_address("[::1]:6667"), ("::1", 6667))
+    self.assertEqual(cloud_address("[::1]"), ("::1", 80))
+    with self.assertRaises(ValueError): cloud_address("host:port")
+
+  def test_timeout_reconnects(self):
+    # a CloudDevice talking to a listening socket, without the renderer request of __init__
+    server = socket.create_server(("127.0.0.1", 0))
+    dev = object.__new__(CloudDevice)
+    dev.host, dev.session, dev.inflight, dev.last, dev.lock = f"127.0.0.1:{server.getsockname()[1]}", "", queue.Queue(), None, threading.Lock()
+    dev._connect().settimeout(0.2)
+    conn, _ = server.accept()
+    threading.Thread(target=dev._recv, daemon=True).start()
+    a, b = dev.send("GET", "renderer"), dev.send("GET", "renderer")
+    with self.assertRaises(TimeoutError): a.result(timeout=5)
+    # the late response to the first request isn't taken as the response to the second
+    with contextlib.suppress(OSError): conn.sendall(b"HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\nok")
+    with self.assertRaises(ConnectionError): b.result(timeout=5)
+    # the next request opens a new connection
+    c = dev.send("GET", "renderer")
+    conn2, _ = server.accept()
+    conn2.sendall(b"HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\nok")
+    self.assertEqual(c.result(timeout=5), b"ok")
+    for s in (conn, conn2, server): s.close()
+
+@unittest.skipUnless(Device.DEFAULT == "CLOUD", "needs a cloud server")
+class TestCloud(unittest.TestCase):
+  def test_big_copyin(self):
+    # it's bigger than CLOUD_BATCH_BYTES, so it's sent before the copyout
+    a = Tensor(np.arange(1<<23, dtype=np.int32)).realize()
+    self.assertEqual((a[::4096] + 1).tolist(), list(range(1, 1<<23, 4096)))
+
+  def test_synchronize(self):
+    (Tensor.ones(16).contiguous() + 1).realize()
+    Device[Device.DEFAULT].synchronize()
+    self.assertTrue(Device[Device.DEFAULT].last.done())
+
+if __name__ == '__main__':
+  unittest.main()
@@ -1,9 +1,9 @@
 #!/usr/bin/env python
 import unittest
 from unittest.mock import patch
-import os
+import os, ctypes
 from tinygrad import Tensor
-from tinygrad.device import Device, Compiler
+from tinygrad.device import Device, Compiler, LRUAllocator, BufferSpec, size_class, _MallocAllocator
 from tinygrad.helpers import diskcache_get, diskcache_put, getenv
 
 class TestDevice(unittest.TestCase):
@@ -49,5 +49,114 @@ class TestCompiler(unittest.TestCase):
       a = Tensor([0.,1.], device=Device.DEFAULT).realize()
       (a + 1).realize()
 
+class MockAllocator(LRUAllocator):
+  def __init__(self, *args):
+    self.live: dict[int, int] = {}
+    super().__init__(*args)
+  def _alloc(self, size, options):
+    self.live[id(ret:=bytearray(size))] = size
+    return ret
+  def _free(self, opaque, options): del self.live[id(opaque)]
+
+class TestLRUAllocator(unittest.TestCase):
+  def test_size_class(self):
+    self.assertEqual([size_class(x, 1) for x in [1, 4, 5, 100, 1024]], [1, 4, 8, 128, 1024])
+    self.assertEqual([size_class(x, 8) for x in [1, 7, 100, 1000, 1024]], [1, 7, 104, 1024, 1024])
+
+  def test_exact_by_default(self):
+    a = MockAllocator(0, 0)
+    a.free(buf:=a.alloc(100), 100)
+    self.assertIsNot(a.alloc(101), buf)
+    self.assertIs(a.alloc(100), buf)
+    self.assertEqual(a.stats, {"hit_bytes": 100, "miss_bytes": 201, "evict_bytes": 0})
+
+  def test_size_steps_reuse(self):
+    a = MockAllocator(8, 0)
+    self.assertEqual(len(buf:=a.alloc(100)), 104)
+    a.free(buf, 100)
+    self.assertIs(a.alloc(98), buf)
+    a.free(buf, 98)
+    # best fit from the next size class, but never twice the size
+    self.assertIs(a.alloc(90), buf)
+    a.free(buf, 90)
+    self.assertIsNot(a.alloc(50), buf)
+    self.assertEqual(a.cached_bytes, 104)
+
+  def test_miss_adds_no_keys(self):
+    a = MockAllocator(8, 0)
+    a.free(a.alloc(100), 100)
+    for sz in range(200, 300): a.alloc(sz)
+    self.assertEqual(list(a.cache), [(104, None)])
+    a.alloc(100)
+    self.assertEqual(list(a.cache), [])
+
+  def test_size_steps_skip_nolru(self):
+    a = MockAllocator(8, 0)
+    self.assertEqual(len(a.alloc(100, BufferSpec(nolru=True))), 100)
+
+  def test_max_cached_evicts_lru(self):
+    a = MockAllocator(0, 250)
+    bufs = [a.alloc(100) for _ in range(3)]
+    for b in bufs: a.free(b, 100)
+    self.assertEqual(a.cached_bytes, 200)
+    self.assertEqual(a.stats["evict_bytes"], 100)
+    self.assertEqual(set(a.live), {id(b) for b in bufs[1:]})
+    self.assertIs(a.alloc(100), bufs[2])
+    a.free_cache()
+    self.assertEqual((a.cached_bytes, len(a.lru)), (0, 0))
+    self.assertEqual(list(a.live), [id(bufs[2])])
+
+  def test_views_keep_size(self):
+    a = _MallocAllocator(8, 0)
+    a._copyin(buf:=a.alloc(100), memoryview(bytearray(range(100))))
+    self.assertEqual(bytes(a._as_buffer(buf)), bytes(range(100)))
+    a.free(buf, 100)
+    self.assertEqual(list(a.cache), [(104, None)])
+    a.free_cache()
+
+class TestMallocArena(unittest.TestCase):
+  def test_alloc_in_arena(self):
+    a = _MallocAllocator(arena_size=1 << 20)
+    bufs = [a.alloc(sz) for sz in [100, 1000, 64, 3]]
+    self.assertEqual(len(a.arenas), 1)
+    for b,sz in zip(bufs, [100, 1000, 64, 3]):
+      self.assertEqual((ctypes.addressof(b) % 64, ctypes.sizeof(b)), (0, sz))
+      a._copyin(b, memoryview(bytearray([sz % 256] * sz)))
+    for b,sz in zip(bufs, [100, 1000, 64, 3]): self.assertEqual(bytes(a._as_buffer(b)), bytes([sz % 256] * sz))
+
+  def test_free_reuses_arena(self):
+    a = _MallocAllocator(arena_size=1 << 20)
+    addr = ctypes.addressof(buf:=a.alloc(4096, BufferSpec(nolru=True)))
+    a.free(buf, 4096, BufferSpec(nolru=True))
+    self.assertEqual(ctypes.addressof(a.alloc(4096, BufferSpec(nolru=True))), addr)
+
+  def test_big_alloc_new_arena(self):
+    a = _MallocAllocator(arena_size=1 << 20)
+    a.alloc(1000)
+    self.assertEqual(ctypes.sizeof(a.alloc(3 << 20)), 3 << 20)
+    self.assertEqual(len(a.arenas), 2)
+
+  def test_free_cache_unmaps_empty_arenas(self):
+    a = _MallocAllocator(arena_size=1 << 20)
+    keep = a.alloc(100)
+    a.free(a.alloc(1000), 1000)
+    a.free(a.alloc(3 << 20), 3 << 20)
+    self.assertEqual(len(a.arenas), 2)
+    a.free_cache()
+    self.assertEqual(len(a.arenas), 1)
+    a.free(keep, 100)
+    a.free_cache()
+    self.assertEqual(len(a.arenas), 0)
+
+  def test_big_arena_unmapped_on_free(self):
+    a = _MallocAllocator(arena_size=1 << 20)
+    a.free(a.alloc(3 << 20, BufferSpec(nolru=True)), 3 << 20, BufferSpec(nolru=True))
+    self.assertEqual(len(a.arenas), 0)
+
+  def test_hugepage(self):
+    a = _MallocAllocator(arena_size=4 << 20, hugepage=True)
+    a.alloc(100)
+    self.assertEqual(ctypes.addressof(a.alloc(2 << 20)) % (2 << 20), 0)
+
 if __name__ == "__main__":
   unittest.main()
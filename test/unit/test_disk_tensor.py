@@ -1,10 +1,14 @@
-import pathlib, tempfile, unittest
+import pathlib, tempfile, unittest, json, builtins, os, ctypes, mmap
+from unittest.mock import patch
 import numpy as np
 from tinygrad import Tensor, Device, dtypes
 from tinygrad.dtype import DType
-from tinygrad.nn.state import safe_load, safe_save, get_state_dict, torch_load
-from tinygrad.helpers import Timing, fetch, temp, CI
-from tinygrad.device import is_dtype_supported
+from tinygrad.nn.state import safe_load, safe_save, get_state_dict, torch_load, safe_load_into, TensorIO
+from tinygrad.helpers import Timing, Context, GlobalCounters, fetch, temp, CI
+from tinygrad.device import Buffer, is_dtype_supported
+from tinygrad.engine.realize import ExecItem, BufferMap, lower_schedule
+from tinygrad.runtime import ops_disk
+from tinygrad.runtime.ops_disk import DiskReader, DiskDevice, DiskAllocator, DISK_SEG_SIZE
 
 def compare_weights_both(url):
   import torch
@@ -33,6 +37,37 @@ class TestTorchLoad(unittest.TestCase):
   # pytorch tar format
   def test_load_resnet(self): compare_weights_both('https://download.pytorch.org/models/resnet50-19c8e357.pth')
 
+class TestTorchLoadLocal(unittest.TestCase):
+  def setUp(self):
+    import torch
+    torch.manual_seed(0)
+    self.state_dict = {"a": torch.randn(16, 8), "t": torch.randn(8, 16).T, "p": torch.randn(2, 3, 4).permute(2, 0, 1), "i": torch.arange(10),
+                       "u": torch.randn(1, 5, 1).permute(2, 1, 0), "s": torch.randn(20)[3:13]}
+
+  def _test(self, fn, t=None):
+    out = torch_load(t if t is not None else fn)
+    self.assertEqual(list(out.keys()), list(self.state_dict.keys()))
+    for k,v in self.state_dict.items():
+      self.assertEqual(out[k].device, f"DISK:{pathlib.Path(fn).resolve()}")
+      np.testing.assert_equal(out[k].numpy(), v.numpy(), err_msg=k)
+      np.testing.assert_equal(out[k].to(Device.DEFAULT).numpy(), v.numpy(), err_msg=k)
+
+  def test_zip(self):
+    import torch
+    torch.save(self.state_dict, fn:=temp("local.pth"))
+    with patch.object(TensorIO, "readinto", side_effect=AssertionError("a file must be read without TensorIO")): self._test(fn)
+
+  def test_legacy(self):
+    import torch
+    torch.save(self.state_dict, fn:=temp("local_legacy.pth"), _use_new_zipfile_serialization=False)
+    self._test(fn)
+
+  def test_tensor_io(self):
+    import torch
+    torch.save(self.state_dict, fn:=temp("local_io.pth"))
+    # a view of the file is read through TensorIO
+    self._test(fn, Tensor(pathlib.Path(fn))[0:])
+
 test_fn = pathlib.Path(__file__).parents[2] / "weights/LLaMA/7B/consolidated.00.pth"
 #test_size = test_fn.stat().st_size
 test_size = 1024*1024*1024*2
@@ -208,6 +243,163 @@ class TestSafetensors(unittest.TestCase):
       assert v.numpy().dtype == tensors[k].dtype
       np.testing.assert_allclose(v.numpy(), tensors[k])
 
+class TestSafeLoadInto(unittest.TestCase):
+  def _model(self, **shapes):
+    class Model: pass
+    m = Model()
+    for k,(shape,dtype) in shapes.items(): setattr(m, k, Tensor.zeros(*shape, dtype=dtype).contiguous().realize())
+    return m
+
+  def test_load_into(self):
+    tensors = {"a": Tensor.rand(16, 16), "b": Tensor.arange(17, dtype=dtypes.uint8), "c": Tensor.arange(15, dtype=dtypes.int16).reshape(3, 5)}
+    safe_save(tensors, fn:=temp("load_into.safetensors"))
+    m = self._model(a=((16, 16), dtypes.float), b=((17,), dtypes.uint8), c=((3, 5), dtypes.int16))
+    safe_load_into(m, fn, verbose=False)
+    for k,v in tensors.items():
+      self.assertEqual(getattr(m, k).dtype, v.dtype)
+      np.testing.assert_equal(getattr(m, k).numpy(), v.numpy())
+
+  def test_coalesced_reads(self):
+    tensors = {f"w{i}": Tensor.full((64,), i, dtype=dtypes.int32) for i in range(10)}
+    safe_save(tensors, fn:=temp("load_into_coalesce.safetensors"))
+    # 3 tensors in each read, the last read has one
+    for read_size,workers in [(64*4*3, 1), (64*4*3, 2), (1, 4), (1<<20, 8)]:
+      m = self._model(**{k:((64,), dtypes.int32) for k in tensors})
+      safe_load_into(m, fn, verbose=False, read_size=read_size, workers=workers)
+      for k,v in tensors.items(): np.testing.assert_equal(getattr(m, k).numpy(), v.numpy())
+
+  def test_staging_copy(self):
+    # devices that can't be read into directly go through host memory
+    tensors = {f"w{i}": Tensor.full((64,), i, dtype=dtypes.int32) for i in range(10)}
+    safe_save(tensors, fn:=temp("load_into_staging.safetensors"))
+    m = self._model(**{k:((64,), dtypes.int32) for k in tensors})
+    with patch("tinygrad.nn.state.hasattr", lambda o,n: n != "_as_buffer" and builtins.hasattr(o, n), create=True):
+      safe_load_into(m, fn, verbose=False, read_size=64*4*3)
+    for k,v in tensors.items(): np.testing.assert_equal(getattr(m, k).numpy(), v.numpy())
+
+  def test_sharded_index(self):
+    tensors = {"a": Tensor.rand(4, 4), "b": Tensor.rand(8), "c": Tensor.rand(2, 3)}
+    safe_save({"a": tensors["a"], "c": tensors["c"]}, temp("load_into-00001.safetensors"))
+    safe_save({"b": tensors["b"]}, temp("load_into-00002.safetensors"))
+    weight_map = {"a": "load_into-00001.safetensors", "b": "load_into-00002.safetensors", "c": "load_into-00001.safetensors"}
+    pathlib.Path(fn:=temp("load_into.safetensors.index.json")).write_text(json.dumps({"weight_map": weight_map}))
+    m = self._model(a=((4, 4), dtypes.float), b=((8,), dtypes.float), c=((2, 3), dtypes.float))
+    safe_load_into(m, fn, verbose=False)
+    for k,v in tensors.items(): np.testing.assert_equal(getattr(m, k).numpy(), v.numpy())
+
+  def test_errors(self):
+    safe_save({"a": Tensor.rand(4, 4)}, fn:=temp("load_into_errors.safetensors"))
+    with self.assertRaises(ValueError): safe_load_into(self._model(a=((4, 5), dtypes.float)), fn, verbose=False)
+    with self.assertRaises(KeyError): safe_load_into(self._model(a=((4, 4), dtypes.float), b=((1,), dtypes.float)), fn, verbose=False)
+    safe_load_into(m:=self._model(a=((4, 4), dtypes.float), b=((1,), dtypes.float)), fn, strict=False, verbose=False)
+    np.testing.assert_equal(m.b.numpy(), [0])
+
+  def test_multi_device(self):
+    safe_save({"a": (a:=Tensor.rand(4, 8))}, fn:=temp("load_into_multi.safetensors"))
+    m = self._model(a=((4, 8), dtypes.float))
+    m.a = m.a.shard((f"{Device.DEFAULT}:0", f"{Device.DEFAULT}:1"), axis=1).realize()
+    devices = m.a.device
+    safe_load_into(m, fn, verbose=False)
+    self.assertEqual(m.a.device, devices)
+    self.assertEqual(m.a.lazydata.axis, 1)
+    np.testing.assert_equal(m.a.numpy(), a.numpy())
+
+class TestDiskReader(unittest.TestCase):
+  @classmethod
+  def setUpClass(cls):
+    cls.data = np.random.randint(0, 255, size=(1<<20)+123, dtype=np.uint8)
+    cls.fn = temp("disk_reader.bin")
+    cls.data.tofile(cls.fn)
+    # io_uring is set up with the first DiskDevice
+    Device[f"disk:{cls.fn}"]
+    if not hasattr(DiskDevice, "io_uring"): raise unittest.SkipTest("DiskReader needs io_uring")
+  def tearDown(self): DiskReader._reader = None
+
+  def _read(self, st:int, en:int, seg_len:int=DISK_SEG_SIZE) -> np.ndarray:
+    t = Tensor.empty(len(self.data), dtype=dtypes.uint8, device=f"disk:{self.fn}")[st:en]
+    src = t.contiguous().realize().lazydata.base.buffer.ensure_allocated()
+    self.assertEqual((src._buf.offset, src.nbytes), (st, en-st))
+    src.allocator._copyout_batched(dest:=memoryview(bytearray(en-st)), src._buf, seg_len)
+    return np.frombuffer(dest, dtype=np.uint8)
+
+  def test_unaligned_reads(self):
+    for depth in [1, 3, 16]:
+      DiskReader._reader = DiskReader(depth)
+      for seg_len in [4096, 3*4096, DISK_SEG_SIZE]:
+        for st,en in [(0, len(self.data)), (1, len(self.data)-1), (4095, 4097+100000), (5000, 5001), (8192, 8192+4096)]:
+          np.testing.assert_equal(self._read(st, en, seg_len), self.data[st:en])
+
+  def test_short_reads(self):
+    # a read can return less than asked for, the rest is read again. O_DIRECT needs the reads to be aligned
+    complete = DiskReader._complete
+    with patch.object(DiskReader, "_complete", lambda self, rid, res: complete(self, rid, min(res, 4096))):
+      DiskReader._reader = DiskReader(4)
+      np.testing.assert_equal(self._read(10, 300000), self.data[10:300000])
+
+  def test_copyout_batched_only_when_not_cached(self):
+    t = Tensor.empty(len(self.data), dtype=dtypes.uint8, device=f"disk:{self.fn}")
+    src = t.lazydata.buffer.ensure_allocated()
+    def copyout():
+      src.allocator._copyout(dest:=memoryview(bytearray(src.nbytes)), src._buf)
+      np.testing.assert_equal(np.frombuffer(dest, dtype=np.uint8), self.data)
+    with patch.object(ops_disk, "DISK_SEG_SIZE", 4096), patch.object(DiskAllocator, "_copyout_batched", side_effect=AssertionError("batched")):
+      # by default and for a file in the page cache, the copy is a memcpy from the mmap
+      copyout()
+      with patch.object(ops_disk, "DISK_BATCHED_COPYOUT", 1): copyout()
+      def drop_cache():
+        src.allocator.dev.mem.madvise(mmap.MADV_DONTNEED)
+        os.posix_fadvise(src.allocator.dev.fd, 0, 0, os.POSIX_FADV_DONTNEED)
+        if src.allocator._cached(src._buf) >= 0.5: self.skipTest("the file can't be dropped from the page cache")
+      drop_cache()
+      copyout()
+      # the memcpy brought the file back to the page cache
+      drop_cache()
+      with patch.object(ops_disk, "DISK_BATCHED_COPYOUT", 1), self.assertRaisesRegex(AssertionError, "batched"): copyout()
+
+@unittest.skipUnless(Device.DEFAULT in ["CLANG", "LLVM"], "the CPU devices run on the mapped file")
+class TestDiskMmap(unittest.TestCase):
+  def setUp(self):
+    self.data = np.arange(1 << 16, dtype=np.float32)
+    self.data.tofile(fn:=temp("disk_mmap.bin"))
+    self.t = Tensor.empty(len(self.data), dtype=dtypes.float32, device=f"disk:{fn}")
+
+  def _to(self, t:Tensor) -> tuple[Tensor, ExecItem]:
+    with Context(DISK_MMAP=1):
+      ei = list(lower_schedule((out:=t.to(Device.DEFAULT)).schedule()))[-1]
+      ei.run()
+    return out, ei
+
+  def test_mapped(self):
+    out, ei = self._to(self.t[1024:4096])
+    self.assertIsInstance(ei.prg, BufferMap)
+    buf = out.lazydata.base.buffer
+    self.assertEqual(buf.options.external_ptr, ctypes.addressof(buf._buf))
+    if os.path.exists("/proc/self/maps"): self.assertIn(temp("disk_mmap.bin"), pathlib.Path("/proc/self/maps").read_text())
+    np.testing.assert_equal((out+1).numpy(), self.data[1024:4096]+1)
+
+  def test_copy_on_write(self):
+    out, _ = self._to(self.t[:4096])
+    out.assign(out*2).realize()
+    np.testing.assert_equal(out.numpy(), self.data[:4096]*2)
+    np.testing.assert_equal(self.t[:4096].numpy(), self.data[:4096])
+
+  def test_numpy_keeps_mapping(self):
+    mem_used = GlobalCounters.mem_used
+    with Context(DISK_MMAP=1): np.testing.assert_equal(self.t.numpy(), self.data)
+    self.assertEqual(GlobalCounters.mem_used, mem_used)
+
+  def test_unaligned_copies(self):
+    out, ei = self._to(self.t[1:4096])
+    self.assertNotIsInstance(ei.prg, BufferMap)
+    np.testing.assert_equal(out.numpy(), self.data[1:4096])
+
+  def test_replaced_dest_copies(self):
+    out, ei = self._to(self.t[:4096])
+    ei.bufs[0] = Buffer(Device.DEFAULT, 4096, dtypes.float32).allocate()
+    ei.run()
+    np.testing.assert_equal(np.frombuffer(ei.bufs[0].as_buffer(), dtype=np.float32), self.data[:4096])
+    self.assertIsNot(ei.bufs[0]._buf, out.lazydata.base.buffer._buf)
+
 def helper_test_disk_tensor(fn, data, np_fxn, tinygrad_fxn=None):
   if tinygrad_fxn is None: tinygrad_fxn = np_fxn
   pathlib.Path(temp(fn)).unlink(missing_ok=True)
@@ -0,0 +1,137 @@
+# the dequantization of the quantized ggml types against numpy ports of ggml's dequantize_row_*, and gguf_load of a small written gguf file
+import unittest, struct, tempfile
+import numpy as np
+from tinygrad import Tensor, dtypes, Device
+from tinygrad.ops import Ops
+from tinygrad.device import is_dtype_supported
+from tinygrad.nn.state import ggml_data_to_tensor, gguf_load, load_state_dict
+
+def _f16(b) -> float: return float(np.frombuffer(bytes(b), dtype=np.float16)[0])
+def _i8(x:int) -> int: return x - 256 if x > 127 else x
+
+def deq_q4_0(blk):
+  d, qs = _f16(blk[0:2]), blk[2:18]
+  return [d*((q & 0xF) - 8) for q in qs] + [d*((q >> 4) - 8) for q in qs]
+
+def deq_q4_1(blk):
+  d, m, qs = _f16(blk[0:2]), _f16(blk[2:4]), blk[4:20]
+  return [d*(q & 0xF) + m for q in qs] + [d*(q >> 4) + m for q in qs]
+
+def deq_q8_0(blk): return [_f16(blk[0:2])*_i8(q) for q in blk[2:34]]
+
+def deq_q2_k(blk):
+  sc, qs, d, dmin, y = blk[:16], blk[16:80], _f16(blk[80:82]), _f16(blk[82:84]), []
+  for n in range(2):
+    for j in range(4):
+      for h in range(2):
+        s = sc[n*8+j*2+h]
+        y += [d*(s & 0xF)*((qs[n*32+h*16+l] >> (2*j)) & 3) - dmin*(s >> 4) for l in range(16)]
+  return y
+
+def deq_q3_k(blk):
+  hm, qs, sc, d, y = blk[:32], blk[32:96], blk[96:108], _f16(blk[108:110]), []
+  scales = [_i8(((sc[i%8] >> (4*(i//8))) & 0xF) | (((sc[8+i%4] >> (2*(i//4))) & 3) << 4)) - 32 for i in range(16)]
+  for n in range(2):
+    for j in range(4):
+      for h in range(2):
+        m, dl = 1 << (n*4+j), d*scales[n*8+j*2+h]
+        y += [dl*(((qs[n*32+h*16+l] >> (2*j)) & 3) - (0 if hm[h*16+l] & m else 4)) for l in range(16)]
+  return y
+
+def _scale_min_k4(j, q):
+  if j < 4: return q[j] & 63, q[j+4] & 63
+  return (q[j+4] & 0xF) | ((q[j-4] >> 6) << 4), (q[j+4] >> 4) | ((q[j] >> 6) << 4)
+
+def deq_q45_k(blk, q5=False):
+  d, dmin, sc, qh, qs, y = _f16(blk[0:2]), _f16(blk[2:4]), blk[4:16], blk[16:48], blk[-128:], []
+  for c in range(4):
+    for h in range(2):
+      s, m = _scale_min_k4(2*c+h, sc)
+      y += [d*s*(((qs[c*32+l] >> (4*h)) & 0xF) + (16 if q5 and qh[l] & (1 << (2*c+h)) else 0)) - dmin*m for l in range(32)]
+  return y
+
+def deq_q6_k(blk):
+  ql, qh, sc, d, y = blk[0:128], blk[128:192], [_i8(x) for x in blk[192:208]], _f16(blk[208:210]), [0.0]*256
+  for n in range(2):
+    for l in range(32):
+      L, H, S = ql[n*64:], qh[n*32:], sc[n*8+l//16:]
+      for k in range(4): y[n*128+l+k*32] = d*S[k*2]*((((L[l+(k%2)*32] >> (4*(k//2))) & 0xF) | (((H[l] >> (2*k)) & 3) << 4)) - 32)
+  return y
+
+# ggml type to (reference, number of elements, number of bytes, offsets of the float16s of a block)
+quants = {2: (deq_q4_0, 32, 18, [0]), 3: (deq_q4_1, 32, 20, [0, 2]), 8: (deq_q8_0, 32, 34, [0]), 10: (deq_q2_k, 256, 84, [80, 82]),
+          11: (deq_q3_k, 256, 110, [108]), 12: (deq_q45_k, 256, 144, [0, 2]), 13: (lambda b: deq_q45_k(b, True), 256, 176, [0, 2]),
+          14: (deq_q6_k, 256, 210, [208])}
+
+def random_blocks(typ:int, nblocks:int, rng:np.random.Generator) -> tuple[np.ndarray, np.ndarray]:
+  fxn, _, nbytes, f16_offsets = quants[typ]
+  data = rng.integers(0, 256, size=(nblocks, nbytes), dtype=np.uint8)
+  for o in f16_offsets: data[:, o:o+2] = rng.uniform(-1, 1, size=(nblocks, 1)).astype(np.float16).view(np.uint8)
+  return data.flatten(), np.array([v for b in data for v in fxn([int(x) for x in b])], dtype=np.float32)
+
+def write_gguf(fn:str, tensors:dict[str, tuple[tuple[int, ...], int, bytes]], kv:dict[str, int], alignment=32):
+  def s(x:str) -> bytes: return struct.pack("<Q", len(x)) + x.encode()
+  header, data = b"GGUF" + struct.pack("<iqq", 3, len(tensors), len(kv)), b""
+  for k,v in kv.items(): header += s(k) + struct.pack("<iI", 4, v)
+  for name,(dims,typ,raw) in tensors.items():
+    data += b"\0" * (-len(data) % alignment)
+    header += s(name) + struct.pack("<I", len(dims)) + b"".join(struct.pack("<Q", d) for d in dims) + struct.pack("<iQ", typ, len(data))
+    data += raw
+  with open(fn, "wb") as f: f.write(header + b"\0" * (-len(header) % alignment) + data)
+
+@unittest.skipUnless(is_dtype_supported(dtypes.half), "need half")
+class TestGGUFQuants(unittest.TestCase):
+  def _test_dequantization(self, typ:int):
+    data, want = random_blocks(typ, 3, np.random.default_rng(typ))
+    got = ggml_data_to_tensor(Tensor(data), len(want), typ).flatten().numpy()
+    np.testing.assert_allclose(got, want, rtol=1e-6, atol=1e-6)
+  def test_dequantization_q4_0(self): self._test_dequantization(2)
+  def test_dequantization_q4_1(self): self._test_dequantization(3)
+  def test_dequantization_q8_0(self): self._test_dequantization(8)
+  def test_dequantization_q2_k(self): self._test_dequantization(10)
+  def test_dequantization_q3_k(self): self._test_dequantization(11)
+  def test_dequantization_q4_k(self): self._test_dequantization(12)
+  def test_dequantization_q5_k(self): self._test_dequantization(13)
+  def test_dequantization_q6_k(self): self._test_dequantization(14)
+
+  def test_dequantization_fuses(self):
+    for typ in quants:
+      with self.subTest(typ=typ):
+        w = ggml_data_to_tensor(Tensor(random_blocks(typ, 8, np.random.default_rng(typ))[0]), 8*quants[typ][1], typ).reshape(4, -1)
+        out = Tensor.ones(1, w.shape[1]) @ w.T
+        out.realize()
+        # once the constants are realized, the dequantization is in the kernel of the matmul
+        self.assertEqual(len([si for si in (Tensor.ones(1, w.shape[1]) @ w.T).schedule() if si.ast.op is Ops.SINK]), 1)
+
+  def test_gguf_load(self):
+    rng = np.random.default_rng(0)
+    q4k, q4k_want = random_blocks(12, 2, rng)
+    f32 = rng.standard_normal((3, 5)).astype(np.float32)
+    with tempfile.NamedTemporaryFile() as f:
+      write_gguf(f.name, {"f32": ((5, 3), 0, f32.tobytes()), "q4_k": ((256, 2), 12, q4k.tobytes())}, {"general.alignment": 64}, alignment=64)
+      for quantized in [False, True]:
+        kv, sd = gguf_load(f.name, quantized=quantized)
+        self.assertEqual(kv, {"general.alignment": 64})
+        self.assertEqual(sd["f32"].device, Device.DEFAULT if quantized else f"DISK:{f.name}")
+        np.testing.assert_equal(sd["f32"].numpy(), f32)
+        np.testing.assert_allclose(sd["q4_k"].numpy(), q4k_want.reshape(2, 256), rtol=1e-6, atol=1e-6)
+
+  def test_gguf_load_unsupported_type(self):
+    with tempfile.NamedTemporaryFile() as f:
+      write_gguf(f.name, {"bad": ((32,), 1337, b"\0"*32)}, {})
+      with self.assertRaises(ValueError): gguf_load(f.name)
+
+  def test_load_state_dict_quantized(self):
+    class Model:
+      def __init__(self): self.w = Tensor.empty(2, 256)
+    data, want = random_blocks(14, 2, np.random.default_rng(1))
+    with tempfile.NamedTemporaryFile() as f:
+      write_gguf(f.name, {"w": ((256, 2), 14, data.tobytes())}, {})
+      m = Model()
+      load_state_dict(m, gguf_load(f.name, quantized=True)[1], realize=False)
+      # the weight is still the dequantization of the realized bytes
+      self.assertIsNot(m.w.lazydata.base.op, Ops.BUFFER)
+      np.testing.assert_allclose(m.w.numpy(), want.reshape(2, 256), rtol=1e-6, atol=1e-6)
+
+if __name__ == '__main__':
+  unittest.main()
@@ -1,7 +1,7 @@
-import unittest, math
+import unittest, math, gc
 from tinygrad import dtypes
-from tinygrad.helpers import all_same
-from tinygrad.ops import GroupOp, UOp, Ops, exec_alu
+from tinygrad.helpers import all_same, Context
+from tinygrad.ops import GroupOp, UOp, Ops, exec_alu, PatternMatcher, UPat, symbolic
 from tinygrad.codegen.rewriter import full_graph_rewrite, mulacc_unrolled
 
 # Helper function to apply the graph rewrite
@@ -310,5 +310,49 @@ class TestMulaccUnrolledAcc(unittest.TestCase):
     expected = acc.assign(acc + a[0]*3.0 + a[1]*4.0 + a[2]*5.0 + a[3]*6.0)
     self.assertIs(expr_with_mulacc, expected)
 
+rewrite_calls = []
+def count_rewrite(x:UOp):
+  rewrite_calls.append(x)
+  return x.src[0] if x.src[1].arg == 0 else None
+memo_pm = PatternMatcher([(UPat(Ops.ADD, src=(UPat(), UPat(Ops.CONST)), name="x"), count_rewrite)], memoize=True)
+
+class TestRewriteMemo(unittest.TestCase):
+  def setUp(self):
+    rewrite_calls.clear()
+    for m in memo_pm.memo: m.cache.clear()
+
+  def test_shared_across_calls(self):
+    a = UOp.variable("a", 0, 10)
+    self.assertIs(graph_rewrite(a+0, memo_pm), a)
+    self.assertIs(graph_rewrite((a+0)*2, memo_pm), a*2)
+    self.assertIs(graph_rewrite(a+1, memo_pm), a+1)
+    self.assertIs(graph_rewrite(a+1, memo_pm), a+1)
+    self.assertEqual(len(rewrite_calls), 2)
+
+  def test_ctx_not_memoized(self):
+    a = UOp.variable("a", 0, 10)
+    for _ in range(2): self.assertIs(graph_rewrite(a+0, memo_pm, ctx={}), a)
+    self.assertEqual(len(rewrite_calls), 2)
+
+  def test_weak_and_bounded(self):
+    a = UOp.variable("a", 0, 10)
+    x = a+3
+    graph_rewrite(x, memo_pm)
+    self.assertIn(x, memo_pm.memo[0].cache)
+    rewrite_calls.clear()
+    del x
+    gc.collect()
+    self.assertNotIn(a+3, memo_pm.memo[0].cache)
+    with Context(REWRITE_CACHE_SIZE=2):
+      for i in range(4): graph_rewrite(a+i, memo_pm)
+      self.assertLessEqual(len(memo_pm.memo[0].cache), 2)
+
+  def test_symbolic_memoized(self):
+    self.assertIsNotNone(symbolic.memo)
+    a = UOp.variable("a", 0, 10)
+    x = (a*4+8)//4
+    self.assertIs(x.simplify(), a+2)
+    self.assertIs(symbolic.memo[0].get(x), a+2)
+
 if __name__ == '__main__':
   unittest.main()
@@ -0,0 +1,53 @@
+import unittest
+from tinygrad import Tensor, Device, dtypes
+from tinygrad.device import Buffer
+from tinygrad.engine.memory import _pack_offsets, _internal_memory_planner
+
+class TestPackOffsets(unittest.TestCase):
+  def test_disjoint_lifetimes_share(self):
+    offsets, size = _pack_offsets([(0, 1, 1000), (2, 3, 1000), (4, 5, 500)])
+    self.assertEqual((offsets, size), ([0, 0, 0], 1000))
+
+  def test_overlapping_lifetimes(self):
+    offsets, size = _pack_offsets([(0, 2, 1000), (1, 3, 1000)])
+    self.assertEqual((offsets, size), ([0, 1024], 2024))
+
+  def test_best_fit_gap(self):
+    # 0 and 2 leave a 512 byte gap at 1024 while 3 is alive, the small buffer goes there and not at the end
+    offsets, _ = _pack_offsets([(0, 9, 1000), (0, 1, 500), (0, 9, 1000), (2, 9, 300)])
+    self.assertEqual(offsets[3], offsets[1])
+
+  def test_no_overlap(self):
+    reqs = [(i % 7, i % 7 + i % 3, 64 * (i % 5 + 1)) for i in range(40)]
+    offsets, size = _pack_offsets(reqs)
+    for i,(st,en,sz) in enumerate(reqs):
+      self.assertLessEqual(offsets[i] + sz, size)
+      for j,(st2,en2,sz2) in enumerate(reqs[:i]):
+        if st <= en2 and st2 <= en: self.assertTrue(offsets[i] + sz <= offsets[j] or offsets[j] + sz2 <= offsets[i])
+
+@unittest.skipUnless(hasattr(Device[Device.DEFAULT].allocator, "_offset"), "needs views")
+class TestMemoryPlanner(unittest.TestCase):
+  def test_dtype_agnostic_arena(self):
+    # the half buffer can't reuse the float buffer, it takes its place in the arena
+    bufs = [Buffer(Device.DEFAULT, 1024, dtypes.float), Buffer(Device.DEFAULT, 4096, dtypes.int8), Buffer(Device.DEFAULT, 2048, dtypes.half)]
+    assigned = _internal_memory_planner([[bufs[0]], [bufs[0], bufs[1]], [bufs[1], bufs[2]]])
+    self.assertEqual(len(set(assigned[b].base for b in bufs)), 1)
+    self.assertEqual(assigned[bufs[0]].offset, assigned[bufs[2]].offset)
+    self.assertEqual((assigned[bufs[1]].offset, assigned[bufs[0]].base.nbytes), (4096, 8192))
+
+  def test_arena_not_smaller(self):
+    # the buffers of the same size and dtype reuse each other, the aligned arena would be bigger
+    bufs = [Buffer(Device.DEFAULT, 100, dtypes.float) for _ in range(3)]
+    assigned = _internal_memory_planner([[bufs[0], bufs[1]], [bufs[1], bufs[2]]])
+    self.assertTrue(all(assigned[b]._base is None for b in bufs))
+    self.assertIs(assigned[bufs[2]], bufs[0])
+
+  def test_chain(self):
+    def f(x:Tensor) -> Tensor:
+      b = (x @ x).contiguous().cast(dtypes.half).contiguous()
+      return b + (b * 2).contiguous()
+    sched = f(Tensor.empty(64, 64)).schedule()
+    inter = [b for si in sched for b in si.bufs if b._base is not None]
+    self.assertTrue(len(inter) and all(b.base is inter[0].base for b in inter))
+    # b and b*2 take the place of x and x@x, they can't reuse them as buffers
+    self.assertEqual(inter[0].base.nbytes, 2*64*64*4)
@@ -1,7 +1,8 @@
 import unittest, itertools
 from tinygrad.dtype import dtypes
 from tinygrad.ops import Ops, UOp, GroupOp # noqa: F401
-from tinygrad.ops import PatternMatcher, UPat
+from tinygrad.ops import PatternMatcher, UPat, graph_rewrite, symbolic
+from tinygrad.helpers import Context
 
 class TestPatternMatcher(unittest.TestCase):
   def test_simple_match(self):
@@ -193,6 +194,46 @@ class TestPatternMatcher(unittest.TestCase):
     self.assertIsNotNone(matcher.rewrite(u1))
     self.assertIsNotNone(matcher.rewrite(u2))
 
+  def test_first_match_falls_through(self):
+    matcher = PatternMatcher([
+      (UPat(Ops.ADD, src=[UPat(Ops.CONST, name="c"), UPat.var("x")]), lambda c,x: x if c.arg == 0 else None),
+      (UPat(Ops.ADD, name="a"), lambda a: a.src[1]),
+      (UPat(Ops.ADD, src=(UPat(Ops.CONST), UPat(Ops.CONST))), lambda: UOp.const(dtypes.int, 7)),
+    ])
+    c0, c1, v = UOp.const(dtypes.int, 0), UOp.const(dtypes.int, 1), UOp.variable("a", 0, 10)
+    self.assertIs(matcher.rewrite(UOp(Ops.ADD, dtypes.int, (v, c0))), v)
+    self.assertIs(matcher.rewrite(UOp(Ops.ADD, dtypes.int, (c1, c0))), c1)
+    self.assertIs(matcher.rewrite(UOp(Ops.ADD, dtypes.int, (c1, v))), v)
+
+  def test_src_repeat_named(self):
+    matcher = PatternMatcher([(UPat(Ops.VECTORIZE, src=UPat(Ops.GEP, src=(UPat(name="x"),)), name="vec"), lambda vec,x: x)])
+    a, b = UOp(Ops.DEFINE_VAR, dtypes.int.vec(2), arg=("a", 0, 10)), UOp(Ops.DEFINE_VAR, dtypes.int.vec(2), arg=("b", 0, 10))
+    def gep(x, i): return UOp(Ops.GEP, dtypes.int, (x,), (i,))
+    self.assertIs(matcher.rewrite(UOp(Ops.VECTORIZE, a.dtype, (gep(a, 0), gep(a, 1)))), a)
+    self.assertIsNone(matcher.rewrite(UOp(Ops.VECTORIZE, a.dtype, (gep(a, 0), gep(b, 1)))))
+
+  def test_allow_len_named_missing(self):
+    matcher = PatternMatcher([(UPat(Ops.MULACC, src=(UPat.var("a"), UPat.var("b")), allow_any_len=True), lambda a,b: b)])
+    c1, c2 = UOp.const(dtypes.float, 1.0), UOp.const(dtypes.float, 2.0)
+    self.assertIsNone(matcher.rewrite(UOp(Ops.MULACC, dtypes.float, (c1,))))
+    self.assertIs(matcher.rewrite(UOp(Ops.MULACC, dtypes.float, (c1, c2, c1))), c2)
+
+  def test_custom_early_reject(self):
+    matcher = PatternMatcher([(UPat(GroupOp.ALU, name="x", custom_early_reject={Ops.DEFINE_VAR}), lambda x: x.src[0])])
+    c1, v = UOp.const(dtypes.int, 1), UOp.variable("a", 0, 10)
+    self.assertIsNone(matcher.rewrite(c1+c1))
+    self.assertIs(matcher.rewrite(UOp(Ops.ADD, dtypes.int, (c1, v))), c1)
+
+  def test_compiled_matches_interpreted(self):
+    interpreted, compiled = PatternMatcher(symbolic.patterns), PatternMatcher(symbolic.patterns)
+    a, b = UOp.variable("a", 0, 10), UOp.variable("b", -5, 5)
+    for expr in [(a*4+b*4)//4, (a+3)%3, (a*2+1)//2 + a*0, (a<3).where(b, b), (a+b)-(b+a), ((a*6)+(b*3))%3, (a//2)*2+a%2, -(-a), a*1+0]:
+      # UPAT_COMPILE is read when the dispatch entry for an (op, dtype, src ops) is built
+      with Context(UPAT_COMPILE=0): ref = graph_rewrite(expr, interpreted)
+      self.assertIs(graph_rewrite(expr, compiled), ref)
+    self.assertTrue(all(f.__name__ == "interpreted" for f in interpreted.compiled.values()))
+    self.assertTrue(any(f.__name__ == "compiled_match" for f in compiled.compiled.values()))
+
   def _assert_eq_upat(self, a:UPat, b:UPat):
     assert (sorted(map(str,a.op)) if a.op else [] == (sorted(map(str,b.op)) if b.op else []))
     assert (sorted(a.dtype) if a.dtype else [] == (sorted(b.dtype) if b.dtype else []))
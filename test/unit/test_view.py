@@ -1,6 +1,6 @@
 #!/usr/bin/env python
 import unittest
-from tinygrad.shape.view import View, merge_dims
+from tinygrad.shape.view import View, merge_dims, unravel, _merge_extents, _merge_extents_int
 # from tinygrad.shape.shapetracker import ShapeTracker
 
 class TestView(unittest.TestCase):
@@ -223,5 +223,20 @@ class TestMergeViews(unittest.TestCase):
     # TODO: why is this different?
     self.assertIsNone(v)
 
+  def test_merge_int_exact_bounds(self):
+    # the index into vm2 is 143+24*idx0, the all-int merge bounds it exactly where the symbolic one can't
+    v0 = View(shape=(2, 6, 8, 2), strides=(96, -16, -2, -1), offset=95, mask=None, contiguous=False)
+    v1 = View(shape=(3,), strides=(24,), offset=143, mask=None, contiguous=False)
+    self.assertEqual(v0 + v1, View(shape=(3,), strides=(-24,), offset=144, mask=None, contiguous=False))
+
+  def test_merge_extents_int_matches_symbolic(self):
+    for shape1, shape2, offset, strides in [((4, 6), (4, 2, 3), 0, (6, 1)), ((3, 2), (6, 4), 5, (8, 1)), ((2, 2), (4, 4), 0, (5, 2))]:
+      origin = unravel(shape2, offset)
+      terms = [[] for _ in shape2]
+      for d1, st in enumerate(strides):
+        for d2, (o, s1) in enumerate(zip(origin, unravel(shape2, offset + st))):
+          if s1 != o: terms[d2].append((d1, s1 - o))
+      self.assertEqual(_merge_extents_int(shape1, shape2, terms, origin), _merge_extents(shape1, shape2, terms, origin))
+
 if __name__ == '__main__':
   unittest.main()
@@ -571,12 +571,17 @@ class Kernel:
 
   kernel_cnt: Final[defaultdict[str, int]] = defaultdict(int)
   @functools.cached_property
-  def name(self) -> str:
+  def name(self) -> str: return Kernel.unique_name(self.base_name)
+
+  @property
+  def base_name(self) -> str:
     # kernel name (before late upcast)
     kernel_type = "r" if self.reduceop is not None else ("C" if all(x.op is Ops.SINK or x.op in GroupOp.Buffer for x in self.ast.toposort) else "E")
     suffix = colored('_', 'BLACK').join([colored(x.render() if isinstance(x, UOp) else str(x), c) for x,c in zip(self.full_shape, self.colors())])
-    name = kernel_type + (f"{len(self.ast.src)}" if len(self.ast.src) > 1 else "") + "_" + suffix
+    return kernel_type + (f"{len(self.ast.src)}" if len(self.ast.src) > 1 else "") + "_" + suffix
 
+  @staticmethod
+  def unique_name(name:str) -> str:
     # name the function something unique
     Kernel.kernel_cnt[(function_name := to_function_name(name))] += 1
     num = f"n{Kernel.kernel_cnt[function_name]-1}" if Kernel.kernel_cnt[function_name] > 1 else ""
@@ -692,4 +697,4 @@ class Kernel:
       for _, group in itertools.groupby([x for x in self.ast.toposort if x.op in GroupOp.Buffer and x.src[0].op is Ops.DEFINE_GLOBAL],
                         key=lambda x: (x.op, x.src[0].arg)))
     return ProgramSpec(ansiname, src, self.opts.device, self.uops, mem_estimate=mem_bytes,
-                   global_size=[1,1,1] if self.opts.has_local else None, local_size=[1,1,1] if self.opts.has_local else None)
+                   global_size=[1,1,1] if (dims:=self.opts.has_local or self.opts.has_threads) else None, local_size=[1,1,1] if dims else None)
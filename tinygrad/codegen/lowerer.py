@@ -5,7 +5,7 @@ from typing import cast
 from tinygrad.dtype import dtypes, PtrDType
 from tinygrad.ops import KernelInfo, UOp, Ops, graph_rewrite, PatternMatcher, UPat, sint, identity_element, sint_to_uop
 from tinygrad.renderer import Renderer
-from tinygrad.helpers import all_int, prod, partition, flatten, unwrap
+from tinygrad.helpers import all_int, prod, partition, flatten, unwrap, ceildiv, CPU_THREADS
 
 # returns the axes to create new_shape if new_shape can be created by combining axis from old_shape
 def get_contraction(old_shape:tuple[sint, ...], new_shape:tuple[sint, ...]) -> list[list[int]]|None:
@@ -41,6 +41,18 @@ def get_grouped_dims(prefix, dims:tuple[sint, ...], max_sizes:tuple[int, ...]|No
       ret.append(idx)
   return ret[::-1] if reverse else ret
 
+def get_threaded_idx(full_shape:tuple[sint, ...], global_dims:int, threads:int) -> tuple[int, UOp]|None:
+  # too little work to be worth waking up the threads
+  if threads <= 1 or not all_int(full_shape) or prod(full_shape) < 1<<16: return None
+  # thread the first global loop that has enough iterations for all threads, else the biggest
+  if not (axes:=[i for i in range(global_dims) if full_shape[i] > 1]): return None
+  axis = next((i for i in axes if full_shape[i] >= threads), max(axes, key=lambda i: full_shape[i]))
+  # each thread runs a contiguous chunk of the loop, only the last one can be shorter
+  chunk = ceildiv(sz:=full_shape[axis], min(threads, sz))
+  core = UOp(Ops.SPECIAL, dtypes.int, (), ("core0", ceildiv(sz, chunk)))
+  end = sint_to_uop(chunk) if sz % chunk == 0 else (core*-chunk+sz).minimum(chunk)
+  return axis, core*chunk + UOp(Ops.RANGE, dtypes.int, (sint_to_uop(0), end), axis)
+
 @dataclass
 class IndexContext:
   idxs: list[UOp]
@@ -70,6 +82,7 @@ def get_index(ast:UOp, opts:Renderer) -> IndexContext:
   else:
     # all loops are RANGES
     idxs = [UOp(Ops.RANGE, dtypes.int, (sint_to_uop(0), sint_to_uop(g)), i) for i,g in enumerate(full_shape[:first_reduce])]
+    if opts.has_threads and (threaded:=get_threaded_idx(full_shape, global_dims, CPU_THREADS.value)) is not None: idxs[threaded[0]] = threaded[1]
 
   # reduce loops
   idxs += [UOp(Ops.RANGE, dtypes.int, (sint_to_uop(0), sint_to_uop(g)), i)
@@ -1,12 +1,15 @@
 from __future__ import annotations
 from dataclasses import dataclass, replace
-from collections import defaultdict
-from typing import Optional, Any, Iterator, Generator
+from collections import defaultdict, OrderedDict
+from typing import Optional, Any, Iterator, Generator, Callable
 import multiprocessing, importlib, inspect, functools, pathlib, os, ctypes, ctypes.util, platform, contextlib, sys, re, atexit, pickle, decimal, time
+import concurrent.futures, threading
+import mmap
 from tinygrad.helpers import CI, OSX, LRU, getenv, diskcache_get, diskcache_put, DEBUG, GlobalCounters, flat_mv, from_mv, PROFILE, temp, mv_address, \
                              cpu_time_execution, colored, Context, round_up
 from tinygrad.dtype import DType, ImageDType, PtrDType, dtypes
 from tinygrad.renderer import Renderer
+from tinygrad.runtime.support.allocator import TLSFAllocator
 
 # **************** Device ****************
 
@@ -122,7 +125,8 @@ class Buffer:
       self._buf: Any = self.allocator._offset(self.base._buf, self.nbytes, self.offset)
     else:
       self._buf = opaque if opaque is not None else self.allocator.alloc(self.nbytes, self.options)
-      if not self.device.startswith("DISK"): GlobalCounters.mem_used += self.nbytes
+      # like in deallocate, the external memory isn't counted
+      if not self.device.startswith("DISK") and (self.options is None or self.options.external_ptr is None): GlobalCounters.mem_used += self.nbytes
     return self
   def deallocate(self):
     assert self.is_allocated(), "buffer must be allocated to deallocate"
@@ -185,29 +189,119 @@ class Allocator:
   # def _offset(self, buf, size:int, offset:int):
   # def _transfer(self, dest, src, sz:int, src_dev, dest_dev):
 
+def size_class(size:int, steps:int) -> int:
+  # round up to one of `steps` equal steps between two powers of two, steps=1 rounds up to a power of two
+  return round_up(size, max((1 << (size.bit_length()-1)) // steps, 1))
+
 class LRUAllocator(Allocator):
   """
   The LRU Allocator is responsible for caching buffers.
   It ensures that buffers are not freed until it is absolutely necessary, optimizing performance.
+
+  With `size_steps`, sizes are rounded up to a size class and a free buffer of a nearby (less than 2x) size class can be reused.
+  With `max_cached`, the least recently freed buffers are freed once more than `max_cached` bytes are cached.
+  Buffers are freed on the thread that drops them, so alloc, free and free_cache hold a lock.
   """
-  def __init__(self): self.cache: dict[tuple[int, Optional[BufferSpec]], Any] = defaultdict(list)
+  def __init__(self, size_steps:int=getenv("LRU_SIZE_STEPS", 0), max_cached:int=getenv("LRU_MAX_BYTES", 0)):
+    self.size_steps, self.max_cached, self.cached_bytes = size_steps, max_cached, 0
+    self.cache: dict[tuple[int, Optional[BufferSpec]], Any] = defaultdict(list)
+    self.lru: OrderedDict[int, tuple[int, Optional[BufferSpec], Any]] = OrderedDict()  # id(opaque) -> (size, options, opaque), oldest first
+    self.views: dict[int, tuple[Any, int]] = {}  # id(opaque handed out) -> (cached opaque, size of it)
+    self.stats: dict[str, int] = {"hit_bytes": 0, "miss_bytes": 0, "evict_bytes": 0}
+    self.lock = threading.RLock()
   def alloc(self, size:int, options:Optional[BufferSpec]=None):
-    if len(c := self.cache[(size, options)]): return c.pop()
-    try: return super().alloc(size, options)
-    except (RuntimeError, MemoryError):
-      self.free_cache()
-      return super().alloc(size, options)
+    with self.lock:
+      bucketed = self.size_steps > 0 and (options is None or not (options.external_ptr or options.nolru or options.image))
+      if (found:=self._take(alloc_size:=size_class(size, self.size_steps) if bucketed else size, options, bucketed)) is not None:
+        self.stats["hit_bytes"] += size
+        return self._view(*found, size)
+      self.stats["miss_bytes"] += size
+      try: return self._view(super().alloc(alloc_size, options), alloc_size, size)
+      except (RuntimeError, MemoryError):
+        self.free_cache()
+        return self._view(super().alloc(alloc_size, options), alloc_size, size)
+  def _take(self, size:int, options:Optional[BufferSpec], bucketed:bool) -> Optional[tuple[Any, int]]:
+    # best fit: the smallest cached size class that isn't twice as big as the request
+    # misses don't add keys to the cache and emptied size classes are removed, so the scan only sees sizes with cached buffers
+    if (size, options) not in self.cache and bucketed:
+      size = min((sz for (sz,opt) in self.cache if opt == options and size < sz < 2*size), default=size)
+    if (c:=self.cache.get((size, options))) is None: return None
+    del self.lru[id(opaque:=c.pop())]
+    if not c: del self.cache[(size, options)]
+    self.cached_bytes -= size
+    return opaque, size
+  def _view(self, opaque:Any, alloc_size:int, size:int):
+    # a bigger buffer is handed out as a view of the requested size if the allocator can make one
+    if alloc_size == size or not hasattr(self, "_offset"): ret = opaque
+    else: ret = self._offset(opaque, size, 0)
+    if ret is not opaque or alloc_size != size: self.views[id(ret)] = (opaque, alloc_size)
+    return ret
   def free_cache(self):
-    for (sz,options),opaques in self.cache.items():
-      for opaque in opaques: super().free(opaque, sz, options)
-      opaques.clear()
+    with self.lock:
+      for (sz,options),opaques in self.cache.items():
+        for opaque in opaques: super().free(opaque, sz, options)
+      self.cache.clear()
+      self.lru.clear()
+      self.cached_bytes = 0
   def free(self, opaque:Any, size:int, options:Optional[BufferSpec]=None):
-    if LRU and (options is None or not options.nolru): self.cache[(size, options)].append(opaque)
-    else: super().free(opaque, size, options)
+    with self.lock:
+      opaque, size = self.views.pop(id(opaque), (opaque, size))
+      if LRU and (options is None or not options.nolru):
+        self.cache[(size, options)].append(opaque)
+        self.lru[id(opaque)] = (size, options, opaque)
+        self.cached_bytes += size
+        while self.max_cached and self.cached_bytes > self.max_cached: self._evict()
+      else: super().free(opaque, size, options)
+  def _evict(self):
+    _, (sz, options, opaque) = self.lru.popitem(last=False)
+    c = self.cache[(sz, options)]
+    c.pop(next(i for i,x in enumerate(c) if x is opaque))
+    if not c: del self.cache[(sz, options)]
+    self.cached_bytes -= sz
+    self.stats["evict_bytes"] += sz
+    super().free(opaque, sz, options)
+
+HUGEPAGE_SIZE = 2 << 20
 
 class _MallocAllocator(LRUAllocator):
+  """
+  With `arena_size`, buffers are carved out of big mmapped arenas by a TLSFAllocator instead of being separate allocations.
+  With `hugepage`, arenas are huge page aligned and advised with MADV_HUGEPAGE, and buffers of at least a huge page are huge page aligned.
+  Arenas with no buffers left are unmapped in `free_cache`, and an arena made bigger than `arena_size` for one buffer is unmapped when it's freed.
+  """
+  def __init__(self, *args, arena_size:int=getenv("MALLOC_ARENA", 0) << 20, hugepage:bool=bool(getenv("MALLOC_HUGEPAGE", 0)), **kwargs):
+    self.arena_size, self.hugepage = arena_size, hugepage
+    self.arenas: list[tuple[mmap.mmap, Any, int, TLSFAllocator]] = []  # (mmap, arena buffer, address, TLSFAllocator)
+    super().__init__(*args, **kwargs)
   def _alloc(self, size:int, options:BufferSpec):
-    return (ctypes.c_uint8 * size).from_address(options.external_ptr) if options.external_ptr else self._alloc_aligned(size, 16)
+    if options.external_ptr: return (ctypes.c_uint8 * size).from_address(options.external_ptr)
+    return self._alloc_arena(size) if self.arena_size else self._alloc_aligned(size, 16)
+  def _alloc_arena(self, size:int):
+    align = HUGEPAGE_SIZE if self.hugepage and size >= HUGEPAGE_SIZE else 64
+    for _,buf,_,tlsf in self.arenas:
+      with contextlib.suppress(MemoryError): return self._offset(buf, size, tlsf.alloc(size, align))
+    # a new arena, big enough for the TLSF bucket rounding of this request
+    _,buf,_,tlsf = self._map_arena(max(self.arena_size, round_up(size + size // 8 + align, HUGEPAGE_SIZE if self.hugepage else mmap.PAGESIZE)))
+    return self._offset(buf, size, tlsf.alloc(size, align))
+  def _map_arena(self, size:int):
+    pad = HUGEPAGE_SIZE if self.hugepage else 0
+    mem = mmap.mmap(-1, size + pad, mmap.MAP_PRIVATE | mmap.MAP_ANONYMOUS) if hasattr(mmap, "MAP_ANONYMOUS") else mmap.mmap(-1, size + pad)
+    addr = round_up(mv_address(mv:=memoryview(mem)), pad or 1)
+    if self.hugepage and hasattr(mmap, "MADV_HUGEPAGE"): mem.madvise(mmap.MADV_HUGEPAGE)
+    self.arenas.append(ret:=(mem, self._offset(mv, size, addr - mv_address(mv)), addr, TLSFAllocator(size, block_size=64)))
+    return ret
+  def _free(self, opaque, options:BufferSpec):
+    if not self.arena_size or options.external_ptr: return
+    addr = ctypes.addressof(opaque)
+    arena = next(a for a in self.arenas if a[2] <= addr < a[2] + ctypes.sizeof(a[1]))
+    arena[3].free(addr - arena[2])
+    if arena[3].size > self.arena_size and self._arena_empty(arena): self.arenas.remove(arena)
+  def _arena_empty(self, arena) -> bool: return (blk:=arena[3].blocks[0])[0] == arena[3].size and blk[3]
+  def free_cache(self):
+    with self.lock:
+      super().free_cache()
+      # the mapping is released once nothing references the arena, a buffer object that's still alive keeps it mapped
+      self.arenas = [a for a in self.arenas if not self._arena_empty(a)]
   def _alloc_aligned(self, size:int, alignment:int):
     buffer = (ctypes.c_uint8 * (size + alignment))()
     offset = round_up(ctypes.addressof(buffer), alignment) - ctypes.addressof(buffer)
@@ -222,7 +316,20 @@ MallocAllocator = _MallocAllocator()
 # NOTE: MAP_JIT is added to mmap module in python 3.13
 MAP_JIT = 0x0800
 
+# kernels rendered with a "core" SPECIAL take the thread index as their last arg and run one contiguous chunk of the threaded loop.
+# the chunks don't overlap and each output is computed by one thread in the same order as without threads, so the result is deterministic
+cpu_pool: Optional[concurrent.futures.ThreadPoolExecutor] = None
+def cpu_launch(launch:Callable[..., None], threads:int):
+  global cpu_pool
+  if threads == 1: return launch()
+  if cpu_pool is None or cpu_pool._max_workers < threads-1: cpu_pool = concurrent.futures.ThreadPoolExecutor(threads-1, thread_name_prefix="cpu")
+  # ctypes drops the GIL for the call, the calling thread runs core 0
+  futs = [cpu_pool.submit(launch, core_id) for core_id in range(1, threads)]
+  launch(0)
+  for f in futs: f.result()
+
 # CPUProgram is a jit/shellcode program that can be just mmapped and jumped to
+ARM64_OSX = platform.machine() == "arm64" and OSX
 class CPUProgram:
   helper_handle = ctypes.CDLL(ctypes.util.find_library('System' if OSX else 'kernel32' if sys.platform == "win32" else 'gcc_s'))
   def __init__(self, name:str, lib:bytes):
@@ -252,15 +359,18 @@ class CPUProgram:
 
       self.fxn = ctypes.CFUNCTYPE(None)(mv_address(self.mem))
 
-  def __call__(self, *bufs, vals=(), wait=False):
-    args = list(bufs) + list(vals)
-    # NOTE: replace this by --target={host's triple}-elf in clang args once we only support macos sequoia and later.
-    # Apple relaxes abi requirement for stack arguments to always be at least 8 byte aligned on arm64
-    # https://developer.apple.com/documentation/xcode/writing-arm64-code-for-apple-platforms
-    # This hack is required because clang/llvm bug doesn't allow us to just use {host's triple}+'-elf' (relocation failures)
-    # The bug was fixed in https://github.com/llvm/llvm-project/commit/454cc36630296262cdb6360b60f90a64a97f7f1a but was only backported to xcode 16+
-    if platform.machine() == "arm64" and OSX: args = args[:8] + [ctypes.c_int64(a) if isinstance(a, int) else a for a in args[8:]]
-    return cpu_time_execution(lambda: self.fxn(*args), enable=wait)
+  def __call__(self, *bufs, vals=(), global_size=(1,1,1), local_size=(1,1,1), wait=False):
+    if global_size[0] == 1 and not wait and not ARM64_OSX: return self.fxn(*bufs, *vals)
+    def launch(*core_id:int):
+      args = list(bufs) + list(vals) + list(core_id)
+      # NOTE: replace this by --target={host's triple}-elf in clang args once we only support macos sequoia and later.
+      # Apple relaxes abi requirement for stack arguments to always be at least 8 byte aligned on arm64
+      # https://developer.apple.com/documentation/xcode/writing-arm64-code-for-apple-platforms
+      # This hack is required because clang/llvm bug doesn't allow us to just use {host's triple}+'-elf' (relocation failures)
+      # The bug was fixed in https://github.com/llvm/llvm-project/commit/454cc36630296262cdb6360b60f90a64a97f7f1a but was only backported to xcode 16+
+      if ARM64_OSX: args = args[:8] + [ctypes.c_int64(a) if isinstance(a, int) else a for a in args[8:]]
+      self.fxn(*args)
+    return cpu_time_execution(lambda: cpu_launch(launch, global_size[0]), enable=wait)
 
 # **************** for Compiled Devices ****************
 
@@ -1,15 +1,19 @@
-from typing import TypeVar, Generic, Callable, Union, cast, Optional, Any
-import functools, collections
+from __future__ import annotations
+from typing import TypeVar, Generic, Callable, Union, cast, Optional, Any, Sequence
+import functools, collections, pickle, hashlib, io, struct, pathlib
 from tinygrad.tensor import Tensor
-from tinygrad.helpers import flatten, merge_dicts, DEBUG, Context, BEAM, getenv, colored, JIT, dedup, partition, unwrap
+from tinygrad.helpers import flatten, merge_dicts, DEBUG, Context, BEAM, getenv, colored, JIT, dedup, partition, unwrap, round_up, JIT_STATS
+from tinygrad.helpers import GlobalCounters
 from tinygrad.device import Buffer, Compiled, Device
-from tinygrad.dtype import DType
+from tinygrad.dtype import DType, dtypes
 from tinygrad.ops import UOp, Variable, sym_infer, Ops
 from tinygrad.shape.shapetracker import ShapeTracker
-from tinygrad.engine.realize import ExecItem, capturing, ViewOp, BufferCopy, BufferXfer, CompiledRunner, Runner, Estimates
+from tinygrad.engine.realize import ExecItem, capturing, ViewOp, BufferCopy, BufferXfer, CompiledRunner, Runner, Estimates, pending_bufs, wait_buffers
+from tinygrad.engine.realize import map_disk
+from tinygrad.renderer import ProgramSpec
 from tinygrad.engine.memory import _internal_memory_planner
 from tinygrad.nn.state import get_parameters
-from dataclasses import dataclass
+from dataclasses import dataclass, replace
 from weakref import WeakKeyDictionary
 
 class GraphException(Exception): pass
@@ -154,6 +158,7 @@ class CapturedJit(Generic[ReturnType]):
     self._jit_cache: list[ExecItem] = self.jit_cache
     self._input_replace: dict[tuple[int, int], int] = self.input_replace
     self._first_run = True
+    self._replay: Optional[list[tuple[Callable, list, Optional[dict], Optional[ProgramSpec], list[Variable], dict]]] = None
     self._clear_inputs()
 
   def _clear_inputs(self):
@@ -164,6 +169,11 @@ class CapturedJit(Generic[ReturnType]):
     update_depends(depends, self.jit_cache)
     for b in depends:
       if b is not None: b.deallocate()
+    # the arenas of the memory planner are freed once none of their views are allocated
+    views: collections.defaultdict[Buffer, list[Buffer]] = collections.defaultdict(list)
+    for v in dedup(b for ji in self.jit_cache for b in ji.bufs if b is not None and b._base is not None): views[v.base].append(v)
+    for base,vs in views.items():
+      if base.is_allocated() and base.lb_refcount == 0 and not any(v.is_allocated() for v in vs): base.deallocate()
     self.__post_init__()   # reset the graph state
 
   # jit exec
@@ -171,10 +181,10 @@ class CapturedJit(Generic[ReturnType]):
     # assign inputs
     for idx, offset, device, size, dtype in self.extra_view_inputs:
       input_buffers.append(Buffer(device, size, dtype, base=input_buffers[idx], offset=offset).ensure_allocated())
-    for (j,i),input_idx in self._input_replace.items(): self._jit_cache[j].bufs[i] = input_buffers[input_idx]
 
     # Condense the items into a graph executor.
     if self._first_run:
+      for (j,i),input_idx in self._input_replace.items(): self._jit_cache[j].bufs[i] = input_buffers[input_idx]
       # allocate intermediates if freed
       for ji in self.jit_cache:
         for b in ji.bufs:
@@ -186,10 +196,51 @@ class CapturedJit(Generic[ReturnType]):
       self._first_run = False
 
     if DEBUG >= 1 and len(self._jit_cache) >= 10: print(f"jit execs {len(self._jit_cache)} kernels")
-    for ei in self._jit_cache: ei.run(var_vals, jit=True)
-    self._clear_inputs()
+    if DEBUG >= 2 or self._replay is None:
+      # the first run goes through ExecItem.run, it prints the kernels and sets the local sizes that aren't fixed yet
+      for (j,i),input_idx in self._input_replace.items(): self._jit_cache[j].bufs[i] = input_buffers[input_idx]
+      for ei in self._jit_cache: ei.run(var_vals, jit=True, do_update_stats=JIT_STATS >= 1)
+      self._clear_inputs()
+      if DEBUG < 2: self._build_replay()
+      return self.ret
+
+    for lst,i,idx,raw in self._patches: lst[i] = input_buffers[idx]._buf if raw else input_buffers[idx]
+    for fxn,args,kwargs,p,pvars,dims in self._replay:
+      if kwargs is not None: fxn(*args, **kwargs)
+      elif p is None: fxn(args, var_vals)
+      else:
+        if (kwargs:=dims.get(vals:=tuple(var_vals[v] for v in pvars))) is None:
+          if len(dims) >= 4096: dims.clear()
+          kwargs = dims[vals] = _launch_kwargs(p, var_vals)
+        fxn(*args, **kwargs)
+    for lst,i,_,_ in self._patches: lst[i] = None
+    if JIT_STATS:
+      GlobalCounters.kernel_count += len(self._replay)
+      GlobalCounters.global_ops += sym_infer(self._estimates.ops, var_vals)
+      GlobalCounters.global_mem += sym_infer(self._estimates.mem, var_vals)
     return self.ret
 
+  def _build_replay(self):
+    # the replay calls the programs with their arguments made once. a CompiledRunner's are the raw buffers and, if it has no vars, the launch dims.
+    # the other runners (graphs, copies and views) are called with their Buffers. the inputs are patched in before each call and cleared after
+    self._replay, self._patches, self._estimates = [], [], Estimates()
+    inputs = self._input_replace
+    for j,ei in enumerate(self._jit_cache):
+      self._estimates += ei.prg.estimates
+      if isinstance(prg:=ei.prg, CompiledRunner):
+        args: list = [None if (j,i) in inputs else cast(Buffer, b)._buf for i,b in enumerate(ei.bufs)]
+        # the launch dims can use vars the kernel doesn't take
+        pvars = dedup(prg.p.vars + [v for sz in (prg.p.global_size or []) + (prg.p.local_size or []) if isinstance(sz, UOp) for v in sz.vars()])
+        self._replay.append((prg._prg, args, None if pvars else _launch_kwargs(prg.p, {}), prg.p, pvars, {}))
+      else: self._replay.append((prg, args:=list(ei.bufs), None, None, [], {}))
+      self._patches += [(args, i, inputs[(j,i)], isinstance(prg, CompiledRunner)) for i in range(len(ei.bufs)) if (j,i) in inputs]
+    self._estimates = self._estimates.simplify()
+
+def _launch_kwargs(p:ProgramSpec, var_vals:dict[Variable, int]) -> dict[str, Any]:
+  global_size, local_size = p.launch_dims(var_vals)
+  return {**({"global_size": tuple(global_size)} if global_size else {}), **({"local_size": tuple(local_size)} if local_size else {}),
+          "vals": tuple(var_vals[k] for k in p.vars), "wait": False}
+
 def _prepare_jit_inputs(args, kwargs):
   input_tensors: list[tuple[int|str, Tensor]] = [(name,t) for name,t in list(enumerate(args))+sorted(kwargs.items()) if t.__class__ is Tensor]
   names, tensors = [name for name,_ in input_tensors], [t for _,t in input_tensors]
@@ -203,13 +254,31 @@ def _prepare_jit_inputs(args, kwargs):
   st_vars_dtype_device = [(x[0], tuple(sorted(x[1].keys(), key=lambda v: v.expr)), x[2], x[3]) for x in st_varval_dtype_device]
   return input_buffers, var_vals, names, st_vars_dtype_device
 
+JIT_FILE_MAGIC, JIT_FILE_ALIGN = b"TINYJIT1", 64
+
+def _next_bucket(n:int, buckets:Sequence[int]) -> int: return min([b for b in buckets if b >= n], default=n)
+
 class TinyJit(Generic[ReturnType]):
-  def __init__(self, fxn:Optional[Callable[..., ReturnType]], captured:Optional[CapturedJit]=None, prune=False):
+  """
+  Captures the kernels of `fxn` on its second call and replays them on the later calls.
+
+  By default there's one capture and every call must have the inputs of the captured one. With `max_captures`, the inputs (names, shapes,
+  dtypes and devices) pick the capture, a new signature is run and captured like a new TinyJit and the least recently used capture is dropped
+  once there are more than `max_captures`. The kernels are shared by the captures through the `method_cache`.
+
+  With `buckets`, the first axis of the tensor inputs with the size of the first axis of the first tensor input (the batch) is padded with
+  zeros to the next bucket, and the returned tensors with a first axis of that bucket are shrunk back. Every batch up to a bucket then runs
+  the same capture.
+  """
+  def __init__(self, fxn:Optional[Callable[..., ReturnType]], captured:Optional[CapturedJit]=None, prune=False, max_captures=0,
+               buckets:Optional[Sequence[int]]=None):
     assert fxn or captured, "need either a function or a CapturedJit"
     self.fxn = fxn
     self.captured: Optional[CapturedJit] = captured
     self.cnt: int = 2 if self.fxn is None else 0
-    self.prune = prune
+    self.prune, self.max_captures, self.buckets = prune, max_captures, buckets
+    # the cnt and capture of every input signature, in the order of their last use
+    self.captures: collections.OrderedDict[tuple, tuple[int, Optional[CapturedJit]]] = collections.OrderedDict()
 
   def add_buffer(self, b:Buffer) -> Buffer:
     if found:=self._buffer_replace.get(b, None): return found
@@ -227,11 +296,77 @@ class TinyJit(Generic[ReturnType]):
     assert self.fxn is not None, "can't reset without function"
     self.cnt = 0
     self.captured = None
+    self.captures.clear()
 
   def __reduce__(self):
     assert self.captured is not None, "can't pickle an uncaptured JIT"
     return self.__class__, (None, self.captured)
 
+  def save(self, fn:Union[str, pathlib.Path]):
+    """
+    Saves the captured JIT to a file that `TinyJit.load` runs without tracing, scheduling or compiling.
+
+    The compiled programs are stored once per hash of their binary, and the contents of the buffers the JIT doesn't own (weights, state and
+    outputs) are aligned in a data section that's read (or on CLANG/LLVM with DISK_MMAP=1, mapped) from the file.
+    """
+    assert self.captured is not None, "can't save an uncaptured JIT"
+    libs: dict[str, bytes] = {}
+    runners: dict[int, tuple[int, ProgramSpec, Estimates, str]] = {}
+    bufs: dict[Buffer, tuple[int, Optional[memoryview]]] = {}
+    # the inputs are replaced on every call
+    inputs = {self.captured.jit_cache[j].bufs[i] for j,i in self.captured.input_replace}
+    class JitPickler(pickle.Pickler):
+      def persistent_id(self, obj):
+        if isinstance(obj, CompiledRunner):
+          libs[h:=hashlib.sha256(obj.lib).hexdigest()] = obj.lib
+          # the uops are only needed to compile, the estimates made from them are kept
+          return ("runner", runners.setdefault(id(obj), (len(runners), replace(obj.p, uops=None), obj.estimates, h))[0])
+        if isinstance(obj, Buffer) and obj._base is None:
+          if obj not in bufs: bufs[obj] = (len(bufs), obj.as_buffer() if obj.is_allocated() and obj.lb_refcount > 0 and obj not in inputs else None)
+          return ("buffer", bufs[obj][0])
+        return None
+    JitPickler(jit:=io.BytesIO()).dump(self)
+
+    data, offsets = bytearray(), {}
+    for h,lib in libs.items():
+      offsets[h] = (len(data), len(lib))
+      data += lib
+    layout = []
+    for b,(_,mv) in bufs.items():
+      data += b"\0" * (-len(data) % JIT_FILE_ALIGN)
+      options = None if b.options is None else replace(b.options, external_ptr=None)
+      layout.append((b.device, b.size, b.dtype, options, b.lb_refcount, None if mv is None else len(data)))
+      if mv is not None: data += mv
+    header = pickle.dumps((offsets, [(h,p,e) for _,p,e,h in runners.values()], layout)) + jit.getvalue()
+    with open(fn, "wb") as f:
+      f.write(JIT_FILE_MAGIC + struct.pack("<QQ", len(header), data_start:=round_up(16+len(header), JIT_FILE_ALIGN)) + header)
+      f.write(b"\0" * (data_start - f.tell()) + data)
+
+  @staticmethod
+  def load(fn:Union[str, pathlib.Path]) -> TinyJit:
+    """Loads a JIT saved with `TinyJit.save`."""
+    with open(fn, "rb") as f:
+      if f.read(8) != JIT_FILE_MAGIC: raise ValueError(f"{fn} isn't a tinygrad JIT file")
+      header_len, data_start = struct.unpack("<QQ", f.read(16))
+      header = io.BytesIO(f.read(header_len))
+      libs, runners, layout = pickle.load(header)
+      f.seek(data_start)
+      # the libs are at the start of the data
+      lib_data = f.read(max([o+n for o,n in libs.values()], default=0))
+    prgs: list[CompiledRunner] = []
+    for h,p,e in runners:
+      prgs.append(prg:=CompiledRunner(p, precompiled=lib_data[libs[h][0]:libs[h][0]+libs[h][1]]))
+      prg.estimates = e
+    bufs = [Buffer(device, size, dtype, options=options, lb_refcount=refcount) for device,size,dtype,options,refcount,_ in layout]
+    if len(saved:=[(b, off) for b,(*_,off) in zip(bufs, layout) if off is not None]):
+      disk = Buffer(f"DISK:{pathlib.Path(fn).resolve()}", data_start+max(off+b.nbytes for b,off in saved), dtypes.uint8).ensure_allocated()
+      for b,off in saved:
+        src = disk.view(b.size, b.dtype, data_start+off)
+        ExecItem(map_disk(b, src) or BufferCopy(b.nbytes, b.device, src.device), [b, src]).run()
+    class JitUnpickler(pickle.Unpickler):
+      def persistent_load(self, pid): return prgs[pid[1]] if pid[0] == "runner" else bufs[pid[1]]
+    return JitUnpickler(header).load()
+
   # keep legacy code working
   @property
   def jit_cache(self) -> list[ExecItem]: return self.captured._jit_cache if self.captured is not None else []
@@ -240,8 +375,29 @@ class TinyJit(Generic[ReturnType]):
 
   def __get__(self, obj, objtype): return functools.partial(self.__call__, obj) # add support for instance methods
 
+  def _pad(self, args, kwargs) -> tuple[tuple, dict, Optional[tuple[int, int]]]:
+    t = next((x for x in (*args, *kwargs.values()) if isinstance(x, Tensor) and x.ndim), None)
+    if not self.buckets or t is None or not isinstance(n:=t.shape[0], int) or n == (b:=_next_bucket(n, self.buckets)): return args, kwargs, None
+    def pad(x): return x.pad(((0, b-n),)+((None,)*(x.ndim-1))) if isinstance(x, Tensor) and x.ndim and x.shape[0] == n else x
+    return tuple(pad(x) for x in args), {k:pad(v) for k,v in kwargs.items()}, (n, b)
+
   def __call__(self, *args, **kwargs) -> ReturnType:
+    args, kwargs, padded = self._pad(args, kwargs)
     input_buffers, var_vals, names, st_vars_dtype_device = _prepare_jit_inputs(args, kwargs)
+    if not self.max_captures: ret = self._call(args, kwargs, input_buffers, var_vals, names, st_vars_dtype_device)
+    else:
+      self.cnt, self.captured = self.captures.pop(key:=(tuple(names), tuple(st_vars_dtype_device)), (0, None))
+      try: ret = self._call(args, kwargs, input_buffers, var_vals, names, st_vars_dtype_device)
+      finally: self.captures[key] = (self.cnt, self.captured)
+      while len(self.captures) > self.max_captures: self.captures.popitem(last=False)
+    if padded is None: return ret
+    def shrink(x): return x.shrink(((0, padded[0]),)+((None,)*(x.ndim-1))) if isinstance(x, Tensor) and x.ndim and x.shape[0] == padded[1] else x
+    return cast(ReturnType, type(ret)(shrink(x) for x in ret) if isinstance(ret, (tuple, list)) else shrink(ret))
+
+  def _call(self, args, kwargs, input_buffers:list[Buffer], var_vals:dict[Variable, int], names:list[Union[int, str]],
+            st_vars_dtype_device:list[tuple[ShapeTracker, tuple[Variable, ...], DType, str]]) -> ReturnType:
+    # the jitted kernels can write any buffer an async schedule reads
+    if pending_bufs: wait_buffers(list(pending_bufs))
     if not JIT or self.cnt == 0:
       # jit ignore
       assert self.fxn is not None
@@ -278,7 +434,7 @@ class TinyJit(Generic[ReturnType]):
 
       # prune independent kernels (optional)
       if self.prune:
-        depends = set(input_buffers)
+        depends: set[Buffer|None] = set(input_buffers)
         update_depends(depends, jit_cache)
         pruned, onetime = partition(jit_cache,
                                     lambda ei: not isinstance(ei.prg, CompiledRunner) or any(ei.bufs[out] in depends for out in ei.prg.p.outs))
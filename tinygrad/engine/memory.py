@@ -1,46 +1,83 @@
+from typing import cast
 from collections import defaultdict
 from tinygrad.engine.schedule import ScheduleItem
 from tinygrad.device import Device, Buffer
-from tinygrad.helpers import NO_MEMORY_PLANNER, dedup, DEBUG
+from tinygrad.helpers import NO_MEMORY_PLANNER, dedup, DEBUG, round_up
 from tinygrad.ops import Ops
+from tinygrad.dtype import dtypes
 
 # **************** memory planning ****************
 
-def _internal_memory_planner(buffers:list[list[Buffer]|tuple[Buffer, ...]], noopt_buffers=None, debug_prefix="") -> dict[Buffer, Buffer]:
-  if NO_MEMORY_PLANNER: return {}
-  first_appearance, last_appearance = {}, {}
-  for i,u in enumerate(buffers):
-    for buf in u:
-      if buf.is_allocated() or buf.lb_refcount > 0 or (noopt_buffers is not None and buf.base in noopt_buffers): continue
-      if buf.base not in first_appearance: first_appearance[buf.base] = i
-      last_appearance[buf.base] = i
+def _pack_offsets(reqs:list[tuple[int, int, int]], align:int=0x100) -> tuple[list[int], int]:
+  # reqs are (first use, last use, nbytes), returns the offset of each in an arena and the size of the arena.
+  # best-fit decreasing: the biggest buffers are placed first, each in the smallest gap left by the placed buffers it's alive with.
+  offsets, placed = [0]*len(reqs), cast(list[tuple[int, int, int, int]], [])  # placed are (offset, end, first use, last use)
+  for i in sorted(range(len(reqs)), key=lambda i: -reqs[i][2]):
+    st, en, sz = reqs[i]
+    best: tuple[int, int]|None = None
+    gap_st = 0
+    for off,end in sorted((off,end) for off,end,pst,pen in placed if pst <= en and st <= pen):
+      if off - gap_st >= sz and (best is None or off - gap_st < best[1]): best = (gap_st, off - gap_st)
+      gap_st = max(gap_st, round_up(end, align))
+    offsets[i] = best[0] if best is not None else gap_st
+    placed.append((offsets[i], offsets[i]+sz, st, en))
+  return offsets, max((end for _,end,_,_ in placed), default=0)
 
-  # Sort buffers by size in descending order, prioritizing largest buffers for allocation first.
+def _reuse_buffers(buffer_requests:list[tuple[int, int, Buffer]], last:int) -> dict[Buffer, Buffer]:
+  # A buffer can only reuse a buffer of the same size and dtype, the largest buffers are allocated first.
   # Track free segments, each containing (start, stop, and buffer that could be reused on this segment).
   free_segs: dict[tuple, list[tuple[int, int, Buffer]]] = defaultdict(list) # dict[buffer key, tuple[start, end, buffer to reuse on the seg]]
   def find_replace_buffer(buf, st, en):
-    key = (buf.device, buf.dtype, buf.options) + ((buf.nbytes,) if not hasattr(Device[buf.device].allocator, "offset") else tuple())
+    key = (buf.device, buf.dtype, buf.options, buf.nbytes)
 
-    default_buf = (0, len(buffers) - 1, buf) # will return the buffer itself if the replace one is not found.
+    default_buf = (0, last, buf) # will return the buffer itself if the replace one is not found.
     seg_st, seg_en, seg_buf = next((free_segs[key].pop(i) for i,(sst,sen,_) in enumerate(free_segs[key]) if sst <= st and en <= sen), default_buf)
 
     free_segs[key] += [(seg_st, st - 1, seg_buf)] if st - 1 >= seg_st else []
     free_segs[key] += [(en + 1, seg_en, seg_buf)] if seg_en >= en + 1 else []
 
-    return seg_buf if seg_buf.nbytes == buf.nbytes else Buffer(buf.device, buf.size, buf.dtype, base=seg_buf)
+    return seg_buf
+
+  return {buf:find_replace_buffer(buf, st, en) for st, en, buf in sorted(buffer_requests, key=lambda x: -x[2].nbytes)}
+
+def _internal_memory_planner(buffers:list[list[Buffer]|tuple[Buffer, ...]], noopt_buffers=None, debug_prefix="") -> dict[Buffer, Buffer]:
+  if NO_MEMORY_PLANNER: return {}
+  first_appearance, last_appearance = {}, {}
+  for i,u in enumerate(buffers):
+    for buf in u:
+      if buf.is_allocated() or buf.lb_refcount > 0 or (noopt_buffers is not None and buf.base in noopt_buffers): continue
+      if buf.base not in first_appearance: first_appearance[buf.base] = i
+      last_appearance[buf.base] = i
+  # the buffers are keyed by device and options in both plans, so the plan of each device can be picked on its own
+  reused = _reuse_buffers([(first_appearance[buf], last_appearance[buf], buf) for buf in first_appearance], len(buffers) - 1)
 
-  buffer_requests = sorted([(first_appearance[buf], last_appearance[buf], buf) for buf in first_appearance.keys()], key=lambda x: -x[2].nbytes)
-  assigned = {buf:find_replace_buffer(buf, st, en) for st, en, buf in buffer_requests}
+  # Buffers on devices that can make views are packed into one arena per device by offset, whatever their dtype.
+  # The arena is only used if it's smaller than the buffers the reuse of whole buffers allocates.
+  arena_reqs: dict[tuple, list[Buffer]] = defaultdict(list)
+  for buf in first_appearance:
+    if hasattr(Device[buf.device].allocator, "_offset") and (buf.options is None or buf.options.image is None):
+      arena_reqs[(buf.device, buf.options)].append(buf)
+  assigned: dict[Buffer, Buffer] = {}
+  for (device, options),bufs in arena_reqs.items():
+    if len(bufs) < 2: continue
+    offsets, size = _pack_offsets([(first_appearance[buf], last_appearance[buf], buf.nbytes) for buf in bufs])
+    if size >= sum(x.nbytes for x in dedup(reused[buf] for buf in bufs)): continue
+    arena = Buffer(device, size, dtypes.uint8, options=options)
+    assigned.update((buf, Buffer(device, buf.size, buf.dtype, base=arena, offset=off)) for buf,off in zip(bufs, offsets))
+  assigned.update((buf, reused[buf]) for buf in first_appearance if buf not in assigned)
 
   for i,u in enumerate(buffers):
     for buf in u:
       if buf.is_allocated() or buf.lb_refcount > 0 or (noopt_buffers is not None and buf.base in noopt_buffers): continue
-      if buf._base is not None: assigned[buf] = Buffer(buf.device, buf.size, buf.dtype, base=assigned.get(buf.base, buf.base).base, offset=buf.offset)
+      if buf._base is not None:
+        base = assigned.get(buf.base, buf.base)
+        assigned[buf] = Buffer(buf.device, buf.size, buf.dtype, base=base.base, offset=base.offset+buf.offset)
       else: assigned[buf] = assigned.get(buf, buf)
 
-  if DEBUG >= 1 and len(ak:=dedup(x for x in assigned.keys() if x._base is None)) != len(av:=dedup(x for x in assigned.values() if x._base is None)):
+  if DEBUG >= 1 and len(ak:=dedup(x for x in assigned.keys() if x._base is None)) != len(av:=dedup(x.base for x in assigned.values())):
+    live = [sum(buf.nbytes for buf in first_appearance if first_appearance[buf] <= i <= last_appearance[buf]) for i in range(len(buffers))]
     print(debug_prefix+f"memory reduced from {sum([x.nbytes for x in ak])/1e6:.2f} MB -> {sum([x.nbytes for x in av])/1e6:.2f} MB,",
-          f"{len(ak)} -> {len(av)} bufs")
+          f"{len(ak)} -> {len(av)} bufs, peak live {max(live, default=0)/1e6:.2f} MB")
   return assigned
 
 def memory_planner(schedule:list[ScheduleItem]) -> list[ScheduleItem]:
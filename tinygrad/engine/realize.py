@@ -1,11 +1,14 @@
-from typing import Optional, cast, Generator
-import time, pprint
+from typing import Optional, cast, Generator, Any
+import time, pprint, ctypes, functools, hashlib, inspect, pathlib, pickle, multiprocessing, threading, concurrent.futures
 from dataclasses import dataclass, replace
-from tinygrad.helpers import all_same, colored, getenv, DEBUG, GlobalCounters, ansilen, BEAM, NOOPT, all_int, CAPTURING, Metadata, TRACEMETA
+from tinygrad.helpers import all_same, colored, getenv, DEBUG, GlobalCounters, ansilen, BEAM, NOOPT, all_int, CAPTURING, Metadata, TRACEMETA, dedup
+from tinygrad.helpers import CACHELEVEL, PROGRAM_CACHE, CAPTURE_PROCESS_REPLAY, USE_TC, TC_OPT, TC_SELECT, AMX, IMAGE, TRANSCENDENTAL
+from tinygrad.helpers import Context, ContextVar, PARALLEL_LOWER, CPU_THREADS, DISK_MMAP, OVERLAP, diskcache_get, diskcache_put
 from tinygrad.ops import Ops, PatternMatcher, UOp, UPat, Variable, sym_infer
-from tinygrad.device import Device, Buffer
+from tinygrad.device import Device, Buffer, Compiler, _MallocAllocator
 from tinygrad.renderer import Renderer, ProgramSpec, Estimates
-from tinygrad.codegen.kernel import Kernel
+from tinygrad.codegen.kernel import Kernel, KernelOptError
+from tinygrad.engine.tuning import tuned_opts
 from tinygrad.engine.schedule import ScheduleItem
 
 # **************** Program Creation ****************
@@ -15,6 +18,14 @@ def get_kernel(renderer:Renderer, ast:UOp) -> Kernel:
   if DEBUG >= 5: print(ast)
   k = Kernel(ast, opts=renderer).required_optimizations()
   if not NOOPT:
+    if (opts:=tuned_opts(ast.key, renderer.device, renderer.suffix)) is not None:
+      # a kernel from the TUNING_DB doesn't need a search
+      try:
+        tk = Kernel(ast, opts=renderer).required_optimizations()
+        for o in opts[len(tk.applied_opts):]: tk.apply_opt(o)
+        return tk
+      except KernelOptError:
+        if DEBUG >= 1: print(f"TUNING_DB opts {opts} don't apply anymore, ignoring them")
     if not k.apply_tensor_cores(getenv("TC", 1)): k.hand_coded_optimizations()
     if BEAM >= 1:
       from tinygrad.engine.search import beam_search, bufs_from_lin
@@ -81,7 +92,7 @@ class BufferCopy(Runner):
     if src.device.startswith("DISK") and hasattr(dest.allocator, 'copy_from_disk') and disk_supports_fast_copyout and src.nbytes >= 4096:
       dest.allocator.copy_from_disk(dest._buf, src._buf, src.nbytes)
     elif src.device.startswith("DISK") and hasattr(dest.allocator, '_as_buffer'):
-      # fast(ish) path, uses readinto in diskbuffers
+      # fast(ish) path, reads straight into the host mapped dest, see DiskAllocator._copyout
       src.allocator._copyout(dest.allocator._as_buffer(dest._buf), src._buf)
     else:
       dest.copyin(src.as_buffer(allow_zero_copy=True))  # may allocate a CPU buffer depending on allow_zero_copy
@@ -94,9 +105,47 @@ class BufferCopy(Runner):
       Device[dest.device].synchronize()
       return time.perf_counter() - st
 
+class BufferMap(BufferCopy):
+  # the dest is a copy on write mapping of the DISK file, the copy is only done if the dest was replaced (e.g. by the JIT)
+  def __init__(self, total_sz, dest_device, src_device, mapped):
+    self.mapped = mapped
+    super().__init__(total_sz, dest_device, src_device)
+  def copy(self, dest, src):
+    if dest._buf is not self.mapped: super().copy(dest, src)
+
+def map_disk(dest:Buffer, src:Buffer) -> Optional[BufferMap]:
+  # the CPU devices can run on the mmap of an aligned file region, the mapping is made here since the dest must not be allocated yet
+  if not DISK_MMAP or not isinstance(Device[dest.device].allocator, _MallocAllocator): return None
+  if not hasattr(src_alloc:=Device[src.device].allocator, '_map'): return None
+  if dest.is_allocated() or dest._base is not None or (mapped:=src_alloc._map(src.ensure_allocated()._buf)) is None: return None
+  dest.allocate(mapped, external_ptr=ctypes.addressof(mapped))
+  return BufferMap(dest.nbytes, dest.device, src.device, mapped)
+
 class BufferXfer(BufferCopy):
   def copy(self, dest, src): dest.allocator._transfer(dest._buf, src._buf, dest.nbytes, src_dev=src.allocator.dev, dest_dev=dest.allocator.dev)
 
+# **************** program cache ****************
+
+@functools.lru_cache(None)
+def codegen_version(device:str) -> str:
+  # hash of all the source between an AST and a compiled lib, any change to it invalidates the program cache
+  root = pathlib.Path(__file__).parent.parent
+  srcs = [root/"ops.py", root/"dtype.py", root/"engine"/"search.py", pathlib.Path(inspect.getfile(type(Device[device])))]
+  srcs += [x for d in ["codegen", "renderer", "shape"] for x in sorted((root/d).glob("*.py"))]
+  return hashlib.sha256(b"".join(x.read_bytes() for x in srcs)).hexdigest()
+
+program_cache_stats: dict[str, int] = {"hits": 0, "misses": 0}
+def program_cache_key(device:str, ast:UOp) -> Optional[dict]:
+  dev = Device[device]
+  if not PROGRAM_CACHE or CACHELEVEL < 1 or dev.compiler.cachekey is None or logkerns is not None or CAPTURE_PROCESS_REPLAY: return None
+  return {"ast": ast.key, "device": device.split(":")[0], "beam": BEAM.value, "noopt": NOOPT.value,
+          "renderer": f"{type(dev.renderer).__name__}{dev.renderer.suffix}", "compiler": dev.compiler.cachekey,
+          "opts": str((getenv("TC", 1), USE_TC.value, TC_OPT.value, TC_SELECT.value, AMX.value, IMAGE.value, TRANSCENDENTAL.value,
+                       CPU_THREADS.value)),
+          # get_kernel uses these instead of optimizing, so a program cached before the TUNING_DB was set isn't used after
+          "tuned": str(tuned_opts(ast.key, dev.renderer.device, dev.renderer.suffix)),
+          "version": codegen_version(device)}
+
 # **************** method cache ****************
 
 method_cache: dict[tuple[str, bytes, int, int, bool], CompiledRunner] = {}
@@ -106,11 +155,88 @@ def get_runner(device:str, ast:UOp) -> CompiledRunner:
   bkey = (device.split(":")[0], ast.key, BEAM.value, NOOPT.value, True)
   if bret:=method_cache.get(bkey):
     method_cache[ckey] = ret = CompiledRunner(replace(bret.p, device=device), bret.lib)
+  elif (pkey:=program_cache_key(device, ast)) is not None and (val:=diskcache_get("program", pkey)) is not None:
+    program_cache_stats["hits"] += 1
+    method_cache[ckey] = method_cache[bkey] = ret = CompiledRunner(replace(val[0], device=device), val[1])
   else:
-    prg: ProgramSpec = get_kernel(Device[device].renderer, ast).to_program()
-    method_cache[ckey] = method_cache[bkey] = ret = CompiledRunner(replace(prg, device=device))
+    prg, lib = _wait_precompiled(bkey) or (get_kernel(Device[device].renderer, ast).to_program(), None)
+    method_cache[ckey] = method_cache[bkey] = ret = CompiledRunner(replace(prg, device=device), lib)
+    if pkey is not None:
+      program_cache_stats["misses"] += 1
+      diskcache_put("program", pkey, (prg, ret.lib))
   return ret
 
+# **************** pipelined lowering ****************
+
+def _rebuild_kernel(ast:UOp, renderer:Renderer, opts:list) -> Kernel:
+  k = Kernel(ast, opts=renderer).required_optimizations()
+  for o in opts[len(k.applied_opts):]: k.apply_opt(o)
+  return k
+
+def _optimize_ast(ast:UOp, renderer:Renderer, ctx:dict[str, int]) -> tuple[list, str]:
+  with Context(**{k:v for k,v in ctx.items() if k in ContextVar._cache}):
+    k = get_kernel(renderer, ast)
+    return k.applied_opts, k.base_name
+
+def _compile_ast(ast:UOp, renderer:Renderer, compiler:Compiler, ctx:dict[str, int], opts:list, name:str) -> tuple[ProgramSpec, bytes]:
+  with Context(**{k:v for k,v in ctx.items() if k in ContextVar._cache}):
+    p = _rebuild_kernel(ast, renderer, opts).to_program(name_override=name)
+    return p, compiler.compile_cached(p.src)
+
+@functools.lru_cache(None)
+def _can_precompile(device:str) -> bool:
+  # the renderer and compiler are sent to the worker, some compilers (like LLVM) hold on to the device
+  try: return pickle.loads(pickle.dumps((Device[device].renderer, Device[device].compiler))) is not None
+  except Exception: return False
+
+compile_pool = None
+# kernels being optimized, in schedule order, and kernels being compiled with the name they got
+optimizing: dict[tuple[str, bytes, int, int, bool], tuple[UOp, dict[str, int], Any]] = {}
+precompiling: dict[tuple[str, bytes, int, int, bool], tuple[UOp, list, str, Any]] = {}
+def precompile_schedule(schedule:list[ScheduleItem]):
+  """
+  Start optimizing, rendering and compiling all the new kernels in a schedule in a pool of PARALLEL_LOWER workers.
+
+  The kernels are named on the main thread as their opts come back, in schedule order like the serial path, so the duplicate name suffixes
+  and the src are the same.
+  """
+  global compile_pool
+  # BEAM search times the kernels, it has to run on the device. LOGKERNS logs the kernels in the order they are lowered
+  if BEAM >= 1 or logkerns is not None: return
+  if compile_pool is None:
+    from tinygrad.engine.search import _init_worker
+    compile_pool = multiprocessing.get_context("spawn").Pool(PARALLEL_LOWER.value, _init_worker, (), getenv("BEAM_MAX_TASKS_PER_CHILD", 16))
+  ctx = {k:v.value for k,v in ContextVar._cache.items()}
+  for si in schedule:
+    if si.ast.op is not Ops.SINK or not _can_precompile(device:=si.bufs[0].device.split(":")[0]): continue
+    if (bkey:=(device, si.ast.key, BEAM.value, NOOPT.value, True)) in method_cache or bkey in optimizing or bkey in precompiling: continue
+    if (pkey:=program_cache_key(device, si.ast)) is not None and diskcache_get("program", pkey) is not None: continue
+    optimizing[bkey] = (si.ast, ctx, compile_pool.apply_async(_optimize_ast, (si.ast, Device[device].renderer, ctx)))
+
+def _name_optimized(until:Optional[tuple[str, bytes, int, int, bool]]=None):
+  # the names are taken in schedule order, this stops at the first kernel still being optimized unless it waits for until
+  while optimizing:
+    bkey, (ast, ctx, res) = next(iter(optimizing.items()))
+    if until not in optimizing and not res.ready(): return
+    del optimizing[bkey]
+    renderer, compiler = Device[bkey[0]].renderer, Device[bkey[0]].compiler
+    try: opts, base_name = res.get()
+    except Exception as e:
+      if DEBUG >= 2: print(f"optimizing failed, optimizing on the main thread: {e}")
+      k = get_kernel(renderer, ast)
+      opts, base_name = k.applied_opts, k.base_name
+    name = Kernel.unique_name(base_name)
+    precompiling[bkey] = (ast, opts, name, cast(Any, compile_pool).apply_async(_compile_ast, (ast, renderer, compiler, ctx, opts, name)))
+
+def _wait_precompiled(bkey:tuple[str, bytes, int, int, bool]) -> Optional[tuple[ProgramSpec, Optional[bytes]]]:
+  _name_optimized(bkey)
+  if (job:=precompiling.pop(bkey, None)) is None: return None
+  try: return job[3].get()
+  except Exception as e:
+    # lowered on the main thread with the name it already has, this raises the error if there is one
+    if DEBUG >= 2: print(f"precompile failed, lowering on the main thread: {e}")
+    return _rebuild_kernel(job[0], Device[bkey[0]].renderer, job[1]).to_program(name_override=job[2]), None
+
 # **************** lowering functions ****************
 
 @dataclass(frozen=True)
@@ -122,28 +248,30 @@ class ExecItem:
     var_vals = {} if _var_vals is None else _var_vals
     bufs = [cast(Buffer, x) for x in self.bufs] if jit else [cast(Buffer, x).ensure_allocated() for x in self.bufs]
     et = self.prg(bufs, var_vals, wait=wait or DEBUG >= 2)
-    if do_update_stats:
-      GlobalCounters.kernel_count += 1
-      GlobalCounters.global_ops += (op_est:=sym_infer(self.prg.estimates.ops, var_vals))
-      GlobalCounters.global_mem += (mem_est:=sym_infer(self.prg.estimates.mem, var_vals))
-      if et is not None: GlobalCounters.time_sum_s += et
-      if DEBUG >= 2:
-        lds_est = sym_infer(self.prg.estimates.lds, var_vals)
-        mem_est = min(mem_est, lds_est)   # there can't be more memory accessed than loads/stores. remove this when symbolic is fixed
-        ptm = (colored(f"{et*1e3:9.2f}ms", "yellow") if et > 0.01 else f"{et*1e6:9.2f}us") if et is not None else ""
-        print(f"{colored(f'*** {self.prg.device[:7]:7s} {GlobalCounters.kernel_count:4d}', 'magenta' if jit else ('green' if self.prg.first_run else None))} {self.prg.display_name+' '*(41-ansilen(self.prg.display_name))} arg {len(bufs):2d} mem {GlobalCounters.mem_used/1e9:5.2f} GB " +  # noqa: E501
-              (str() if et is None else f"tm {ptm}/{GlobalCounters.time_sum_s*1e3:9.2f}ms ({op_est/((et or 1e-20)*1e9):9.2f} GFLOPS {mem_est/((et or 1e-20)*1e9):6.1f}|{lds_est/((et or 1e-20)*1e9):<7.1f} GB/s)" +  # noqa: E501
-               f" {[repr(m) if TRACEMETA >= 2 else str(m) for m in self.metadata] if self.metadata else ''}"))
-      self.prg.first_run = False
+    if do_update_stats: self.update_stats(var_vals, et, jit)
     return et
 
+  def update_stats(self, var_vals:dict[Variable, int], et:Optional[float]=None, jit=False):
+    GlobalCounters.kernel_count += 1
+    GlobalCounters.global_ops += (op_est:=sym_infer(self.prg.estimates.ops, var_vals))
+    GlobalCounters.global_mem += (mem_est:=sym_infer(self.prg.estimates.mem, var_vals))
+    if et is not None: GlobalCounters.time_sum_s += et
+    if DEBUG >= 2:
+      lds_est = sym_infer(self.prg.estimates.lds, var_vals)
+      mem_est = min(mem_est, lds_est)   # there can't be more memory accessed than loads/stores. remove this when symbolic is fixed
+      ptm = (colored(f"{et*1e3:9.2f}ms", "yellow") if et > 0.01 else f"{et*1e6:9.2f}us") if et is not None else ""
+      print(f"{colored(f'*** {self.prg.device[:7]:7s} {GlobalCounters.kernel_count:4d}', 'magenta' if jit else ('green' if self.prg.first_run else None))} {self.prg.display_name+' '*(41-ansilen(self.prg.display_name))} arg {len(self.bufs):2d} mem {GlobalCounters.mem_used/1e9:5.2f} GB " +  # noqa: E501
+            (str() if et is None else f"tm {ptm}/{GlobalCounters.time_sum_s*1e3:9.2f}ms ({op_est/((et or 1e-20)*1e9):9.2f} GFLOPS {mem_est/((et or 1e-20)*1e9):6.1f}|{lds_est/((et or 1e-20)*1e9):<7.1f} GB/s)" +  # noqa: E501
+             f" {[repr(m) if TRACEMETA >= 2 else str(m) for m in self.metadata] if self.metadata else ''}"))
+    self.prg.first_run = False
+
 # NOTE: ctx is the buffers
 si_lowerer = PatternMatcher([
   (UPat(Ops.SINK, name="sink"), lambda ctx,sink: (runner:=get_runner(ctx[0].device, sink), [ctx[x] for x in runner.p.globals])),
   (UPat(Ops.BUFFER_VIEW), lambda ctx: (ViewOp(ctx[0]), list(ctx))),
   (UPat(Ops.COPY, name="copy"), lambda ctx,copy: ((BufferXfer(ctx[0].nbytes, ctx[0].device, ctx[1].device) \
       if hasattr(Device[ctx[0].device].allocator, '_transfer') and all_same([x.device.split(":")[0] for x in ctx]) \
-      else BufferCopy(ctx[0].nbytes, ctx[0].device, ctx[1].device)), list(ctx))),
+      else map_disk(ctx[0], ctx[1]) or BufferCopy(ctx[0].nbytes, ctx[0].device, ctx[1].device)), list(ctx))),
 ])
 def lower_schedule_item(si:ScheduleItem) -> ExecItem: return ExecItem(*cast(tuple[Runner,list], si_lowerer.rewrite(si.ast, si.bufs)), si.metadata)
 
@@ -163,6 +291,107 @@ def lower_schedule(schedule:list[ScheduleItem]) -> Generator[ExecItem, None, Non
 capturing: list = []  # put classes with an add method in here
 
 def run_schedule(schedule:list[ScheduleItem], var_vals:Optional[dict[Variable, int]]=None, do_update_stats=True):
-  for ei in lower_schedule(schedule):
-    if len(capturing) and CAPTURING: capturing[0].add(ei)
-    ei.run(var_vals, do_update_stats=do_update_stats)
+  # while async schedules are pending, this one runs after them on their worker, so the lowering and the allocations never run on two threads
+  if pending_bufs and not getattr(_worker_local, "worker", False):
+    return cast(concurrent.futures.ThreadPoolExecutor, realize_worker).submit(run_schedule, schedule, var_vals, do_update_stats).result()
+  if PARALLEL_LOWER: precompile_schedule(schedule)
+  # the JIT replays what it captures in order, there's nothing to overlap with then
+  streams = Streams(var_vals) if OVERLAP and DEBUG < 2 and not (len(capturing) and CAPTURING) else None
+  try:
+    for ei in lower_schedule(schedule):
+      if len(capturing) and CAPTURING: capturing[0].add(ei)
+      if streams is not None: streams.run(ei, do_update_stats)
+      else: ei.run(var_vals, do_update_stats=do_update_stats)
+  finally:
+    if streams is not None: streams.synchronize()
+
+# **************** streams ****************
+
+# with OVERLAP, the kernels of each host device run in order on a worker thread of the device, like the queue of a GPU, and the copies between
+# them on another one. so the devices compute at the same time and the copies of a gradient run while the backward goes on. the copies that
+# follow each other in the schedule are handed to the worker together, in buckets of up to OVERLAP_BUCKET bytes.
+# an item waits for the last item that touched the base of any of its buffers on another stream
+stream_workers: dict[str, concurrent.futures.ThreadPoolExecutor] = {}
+OVERLAP_BUCKET = getenv("OVERLAP_BUCKET", 1 << 22)
+
+def _host(device:str) -> bool: return isinstance(Device[device].allocator, _MallocAllocator)
+
+class Streams:
+  def __init__(self, var_vals:Optional[dict[Variable, int]]):
+    self.var_vals, self.bucket, self.nbytes = var_vals or {}, cast(list[ExecItem], []), 0
+    self.last: dict[Buffer, concurrent.futures.Future] = {}
+    # the items are kept until synchronize, so their buffers are freed on this thread
+    self.items: list[ExecItem] = []
+
+  def run(self, ei:ExecItem, do_update_stats:bool):
+    # a view doesn't touch the memory
+    if isinstance(ei.prg, ViewOp): return ei.run(self.var_vals, do_update_stats=do_update_stats)
+    # buffers are allocated here, the workers only run
+    bufs = [cast(Buffer, b).ensure_allocated() for b in ei.bufs]
+    if do_update_stats: ei.update_stats(self.var_vals)
+    self.items.append(ei)
+    if type(ei.prg) is BufferCopy and all(_host(b.device) for b in bufs):
+      self.bucket.append(ei)
+      if (nbytes:=self.nbytes + bufs[0].nbytes) >= OVERLAP_BUCKET: self.flush()
+      else: self.nbytes = nbytes
+      return
+    self.flush()
+    if isinstance(ei.prg, CompiledRunner) and _host(ei.prg.device): self._submit(ei.prg.device, [ei])
+    else:
+      # the other devices have their own queues, they run here once what they need is done
+      for b in bufs:
+        if (fut:=self.last.pop(b.base, None)) is not None: fut.result()
+      ei.run(self.var_vals, do_update_stats=False)
+
+  def _submit(self, stream:str, eis:list[ExecItem]):
+    deps = dedup(fut for ei in eis for b in ei.bufs if (fut:=self.last.get(cast(Buffer, b).base)) is not None)
+    def task():
+      for dep in deps: dep.result()
+      for ei in eis: ei.run(self.var_vals, do_update_stats=False)
+    if stream not in stream_workers: stream_workers[stream] = concurrent.futures.ThreadPoolExecutor(1, f"stream {stream}")
+    fut = stream_workers[stream].submit(task)
+    self.last.update((cast(Buffer, b).base, fut) for ei in eis for b in ei.bufs)
+
+  def flush(self):
+    if self.bucket: self._submit("copy", self.bucket)
+    self.bucket, self.nbytes = [], 0
+
+  def synchronize(self):
+    self.flush()
+    for fut in self.last.values(): fut.result()
+    self.last.clear()
+    self.items.clear()
+
+# **************** async run ****************
+
+# a single worker runs the async schedules in order, pending_bufs maps every Buffer they touch to the last Future touching it.
+# run_schedule sends the schedules to the worker too while any are pending, and the allocators lock for the frees of the main thread
+realize_worker: Optional[concurrent.futures.ThreadPoolExecutor] = None
+pending_bufs: dict[Buffer, concurrent.futures.Future] = {}
+_worker_local = threading.local()
+
+def _init_realize_worker(): _worker_local.worker = True
+def _done(bufs:list[Buffer], fut:concurrent.futures.Future):
+  for b in bufs:
+    if pending_bufs.get(b) is fut: del pending_bufs[b]
+
+def run_schedule_async(schedule:list[ScheduleItem], var_vals:Optional[dict[Variable, int]]=None, do_update_stats=True) -> concurrent.futures.Future:
+  """Lowers and runs the schedule on a background thread, later schedules touching the same buffers wait for it."""
+  global realize_worker
+  if len(capturing) and CAPTURING:
+    run_schedule(schedule, var_vals, do_update_stats)
+    fut: concurrent.futures.Future = concurrent.futures.Future()
+    fut.set_result(None)
+    return fut
+  if realize_worker is None: realize_worker = concurrent.futures.ThreadPoolExecutor(1, "realize", _init_realize_worker)
+  bufs = dedup(b.base for si in schedule for b in si.bufs)
+  fut = realize_worker.submit(run_schedule, schedule, var_vals, do_update_stats)
+  pending_bufs.update((b, fut) for b in bufs)
+  fut.add_done_callback(functools.partial(_done, bufs))
+  return fut
+
+def wait_buffers(bufs:list[Buffer]):
+  # the worker runs in order, it never waits for itself
+  if getattr(_worker_local, "worker", False): return
+  for b in bufs:
+    if (fut:=pending_bufs.get(b.base)) is not None: fut.result()
@@ -1,10 +1,11 @@
 import sys, atexit, functools, pickle
+from typing import cast
 from collections import defaultdict, deque
 from dataclasses import dataclass, field
 from tinygrad.ops import UOp, Variable, Ops, GroupOp, PatternMatcher, UPat, graph_rewrite, graph_rewrite_map, track_rewrites, buffers
-from tinygrad.ops import can_pad, identity_element, resolve, symbolic_simple, view_left, merge_views
+from tinygrad.ops import can_pad, identity_element, resolve, symbolic_simple, view_left, merge_views, _substitute
 from tinygrad.helpers import Context, ContextVar, Metadata, all_int, all_same, colored, diskcache_put, prod, dedup, getenv, unwrap, flatten
-from tinygrad.helpers import FUSE_CONV_BW, FUSE_ARANGE, DEBUG, CAPTURE_PROCESS_REPLAY
+from tinygrad.helpers import FUSE_CONV_BW, FUSE_ARANGE, DEBUG, CAPTURE_PROCESS_REPLAY, SCHEDULE_CACHE, OVERLAP
 from tinygrad.dtype import ImageDType, dtypes
 from tinygrad.shape.shapetracker import ShapeTracker
 from tinygrad.shape.view import View, strides_for_shape
@@ -476,15 +477,72 @@ def create_schedule_with_vars(big_sink:UOp) -> tuple[list[ScheduleItem], dict[Va
       graph[x].append(si)
       in_degree[si] += 1
 
-  # do BFS
-  queue = deque(si for si in prescheduled if in_degree[si] == 0)
+  # do BFS, with OVERLAP the copies go first once they're ready, so they run while the kernels that don't need them do
+  def ready(x:ScheduleItem):
+    if OVERLAP and x.ast.op is Ops.COPY: queue.appendleft(x)
+    else: queue.append(x)
+  queue: deque[ScheduleItem] = deque()
+  for si in prescheduled:
+    if in_degree[si] == 0: ready(si)
   schedule: list[ScheduleItem] = []
   while queue:
     schedule.append(si:=queue.popleft())
     for x in graph[si]:
       in_degree[x] -= 1
-      if in_degree[x] == 0: queue.append(x)
+      if in_degree[x] == 0: ready(x)
   # confirm everything was scheduled correctly
   if len(schedule) != (groups:=len(prescheduled)): raise RuntimeError(f"cycle detected in graph, grouped {groups} but only scheduled {len(schedule)}")
   if DEBUG >= 1 and len(schedule) >= 10: print(f"scheduled {len(schedule)} kernels")
   return schedule, ctx.var_vals, becomes_map
+
+# **** schedule cache
+
+# a scheduled graph with its BUFFERs abstracted to placeholders, ScheduleItem bufs index into the input BUFFERs followed by the new ones
+@dataclass(frozen=True)
+class ScheduleTemplate:
+  items: tuple[tuple[UOp, tuple[int, ...], tuple[Metadata, ...]], ...]
+  new_bufs: tuple[UOp, ...]
+  becomes: tuple[tuple[UOp, UOp], ...]
+  var_vals: dict[Variable, int]
+
+schedule_cache: dict[tuple[UOp, tuple[tuple[str, int], ...]], ScheduleTemplate] = {}
+def _placeholder(b:UOp, i:int) -> UOp: return b.replace(arg=(-1-i, b.size))
+
+def _make_template(slots:list[UOp], key_map:dict[UOp, UOp], schedule:list[ScheduleItem], var_vals:dict[Variable, int],
+                   becomes_map:dict[UOp, UOp]) -> ScheduleTemplate|None:
+  bufs = slots+dedup(x for v in becomes_map.values() for x in v.toposort if x.op is Ops.BUFFER and x not in key_map)
+  # DISK subbuffers are views created while scheduling, those schedules can't be replayed
+  if any(b.buffer._base is not None for b in bufs[len(slots):]): return None
+  idxs = {id(b.buffer):i for i,b in enumerate(bufs)}
+  if not all(id(b) in idxs for si in schedule for b in si.bufs): return None
+  sub = {b:_placeholder(b, i) for i,b in enumerate(bufs)}
+  items = tuple((si.ast, tuple(idxs[id(b)] for b in si.bufs), si.metadata) for si in schedule)
+  becomes = tuple((key_map[k], v.substitute(sub)) for k,v in becomes_map.items())
+  return ScheduleTemplate(items, tuple(sub[b] for b in bufs[len(slots):]), becomes, var_vals)
+
+def _bind_template(t:ScheduleTemplate, slots:list[UOp], key_map:dict[UOp, UOp]):
+  bufs = slots+[UOp.new_buffer(cast(str, p.device), p.size, p.dtype) for p in t.new_bufs]
+  sub = {_placeholder(b, i):b for i,b in enumerate(bufs)}
+  real = {v:k for k,v in key_map.items()}
+  schedule = [ScheduleItem(ast, tuple(bufs[i].buffer for i in idxs), metadata) for ast,idxs,metadata in t.items]
+  # increment refcount of the buffers each ScheduleItem realizes
+  for si in schedule: si.outputs[0].ref(1)
+  return schedule, t.var_vals.copy(), {real[k]:v.substitute(sub) for k,v in t.becomes}
+
+def create_schedule_with_vars_cached(big_sink:UOp) -> tuple[list[ScheduleItem], dict[Variable, int], dict[UOp, UOp]]:
+  """Like create_schedule_with_vars, but a graph structurally identical to one scheduled before up to its BUFFERs reuses that schedule."""
+  if not SCHEDULE_CACHE or CAPTURE_PROCESS_REPLAY: return create_schedule_with_vars(big_sink)
+  slots = [u for u in big_sink.toposort if u.op is Ops.BUFFER]
+  # aliased input buffers change how ASSIGNs are ordered, don't use the cache for them
+  if len(set(id(b.buffer) for b in slots)) != len(slots): return create_schedule_with_vars(big_sink)
+  placeholders = {b:_placeholder(b, i) for i,b in enumerate(slots)}
+  with Context(TRACK_MATCH_STATS=0): key_map = graph_rewrite_map(big_sink, _substitute, placeholders, bottom_up=True)
+  # every ContextVar is in the key, so no setting that changes how a graph is scheduled (like FUSE_ARANGE or OVERLAP) can be missed
+  if (t:=schedule_cache.get(key:=(key_map[big_sink], tuple(sorted((k, v.value) for k,v in ContextVar._cache.items()))))) is not None:
+    schedule_cache[key] = schedule_cache.pop(key)
+    return _bind_template(t, slots, key_map)
+  schedule, var_vals, becomes_map = create_schedule_with_vars(big_sink)
+  if (t:=_make_template(slots, key_map, schedule, var_vals, becomes_map)) is not None:
+    if len(schedule_cache) >= getenv("SCHEDULE_CACHE_SIZE", 256): schedule_cache.pop(next(iter(schedule_cache)))
+    schedule_cache[key] = t
+  return schedule, var_vals, becomes_map
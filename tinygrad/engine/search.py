@@ -1,15 +1,17 @@
-from typing import cast, Optional, Callable
-import itertools, functools, random, math, time, multiprocessing, traceback, signal
-from collections import defaultdict
+from __future__ import annotations
+from typing import cast, Optional, Callable, Iterable
+import itertools, functools, random, math, time, multiprocessing, traceback, signal, hashlib, json
+import multiprocessing.pool
+from collections import defaultdict, Counter
 from dataclasses import replace
-from tinygrad.ops import UOp, Ops, Variable, sym_infer
+from tinygrad.ops import UOp, Ops, Variable, GroupOp, sym_infer
 from tinygrad.device import Device, Buffer, Compiler
 from tinygrad.helpers import prod, flatten, DEBUG, CACHELEVEL, diskcache_get, diskcache_put, getenv, Context, colored, to_function_name
-from tinygrad.helpers import IGNORE_BEAM_CACHE
+from tinygrad.helpers import IGNORE_BEAM_CACHE, ContextVar, diskcache_items
 from tinygrad.dtype import ImageDType, PtrDType
 from tinygrad.codegen.kernel import Kernel, Opt, OptOps, KernelOptError
 from tinygrad.tensor import Tensor
-from tinygrad.engine.realize import CompiledRunner
+from tinygrad.engine.realize import CompiledRunner, _can_precompile, _host
 from tinygrad.renderer import ProgramSpec
 
 actions = [Opt(op=OptOps.UPCAST, axis=axis, arg=amt) for amt in [0,2,3,4,5,7] for axis in range(6)]
@@ -56,18 +58,24 @@ def _time_program(p:ProgramSpec, lib:bytes, var_vals:dict[Variable, int], rawbuf
 class TimeoutException(Exception): pass
 def timeout_handler(signum, frame): raise TimeoutException()
 
-def _try_compile_linearized_w_idx(x:tuple[int,Kernel], compiler:Compiler) -> tuple[int, Optional[tuple[ProgramSpec, bytes, float]]]:
+# NOTE: x can be a Kernel or a ProgramSpec that was already rendered. with compiler=None, the kernel is only rendered (for the cost model)
+def _try_compile_linearized_w_idx(x:tuple[int,Kernel|ProgramSpec], compiler:Optional[Compiler],
+                                  ctx:Optional[dict[str, int]]=None) -> tuple[int, Optional[tuple[ProgramSpec, bytes, float]]]:
   if hasattr(signal, "alarm"):
     signal.signal(getattr(signal, 'SIGALRM'), timeout_handler)
     # set timeout
     signal.alarm(getenv("BEAM_TIMEOUT_SEC", 10))
   ret = None
   try:
-    p = x[1].to_program(name_override="test")
+    # the pool outlives the Context the search was started in, a worker renders with the ContextVars of the caller
+    with Context(**{k:v for k,v in (ctx or {}).items() if k in ContextVar._cache}):
+      p = x[1] if isinstance(x[1], ProgramSpec) else x[1].to_program(name_override="test")
     assert p.uops is not None, "uop list wasn't generated?"
     if len(p.uops) >= getenv("BEAM_UOPS_MAX", 3000) > 0: raise RuntimeError("too many uops")
+    if compiler is None: return x[0], (p, b"", 0.0)
     st = time.perf_counter()
-    prog = compiler.compile(p.src)
+    # the kernels are all named "test", so a search that is run again (or resumed) finds its compiles in the compiler cache
+    prog = compiler.compile_cached(p.src)
     et = time.perf_counter() - st
     ret = (p, prog, et)
   except RuntimeError:
@@ -118,7 +126,90 @@ def get_kernel_actions(lin:Kernel, include_0=True) -> dict[int, Kernel]:
     except KernelOptError: pass
   return acted_lins
 
-beam_pool, BEAM_DEBUG = None, getenv("BEAM_DEBUG")
+# *** cost model ***
+
+def kernel_features(lin:Kernel, p:ProgramSpec, var_vals:dict[Variable, int]) -> list[float]:
+  # cheap features of a candidate from its opts and its rendered uops, nothing is compiled
+  sizes: defaultdict[str, int] = defaultdict(lambda: 1)
+  for s,c in zip(lin.full_shape, lin.colors()): sizes[c.lower()] *= sym_infer(s, var_vals)
+  uops, est = cast(list[UOp], p.uops), p.estimates
+  cnt = Counter(u.op for u in uops)
+  return [math.log2(sizes["blue"]), math.log2(sizes["cyan"]*sizes["green"]*sizes["white"]), math.log2(sizes["red"]),
+          math.log2(sizes["yellow"]*sizes["magenta"]), float(lin.upcasted), float(lin.local_dims), float(cnt[Ops.WMMA] > 0)] + \
+         [math.log2(1+x) for x in (sym_infer(est.ops, var_vals), sym_infer(est.lds, var_vals), sym_infer(est.mem, var_vals), len(uops),
+                                   sum(v for op,v in cnt.items() if op in GroupOp.ALU), cnt[Ops.LOAD], cnt[Ops.STORE], cnt[Ops.RANGE])]
+
+class CostModel:
+  # predicts the log2 run time of a candidate from its kernel_features, only the order of the candidates of a kernel matters
+  def predict(self, feats:list[float]) -> float: raise NotImplementedError("needs a cost model")
+
+class LinearCostModel(CostModel):
+  def __init__(self, weights:list[float]): self.weights = weights
+  def predict(self, feats:list[float]) -> float: return sum(w*f for w,f in zip(self.weights, feats))
+
+  @staticmethod
+  def fit(samples:dict[bytes, list[tuple[list[float], float]]], l2=1e-2) -> LinearCostModel:
+    # ridge regression on the candidates of each kernel, centered on the kernel's mean so it only learns the ranking within a kernel
+    n = len(next(iter(samples.values()))[0][0])
+    A, b = [[l2 if i == j else 0.0 for j in range(n)] for i in range(n)], [0.0]*n
+    for rows in samples.values():
+      mx, my = [sum(f[i] for f,_ in rows)/len(rows) for i in range(n)], sum(math.log2(tm) for _,tm in rows)/len(rows)
+      for f,tm in rows:
+        x, y = [fi-mi for fi,mi in zip(f, mx)], math.log2(tm)-my
+        for i in range(n):
+          b[i] += x[i]*y
+          for j in range(n): A[i][j] += x[i]*x[j]
+    # gauss-jordan with partial pivoting, A is symmetric positive definite
+    for c in range(n):
+      piv = max(range(c, n), key=lambda r: abs(A[r][c]))
+      A[c], A[piv], b[c], b[piv] = A[piv], A[c], b[piv], b[c]
+      for r in range(n):
+        if r != c and A[r][c] != 0:
+          fac = A[r][c] / A[c][c]
+          A[r], b[r] = [a-fac*ac for a,ac in zip(A[r], A[c])], b[r]-fac*b[c]
+    return LinearCostModel([b[i]/A[i][i] for i in range(n)])
+
+  def save(self, fn:str):
+    with open(fn, "w") as f: json.dump({"weights": self.weights}, f)
+  @staticmethod
+  def load(fn:str) -> LinearCostModel:
+    with open(fn) as f: return LinearCostModel(json.load(f)["weights"])
+
+def _features_key(lin:Kernel) -> dict:
+  return {"ast": lin.ast.key, "opts": str(lin.applied_opts), "device": lin.opts.device, "suffix": lin.opts.suffix}
+
+def cost_model_samples(device:str) -> dict[bytes, list[tuple[list[float], float]]]:
+  """Returns the features and the time of every candidate timed by `time_linearizer` or `beam_search` on a device, grouped by kernel."""
+  feats = {tuple(k.values()):v for k,v in diskcache_items("kernel_features") if k["device"] == device}
+  samples: dict[tuple, float] = {}
+  for k,tms in diskcache_items("time_linearizer"):
+    if (key:=(k["ast"], k["opts"], k["device"], k["suffix"])) in feats and math.isfinite(tm:=min(tms)): samples[key] = min(tm, samples.get(key, tm))
+  for k,(lib_hash,_,tm) in diskcache_items("beam_timing"):
+    if (key:=(k["ast"], k["opts"], k["device"], k["suffix"])) in feats and lib_hash is not None and math.isfinite(tm):
+      samples[key] = min(tm, samples.get(key, tm))
+  ret: defaultdict[bytes, list[tuple[list[float], float]]] = defaultdict(list)
+  for key,tm in samples.items():
+    if tm > 0: ret[key[0]].append((feats[key], tm))
+  # a kernel with one candidate doesn't say anything about the ranking
+  return {k:v for k,v in ret.items() if len(v) > 1}
+
+# only the BEAM_TOPK candidates with the lowest predicted time are compiled and timed
+cost_model: Optional[CostModel] = LinearCostModel.load(fn) if (fn:=getenv("BEAM_COST_MODEL", "")) else None
+BEAM_TOPK = getenv("BEAM_TOPK", 16)
+
+# the compile workers live across kernels and beam_search calls
+beam_pool: Optional[multiprocessing.pool.Pool] = None
+BEAM_DEBUG = getenv("BEAM_DEBUG")
+def _get_beam_pool(device:str) -> Optional[multiprocessing.pool.Pool]:
+  global beam_pool
+  # the renderer and compiler of some devices can't be sent to a worker, they compile serially
+  if not (workers:=getenv("PARALLEL", multiprocessing.cpu_count())) or not _can_precompile(device): return None
+  if beam_pool is None: beam_pool = multiprocessing.get_context("spawn").Pool(workers, _init_worker, (), getenv("BEAM_MAX_TASKS_PER_CHILD", 16))
+  return beam_pool
+
+def _beam_timing_key(lin:Kernel, allow_test_size:bool) -> dict:
+  return {"ast": lin.ast.key, "opts": str(lin.applied_opts), "allow_test_size": allow_test_size, "device": lin.opts.device, "suffix": lin.opts.suffix}
+
 def beam_search(lin:Kernel, rawbufs:list[Buffer], amt:int, allow_test_size=True, disable_cache=IGNORE_BEAM_CACHE.value) -> Kernel:
   global beam_pool
   key = {"ast": lin.ast.key, "amt": amt, "allow_test_size": allow_test_size, "device": lin.opts.device, "suffix": lin.opts.suffix}
@@ -128,11 +219,8 @@ def beam_search(lin:Kernel, rawbufs:list[Buffer], amt:int, allow_test_size=True,
     return ret
 
   beam: list[tuple[Kernel, float]] = [(lin, float("inf"))]
-  seen_libs = set()
-
-  default_parallel = multiprocessing.cpu_count() if lin.opts.device in {"CUDA", "AMD", "NV", "METAL"} else 0
-  if beam_pool is None and (workers := getenv("PARALLEL", default_parallel)):
-    beam_pool = multiprocessing.get_context("spawn").Pool(workers, _init_worker, (), getenv("BEAM_MAX_TASKS_PER_CHILD", 16))
+  seen_libs: set[str] = set()
+  pool = _get_beam_pool(lin.opts.device)
 
   min_progress = getenv("BEAM_MIN_PROGRESS", 0.01)/1e6
   if BEAM_DEBUG: print(f"BEAM_SEARCH:\n{lin.ast}")
@@ -143,23 +231,50 @@ def beam_search(lin:Kernel, rawbufs:list[Buffer], amt:int, allow_test_size=True,
     var_vals: dict[Variable, int] = {k:int(k.vmax+k.vmin)//2 for k in lin.ast.variables()}
     exiting, st = False, time.perf_counter()
     dev = Device[lin.opts.device]
+    ctx = {k:v.value for k,v in ContextVar._cache.items()}
     while not exiting:
       acted_lins: list[Kernel] = flatten([get_kernel_actions(lin, include_0=False).values() for lin,_ in beam])
       timed_lins: list[tuple[Kernel, float]] = []
-      _compile_fn = functools.partial(_try_compile_linearized_w_idx, compiler=dev.compiler)
+      # every candidate is checkpointed as (lib hash, ops, time) once it's timed in full, a search that was interrupted picks up from there
+      checkpointed: dict[int, tuple[Optional[str], int, float]] = {}
+      if not disable_cache and CACHELEVEL >= 2:
+        checkpointed = {i:val for i,k in enumerate(acted_lins) if (val:=diskcache_get("beam_timing", _beam_timing_key(k, allow_test_size)))}
+      todo: list[tuple[int, Kernel|ProgramSpec]] = [(i,k) for i,k in enumerate(acted_lins) if i not in checkpointed]
+      if cost_model is not None and len(todo) > BEAM_TOPK:
+        # render everything, then only compile the candidates the cost model ranks best
+        _render_fn = functools.partial(_try_compile_linearized_w_idx, compiler=None, ctx=ctx)
+        rendered = [(i,proc[0]) for i,proc in (map(_render_fn, todo) if pool is None else pool.imap_unordered(_render_fn, todo)) if proc is not None]
+        todo = [(i,p) for i,p in sorted(rendered, key=lambda x: cost_model.predict(kernel_features(acted_lins[x[0]], x[1], var_vals)))[:BEAM_TOPK]]
+      _compile_fn = functools.partial(_try_compile_linearized_w_idx, compiler=dev.compiler, ctx=ctx)
+      compiled: Iterable[tuple[int, Optional[tuple[ProgramSpec, bytes, float]]]] = \
+        map(_compile_fn, todo) if pool is None else pool.imap_unordered(_compile_fn, todo)
+      # the candidates of CPU devices run on the cores the workers compile on, so they are all compiled before the first is timed
+      if pool is not None and _host(lin.opts.device): compiled = list(compiled)
       least_compute_ops = math.inf
-      for i,proc in (map(_compile_fn, enumerate(acted_lins)) if beam_pool is None else beam_pool.imap_unordered(_compile_fn, enumerate(acted_lins))):
-        if proc is None: continue
-        p, lib, compile_et = proc
-        if lib in seen_libs: continue
-        # filter out kernels that use 1000x more compute than the smallest
-        least_compute_ops = min(this_compute_ops:=sym_infer(p.estimates.ops, var_vals), least_compute_ops)
-        if least_compute_ops*1000 < this_compute_ops: continue
-        seen_libs.add(lib)
-        try: tms = _time_program(p, lib, var_vals, rawbufs, early_stop=beam[0][1]*3 if len(beam) else 1.0, clear_l2=hasattr(dev, 'invalidate_caches'))
-        except RuntimeError: continue # for runtime issues
-        timed_lins.append((acted_lins[i], min(tms)))
-        if BEAM_DEBUG > 1: print(f"{time.perf_counter() - st:7.2f}s: {i:5d} {len(cast(list, p.uops)):5d} uops {compile_et*1e6:12.2f} us compile/{timed_lins[-1][1]*1e6:12.2f} us run       {len(timed_lins):4d}/{len(acted_lins):4d}         {timed_lins[-1][0].colored_shape()}")  # noqa: E501
+      for i,proc in itertools.chain([(i, None) for i in checkpointed], compiled):
+        if i in checkpointed: lib_hash, this_compute_ops, tm = checkpointed[i]
+        elif proc is None: lib_hash, this_compute_ops, tm = None, 0, math.inf
+        else:
+          p, lib, compile_et = proc
+          lib_hash, this_compute_ops, tm = hashlib.sha256(lib).hexdigest(), sym_infer(p.estimates.ops, var_vals), math.inf
+        if lib_hash is not None:
+          if lib_hash in seen_libs: continue
+          # filter out kernels that use 1000x more compute than the smallest
+          least_compute_ops = min(this_compute_ops, least_compute_ops)
+          if least_compute_ops*1000 < this_compute_ops: continue
+          seen_libs.add(lib_hash)
+        if i not in checkpointed and lib_hash is not None:
+          cnt, early_stop = 3, beam[0][1]*3 if len(beam) else 1.0
+          try: tm = min(tms:=_time_program(p, lib, var_vals, rawbufs, early_stop=early_stop, clear_l2=hasattr(dev, 'invalidate_caches'), cnt=cnt))
+          except RuntimeError: lib_hash = None # for runtime issues
+          # compile timeouts, runtime errors and times cut short by early_stop can be different next time, they aren't checkpointed
+          if CACHELEVEL >= 2 and lib_hash is not None:
+            if len(tms) == cnt and math.isfinite(tm):
+              diskcache_put("beam_timing", _beam_timing_key(acted_lins[i], allow_test_size), (lib_hash, this_compute_ops, tm))
+            diskcache_put("kernel_features", _features_key(acted_lins[i]), kernel_features(acted_lins[i], p, var_vals))
+        if lib_hash is None: continue
+        timed_lins.append((acted_lins[i], tm))
+        if BEAM_DEBUG > 1: print(f"{time.perf_counter() - st:7.2f}s: {i:5d} " + ("    checkpointed" if i in checkpointed else f"{len(cast(list, p.uops)):5d} uops {compile_et*1e6:12.2f} us compile") + f"/{tm*1e6:12.2f} us run       {len(timed_lins):4d}/{len(acted_lins):4d}         {timed_lins[-1][0].colored_shape()}")  # noqa: E501
         elif DEBUG >= 2: print(f"\r{time.perf_counter() - st:7.2f}s: {timed_lins[-1][1]*1e6:12.2f} us       {len(timed_lins):4d}/{len(acted_lins):4d}         {timed_lins[-1][0].colored_shape()}\033[K", end="")  # noqa: E501
 
       # done
@@ -170,9 +285,13 @@ def beam_search(lin:Kernel, rawbufs:list[Buffer], amt:int, allow_test_size=True,
       if DEBUG >= 2: print(f"\r{time.perf_counter() - st:7.2f}s:", colored(f"{beam[0][1]*1e6:12.2f} us", "green" if exiting else None), f"from {len(acted_lins):3d} -> {len(opts):3d} actions\033[K", beam[0][0].colored_shape())  # noqa: E501
   except KeyboardInterrupt as e:
     if beam_pool is not None: beam_pool.terminate()
+    beam_pool = None
     raise e
 
-  if CACHELEVEL >= 1: diskcache_put("beam_search", key, beam[0][0].applied_opts)
+  if CACHELEVEL >= 1:
+    diskcache_put("beam_search", key, beam[0][0].applied_opts)
+    # the time is what tinygrad.engine.tuning merges on
+    diskcache_put("beam_search_tm", key, beam[0][1])
   if BEAM_DEBUG: print(f"BEAM_SEARCH: final tm={beam[0][1]*1e6:0.2f} us, applied_opts={beam[0][0].applied_opts}")
   return beam[0][0]
 
@@ -202,5 +321,7 @@ def time_linearizer(lin:Kernel, rawbufs:list[Buffer], allow_test_size=True, max_
   tms = _time_program(p, dev.compiler.compile(p.src), var_vals, rawbufs,
                       max_global_size=max_global_size if allow_test_size else None, clear_l2=clear_l2, cnt=cnt, name=to_function_name(lin.name))
 
-  if CACHELEVEL >= 2: diskcache_put("time_linearizer", key, tms)
+  if CACHELEVEL >= 2:
+    diskcache_put("time_linearizer", key, tms)
+    diskcache_put("kernel_features", _features_key(lin), kernel_features(lin, p, var_vals))
   return min(tms)
@@ -0,0 +1,82 @@
+# a portable file of BEAM results, tuned once and shipped to the machines that run the model
+from __future__ import annotations
+import json, math, functools
+from dataclasses import dataclass
+from tinygrad.helpers import diskcache_put, diskcache_items, TUNING_DB
+from tinygrad.codegen.kernel import Opt, OptOps
+
+@dataclass(frozen=True)
+class TuningEntry:
+  ast: str         # hex of UOp.key
+  device: str
+  suffix: str
+  amt: int
+  allow_test_size: bool
+  opts: tuple[Opt, ...]
+  tm: float = math.inf
+  @property
+  def key(self) -> tuple: return (self.ast, self.device, self.suffix, self.amt, self.allow_test_size)
+  def to_json(self) -> dict:
+    return {"ast": self.ast, "device": self.device, "suffix": self.suffix, "amt": self.amt, "allow_test_size": self.allow_test_size,
+            "opts": [[o.op.name, o.axis, list(o.arg) if isinstance(o.arg, tuple) else o.arg] for o in self.opts], "tm": self.tm}
+  @staticmethod
+  def from_json(x:dict) -> TuningEntry:
+    opts = tuple(Opt(OptOps[op], axis, tuple(arg) if isinstance(arg, list) else arg) for op,axis,arg in x["opts"])
+    return TuningEntry(x["ast"], x["device"], x["suffix"], x["amt"], x["allow_test_size"], opts, x["tm"])
+
+def merge(*dbs:dict[tuple, TuningEntry]) -> dict[tuple, TuningEntry]:
+  """Merges tuning databases, the fastest entry of every kernel wins."""
+  ret: dict[tuple, TuningEntry] = {}
+  for db in dbs:
+    for k,e in db.items():
+      if k not in ret or e.tm < ret[k].tm: ret[k] = e
+  return ret
+
+def save(fn:str, db:dict[tuple, TuningEntry]):
+  with open(fn, "w") as f: json.dump({"version": 1, "entries": [e.to_json() for e in sorted(db.values(), key=lambda e: e.key)]}, f, indent=1)
+
+def load(fn:str) -> dict[tuple, TuningEntry]:
+  with open(fn) as f: data = json.load(f)
+  if data.get("version") != 1: raise ValueError(f"{fn} has tuning database version {data.get('version')}, expected 1")
+  return {(e:=TuningEntry.from_json(x)).key:e for x in data["entries"]}
+
+# *** the local cache ***
+
+def _cache_key(e:TuningEntry) -> dict:
+  return {"ast": bytes.fromhex(e.ast), "amt": e.amt, "allow_test_size": e.allow_test_size, "device": e.device, "suffix": e.suffix}
+
+def from_cache() -> dict[tuple, TuningEntry]:
+  """Returns the results of every beam_search in the local CACHEDB."""
+  tms = {tuple(k.values()):tm for k,tm in diskcache_items("beam_search_tm")}
+  ret = {}
+  for k,opts in diskcache_items("beam_search"):
+    e = TuningEntry(k["ast"].hex(), k["device"], k["suffix"], k["amt"], bool(k["allow_test_size"]), tuple(opts), tms.get(tuple(k.values()), math.inf))
+    ret[e.key] = e
+  return ret
+
+def to_cache(db:dict[tuple, TuningEntry]) -> int:
+  """Writes the entries that are faster than the local ones (or missing locally) to the local CACHEDB, returns how many were written."""
+  local, cnt = from_cache(), 0
+  for k,e in db.items():
+    if k in local and local[k].tm <= e.tm: continue
+    diskcache_put("beam_search", _cache_key(e), list(e.opts))
+    diskcache_put("beam_search_tm", _cache_key(e), e.tm)
+    cnt += 1
+  return cnt
+
+# *** lookup in get_kernel ***
+
+# get_kernel uses the opts of the kernels in the TUNING_DB file instead of hand coded ones or a BEAM search
+
+@functools.cache
+def _tuning_db(fn:str) -> dict[tuple[str, str, str], TuningEntry]:
+  # the fastest entry of a kernel on a device, no matter which BEAM width found it
+  ret: dict[tuple[str, str, str], TuningEntry] = {}
+  for e in load(fn).values():
+    if (k:=(e.ast, e.device, e.suffix)) not in ret or e.tm < ret[k].tm: ret[k] = e
+  return ret
+
+def tuned_opts(ast_key:bytes, device:str, suffix:str) -> tuple[Opt, ...]|None:
+  """Returns the opts of a kernel from the TUNING_DB file, None if it's not set or doesn't have the kernel."""
+  if not TUNING_DB or (e:=_tuning_db(TUNING_DB.value).get((ast_key.hex(), device, suffix))) is None: return None
+  return e.opts
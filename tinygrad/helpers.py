@@ -1,6 +1,6 @@
 from __future__ import annotations
 import os, functools, platform, time, re, contextlib, operator, hashlib, pickle, sqlite3, tempfile, pathlib, string, ctypes, sys, gzip
-import urllib.request, subprocess, shutil, math, contextvars, types, copyreg, inspect, importlib
+import urllib.request, subprocess, shutil, math, contextvars, types, copyreg, inspect, importlib, threading
 from dataclasses import dataclass
 from typing import Union, ClassVar, Optional, Iterable, Any, TypeVar, Callable, Sequence, TypeGuard, Iterator, Generic
 
@@ -111,6 +111,10 @@ FUSE_ARANGE, FUSE_CONV_BW = ContextVar("FUSE_ARANGE", 0), ContextVar("FUSE_CONV_
 SPLIT_REDUCEOP, NO_MEMORY_PLANNER, RING = ContextVar("SPLIT_REDUCEOP", 1), ContextVar("NO_MEMORY_PLANNER", 0), ContextVar("RING", 1)
 PICKLE_BUFFERS, PROFILE, LRU = ContextVar("PICKLE_BUFFERS", 1), ContextVar("PROFILE", getenv("VIZ")), ContextVar("LRU", 1)
 CACHELEVEL, IGNORE_BEAM_CACHE = ContextVar("CACHELEVEL", 2), ContextVar("IGNORE_BEAM_CACHE", 0)
+PROGRAM_CACHE, PARALLEL_LOWER = ContextVar("PROGRAM_CACHE", 0), ContextVar("PARALLEL_LOWER", 0)
+SCHEDULE_CACHE, CPU_THREADS = ContextVar("SCHEDULE_CACHE", 0), ContextVar("CPU_THREADS", 1)
+DISK_MMAP, JIT_STATS, OVERLAP = ContextVar("DISK_MMAP", 0), ContextVar("JIT_STATS", 1), ContextVar("OVERLAP", 0)
+TUNING_DB = ContextVar("TUNING_DB", "")
 
 @dataclass(frozen=True)
 class Metadata:
@@ -169,17 +173,17 @@ cache_dir: str = os.path.join(getenv("XDG_CACHE_HOME", os.path.expanduser("~/Lib
 CACHEDB: str = getenv("CACHEDB", os.path.abspath(os.path.join(cache_dir, "cache.db")))
 
 VERSION = 19
-_db_connection = None
+# sqlite connections can't be shared between threads, each thread gets its own
+_db_connection = threading.local()
 def db_connection():
-  global _db_connection
-  if _db_connection is None:
+  if (conn:=getattr(_db_connection, "conn", None)) is None:
     os.makedirs(CACHEDB.rsplit(os.sep, 1)[0], exist_ok=True)
-    _db_connection = sqlite3.connect(CACHEDB, timeout=60, isolation_level="IMMEDIATE")
+    _db_connection.conn = conn = sqlite3.connect(CACHEDB, timeout=60, isolation_level="IMMEDIATE")
     # another connection has set it already or is in the process of setting it
     # that connection will lock the database
-    with contextlib.suppress(sqlite3.OperationalError): _db_connection.execute("PRAGMA journal_mode=WAL").fetchone()
-    if DEBUG >= 7: _db_connection.set_trace_callback(print)
-  return _db_connection
+    with contextlib.suppress(sqlite3.OperationalError): conn.execute("PRAGMA journal_mode=WAL").fetchone()
+    if DEBUG >= 7: conn.set_trace_callback(print)
+  return conn
 
 def diskcache_clear():
   cur = db_connection().cursor()
@@ -214,6 +218,14 @@ def diskcache_put(table:str, key:Union[dict, str, int], val:Any, prepickled=Fals
   cur.close()
   return val
 
+def diskcache_items(table:str) -> list[tuple[dict, Any]]:
+  if CACHELEVEL < 1: return []
+  try: cur = db_connection().execute(f"SELECT * FROM '{table}_{VERSION}'")
+  except sqlite3.OperationalError: return []  # table doesn't exist
+  # the val is the last column, after the key columns
+  cols = [d[0] for d in cur.description][:-1]
+  return [(dict(zip(cols, row[:-1])), pickle.loads(row[-1])) for row in cur.fetchall()]
+
 def diskcache(func):
   def wrapper(*args, **kwargs) -> bytes:
     table, key = f"cache_{func.__name__}", hashlib.sha256(pickle.dumps((args, kwargs))).hexdigest()
@@ -1,9 +1,9 @@
-import json, pathlib, zipfile, pickle, tarfile, struct, functools, io
-from collections import OrderedDict
+import json, pathlib, zipfile, pickle, tarfile, struct, functools, io, time, os, concurrent.futures
+from collections import OrderedDict, deque
 from typing import Union, Optional, Any, Callable, BinaryIO, Iterable
 from tinygrad.tensor import Tensor
 from tinygrad.dtype import dtypes
-from tinygrad.helpers import prod, argsort, DEBUG, Timing, CI, unwrap, GlobalCounters, tqdm, round_up, T
+from tinygrad.helpers import prod, argsort, DEBUG, Timing, CI, unwrap, GlobalCounters, tqdm, round_up, T, getenv
 from tinygrad.shape.view import strides_for_shape
 
 class TensorIO(io.RawIOBase, BinaryIO):
@@ -35,9 +35,10 @@ safe_dtypes = {"BOOL":dtypes.bool, "I8":dtypes.int8, "U8":dtypes.uint8, "I16":dt
                "I64":dtypes.int64, "U64":dtypes.uint64, "F16":dtypes.float16, "BF16":dtypes.bfloat16, "F32":dtypes.float32, "F64":dtypes.float64}
 inverse_safe_dtypes = {v:k for k,v in safe_dtypes.items()}
 
-def accept_filename(func: Callable[[Tensor], T]) -> Callable[[Union[Tensor, str, pathlib.Path]], T]:
+def accept_filename(func: Callable[..., T]) -> Callable[..., T]:
   @functools.wraps(func)
-  def wrapper(fn: Union[Tensor, str, pathlib.Path]) -> T: return func(Tensor(pathlib.Path(fn)) if not isinstance(fn, Tensor) else fn)
+  def wrapper(fn: Union[Tensor, str, pathlib.Path], *args, **kwargs) -> T:
+    return func(Tensor(pathlib.Path(fn)) if not isinstance(fn, Tensor) else fn, *args, **kwargs)
   return wrapper
 
 @accept_filename
@@ -124,7 +125,7 @@ def get_parameters(obj) -> list[Tensor]:
   """
   return list(get_state_dict(obj).values())
 
-def load_state_dict(model, state_dict:dict[str, Tensor], strict=True, verbose=True, consume=False) -> None:
+def load_state_dict(model, state_dict:dict[str, Tensor], strict=True, verbose=True, consume=False, realize=True) -> None:
   """
   Loads a state_dict into a model.
 
@@ -152,11 +153,83 @@ def load_state_dict(model, state_dict:dict[str, Tensor], strict=True, verbose=Tr
       if v.shape != state_dict[k].shape:
         raise ValueError(f'Shape mismatch in layer `{k}`: Expected shape {v.shape}, but found {state_dict[k].shape} in state dict.')
       if isinstance(v.device, tuple):
-        if isinstance(state_dict[k].device, tuple): v.replace(state_dict[k]).realize()
-        else: v.replace(state_dict[k].shard(v.device, v.lazydata.axis)).realize()
-      else: v.replace(state_dict[k].to(v.device)).realize()
+        if isinstance(state_dict[k].device, tuple): v.replace(state_dict[k])
+        else: v.replace(state_dict[k].shard(v.device, v.lazydata.axis))
+      else: v.replace(state_dict[k].to(v.device))
+      # NOTE: without realize, the weights stay what the state_dict has (e.g. the dequantization of quantized gguf_load weights)
+      if realize: v.realize()
       if consume: del state_dict[k]
 
+def _read_into(fn:pathlib.Path, offset:int, bufs:list[memoryview]):
+  # one read of adjacent ranges of a file, scattered into bufs
+  with open(fn, "rb", buffering=0) as f:
+    i = 0
+    while i < len(bufs):
+      if hasattr(os, "preadv"): n = os.preadv(f.fileno(), bufs[i:i+1024], offset)  # IOV_MAX is 1024 on linux
+      else:
+        f.seek(offset)
+        n = f.readinto(bufs[i]) or 0
+      if n == 0: raise EOFError(f"{fn} ended at {offset}")
+      offset += n
+      while i < len(bufs) and n >= len(bufs[i]): n, i = n-len(bufs[i]), i+1
+      if n: bufs[i] = bufs[i][n:]
+
+def safe_load_into(model, fn:Union[str, pathlib.Path], strict=True, verbose=True, workers:int=getenv("LOAD_WORKERS", 8),
+                   read_size:int=getenv("LOAD_READ_SIZE", 64<<20)) -> None:
+  """
+  Loads a .safetensors file, or all the shards of a .safetensors.index.json, straight into the weights of a model.
+
+  All the reads of a file are planned at once. Adjacent tensors are merged into reads of up to `read_size` bytes, which run in a pool of
+  `workers` threads while the tensors of the earlier reads are copied to their devices.
+
+  ```python
+  nn.state.safe_load_into(net, "model.safetensors")
+  ```
+  """
+  fn = pathlib.Path(fn)
+  files = sorted(set(json.loads(fn.read_text())["weight_map"].values())) if fn.name.endswith(".index.json") else [fn.name]
+  model_state_dict, seen = get_state_dict(model), set()
+  # (file, offset, size, [(key, offset in the read, size, dtype, shape)]) for every read
+  reads: list[tuple[pathlib.Path, int, int, list[tuple[str, int, int, Any, list[int]]]]] = []
+  for f in files:
+    with open(path:=fn.parent / f, "rb") as fo: metadata = json.loads(fo.read(data_start:=int.from_bytes(fo.read(8), "little")+8)[:data_start-8])
+    for k,v in sorted(((k,v) for k,v in metadata.items() if k != "__metadata__"), key=lambda x: x[1]["data_offsets"][0]):
+      seen.add(k)
+      if k not in model_state_dict: continue
+      if model_state_dict[k].shape != tuple(v["shape"]):
+        raise ValueError(f'Shape mismatch in layer `{k}`: Expected shape {model_state_dict[k].shape}, but found {tuple(v["shape"])} in state dict.')
+      st, en = data_start+v["data_offsets"][0], data_start+v["data_offsets"][1]
+      if reads and reads[-1][0] == path and reads[-1][1]+reads[-1][2] == st and reads[-1][2]+en-st <= read_size:
+        reads[-1] = (path, reads[-1][1], reads[-1][2]+en-st, reads[-1][3]+[(k, reads[-1][2], en-st, safe_dtypes[v["dtype"]], v["shape"])])
+      else: reads.append((path, st, en-st, [(k, 0, en-st, safe_dtypes[v["dtype"]], v["shape"])]))
+  if DEBUG >= 1 and len(seen - model_state_dict.keys()): print("WARNING: unused weights in safetensors", sorted(list(seen - model_state_dict.keys())))
+  if strict and (missing:=model_state_dict.keys() - seen): raise KeyError(f"missing weights {sorted(missing)}")
+
+  def _submit(path:pathlib.Path, offset:int, size:int, tensors:list) -> tuple[concurrent.futures.Future, list[Tensor], Optional[memoryview]]:
+    # a sharded weight is loaded on its first device and sharded from there
+    devs = [d[0] if isinstance(d:=model_state_dict[k].device, tuple) else d for k,*_ in tensors]
+    ws = [Tensor.empty(*shape, dtype=dtype, device=d) for d,(_,_,_,dtype,shape) in zip(devs, tensors)]
+    bufs = [w.lazydata.buffer.ensure_allocated() for w,(_,_,sz,_,_) in zip(ws, tensors) if sz]
+    # devices that map their memory on the host are read into directly, the rest are read into host memory and copied in
+    if all(hasattr(b.allocator, "_as_buffer") for b in bufs):
+      return pool.submit(_read_into, path, offset, [b.as_buffer(force_zero_copy=True) for b in bufs]), ws, None
+    return pool.submit(_read_into, path, offset, [staging:=memoryview(bytearray(size))]), ws, staging
+
+  st, total = time.perf_counter(), sum(r[2] for r in reads)
+  with concurrent.futures.ThreadPoolExecutor(workers) as pool, tqdm(disable=CI or not verbose, total=total, unit="B", unit_scale=True) as t:
+    # 2*workers reads are in flight while the earlier ones are copied to the devices, the host memory used is at most 2*workers*read_size
+    pending = deque(_submit(*r) for r in reads[:2*workers])
+    for i,(_,_,size,tensors) in enumerate(reads):
+      fut, ws, staging = pending.popleft()
+      fut.result()
+      if i+2*workers < len(reads): pending.append(_submit(*reads[i+2*workers]))
+      for w,(k,off,sz,_,_) in zip(ws, tensors):
+        if staging is not None and sz: w.lazydata.buffer.copyin(staging[off:off+sz])
+        v = model_state_dict[k]
+        v.replace(w.shard(v.device, v.lazydata.axis).realize() if isinstance(v.device, tuple) else w)
+      t.update(size)
+  if verbose and not CI: print(f"loaded {total/1e9:.2f} GB in {len(reads)} reads at {total/1e9/(time.perf_counter()-st):.2f} GB/s")
+
 @accept_filename
 def tar_extract(t: Tensor) -> dict[str, Tensor]:
   """
@@ -171,6 +244,11 @@ def tar_extract(t: Tensor) -> dict[str, Tensor]:
 
 # torch support!
 
+def _disk_file(t:Tensor) -> Optional[str]:
+  # the file of a DISK tensor that is the whole file, like the one accept_filename makes
+  if not isinstance(t.device, str) or not t.device.startswith("DISK:") or not unwrap(t.lazydata.st).contiguous: return None
+  return fn if os.path.isfile(fn:=t.device[len("DISK:"):]) and os.path.getsize(fn) == t.nbytes() else None
+
 @accept_filename
 def torch_load(t:Tensor) -> dict[str, Tensor]:
   """
@@ -189,16 +267,13 @@ def torch_load(t:Tensor) -> dict[str, Tensor]:
     byte_offset = offsets[storage[2]]+storage_offset*storage[1].itemsize
     ret = t[byte_offset:byte_offset+prod(size)*storage[1].itemsize].bitcast(storage[1])
 
-    # 7 lines to deal with permuted tensors. NOTE: this currently requires reading off the disk
+    # permuted tensors stay a view of the DISK tensor, the permute runs on the device it's copied to
     shape_strides = [(s, st) for s,st in zip(size, stride) if s != 1]
     permute_indexes = [len(shape_strides)-1-y for y in argsort([x[1] for x in shape_strides])]
     if tuple(permute_indexes) != tuple(range(len(permute_indexes))):
       intermediate_shape = tuple([shape_strides[x][0] for x in argsort(permute_indexes)])
       assert tuple([shape_strides[i][1] for i in argsort(permute_indexes)]) == strides_for_shape(intermediate_shape), "nonpermutable strides"
-      if DEBUG >= 3: print(f"WARNING: this torch load is slow. CLANG to permute {intermediate_shape} with {permute_indexes}")
-      assert storage[1] != dtypes.bfloat16, "can't CLANG permute BF16"
-      # TODO: find a nice way to support all shapetracker on disktensors
-      ret = ret.to(None).reshape(intermediate_shape).permute(permute_indexes)
+      ret = ret.reshape(intermediate_shape).permute(permute_indexes)
 
     return ret.reshape(size)
 
@@ -220,53 +295,60 @@ def torch_load(t:Tensor) -> dict[str, Tensor]:
       return intercept[name] if module_root == "torch" else super().find_class(module, name)
     def persistent_load(self, pid): return deserialized_objects.get(pid, pid)
 
-  fobj = io.BufferedReader(TensorIO(t))
-  def passthrough_reset(v: bool): return fobj.seek(0, 0) or v
-
-  if passthrough_reset(zipfile.is_zipfile(fobj)): # NOTE: passthrough_reset required to support python < 3.14
-    myzip = zipfile.ZipFile(fobj, 'r')
-    base_name = myzip.namelist()[0].split('/', 1)[0]
-    for n in myzip.namelist():
-      if n.startswith(f'{base_name}/data/'):
-        with myzip.open(n) as myfile:
-          offsets[n.split("/")[-1]] = myfile._orig_compress_start # type: ignore
-    with myzip.open(f'{base_name}/data.pkl') as myfile:
-      return TorchPickle(myfile).load()
-  elif passthrough_reset(tarfile.is_tarfile(fobj)): # NOTE: passthrough_reset required to support python < 3.11
-    with tarfile.open(fileobj=fobj, mode="r") as tar:
-      storages_offset = tar.getmember('storages').offset_data
-      f = unwrap(tar.extractfile('storages'))
-      for i in range(TorchPickle(f).load()):  # num_storages
-        (key, _, storage_type), sz = TorchPickle(f).load(), struct.unpack('<q', f.read(8))[0]
-        offsets[key] = storages_offset + f.tell()
-        f.seek(sz*storage_type.itemsize, 1)
-      f = unwrap(tar.extractfile('tensors'))
-      for _ in range(TorchPickle(f).load()):  # num_tensors
-        (key, storage_id, _), ndim, _ = TorchPickle(f).load(), struct.unpack('<i', f.read(4))[0], f.read(4)
-        size, stride = struct.unpack(f'<{ndim}q', f.read(8 * ndim)), struct.unpack(f'<{ndim}q', f.read(8 * ndim))
-        storage_offset = struct.unpack('<q', f.read(8))[0]
-        deserialized_objects[str(key)] = _rebuild_tensor_v2((None, storage_type, storage_id, None, -1), storage_offset, size, stride)
-      return {k:v.tensor if isinstance(v, Parameter) else v for k,v in TorchPickle(unwrap(tar.extractfile('pickle'))).load().items()}
-  else:
-    pkl = TorchPickle(fobj)
-    _, _, _, rwd, _, ids, base_offset = pkl.load(), pkl.load(), pkl.load(), fobj.tell(), pkl.load(), pkl.load(), fobj.tell()
-    for i in ids:
-      offsets[i] = base_offset + 8
-      base_offset += 8 + lens[i]
-    fobj.seek(rwd)
-    return TorchPickle(fobj).load()
+  # the metadata of a file is read from the file, instead of through TensorIO which runs a copy for every read
+  with (io.BufferedReader(TensorIO(t)) if (fn:=_disk_file(t)) is None else open(fn, "rb")) as fobj:
+    def passthrough_reset(v: bool): return fobj.seek(0, 0) or v
+
+    if passthrough_reset(zipfile.is_zipfile(fobj)): # NOTE: passthrough_reset required to support python < 3.14
+      myzip = zipfile.ZipFile(fobj, 'r')
+      base_name = myzip.namelist()[0].split('/', 1)[0]
+      # all the storages from the central directory, the data is after the local header (its extra field can differ from the central one)
+      for zi in myzip.infolist():
+        if zi.filename.startswith(f'{base_name}/data/'):
+          fobj.seek(zi.header_offset+26)
+          name_len, extra_len = struct.unpack('<HH', fobj.read(4))
+          offsets[zi.filename.split("/")[-1]] = zi.header_offset + 30 + name_len + extra_len
+      with myzip.open(f'{base_name}/data.pkl') as myfile:
+        return TorchPickle(myfile).load()
+    elif passthrough_reset(tarfile.is_tarfile(fobj)): # NOTE: passthrough_reset required to support python < 3.11
+      with tarfile.open(fileobj=fobj, mode="r") as tar:
+        storages_offset = tar.getmember('storages').offset_data
+        f = unwrap(tar.extractfile('storages'))
+        for i in range(TorchPickle(f).load()):  # num_storages
+          (key, _, storage_type), sz = TorchPickle(f).load(), struct.unpack('<q', f.read(8))[0]
+          offsets[key] = storages_offset + f.tell()
+          f.seek(sz*storage_type.itemsize, 1)
+        f = unwrap(tar.extractfile('tensors'))
+        for _ in range(TorchPickle(f).load()):  # num_tensors
+          (key, storage_id, _), ndim, _ = TorchPickle(f).load(), struct.unpack('<i', f.read(4))[0], f.read(4)
+          size, stride = struct.unpack(f'<{ndim}q', f.read(8 * ndim)), struct.unpack(f'<{ndim}q', f.read(8 * ndim))
+          storage_offset = struct.unpack('<q', f.read(8))[0]
+          deserialized_objects[str(key)] = _rebuild_tensor_v2((None, storage_type, storage_id, None, -1), storage_offset, size, stride)
+        return {k:v.tensor if isinstance(v, Parameter) else v for k,v in TorchPickle(unwrap(tar.extractfile('pickle'))).load().items()}
+    else:
+      pkl = TorchPickle(fobj)
+      _, _, _, rwd, _, ids, base_offset = pkl.load(), pkl.load(), pkl.load(), fobj.tell(), pkl.load(), pkl.load(), fobj.tell()
+      for i in ids:
+        offsets[i] = base_offset + 8
+        base_offset += 8 + lens[i]
+      fobj.seek(rwd)
+      return TorchPickle(fobj).load()
+
+ggml_native_dtypes = { 0: dtypes.float32, 1: dtypes.float16, 16: dtypes.int8, 17: dtypes.int16, 18: dtypes.int32 }
+# quantized types to (number of elements, number of bytes) of a block
+ggml_blocks = { 2: (32, 18), 3: (32, 20), 8: (32, 34), 10: (256, 84), 11: (256, 110), 12: (256, 144), 13: (256, 176), 14: (256, 210) }
 
 def ggml_data_to_tensor(t: Tensor, n: int, ggml_type: int) -> Tensor:
   """
   Converts ggml tensor data to a tinygrad tensor.
 
   Supported native types: float32 (id: 0), float16 (id: 1), int8 (id: 16), int16 (id: 17), int32 (id: 18)
-  Supported quantized types: Q4_0 (id: 2), Q4_1 (id: 3), Q8_0 (id: 8), Q6_K (id: 14)
+  Supported quantized types: Q4_0 (id: 2), Q4_1 (id: 3), Q8_0 (id: 8), Q2_K (id: 10), Q3_K (id: 11), Q4_K (id: 12), Q5_K (id: 13), Q6_K (id: 14)
   """
   # https://github.com/ggerganov/ggml/blob/6dccc647264f5429df2624f36138f601e7ce23e5/include/ggml.h#L356
 
   # native types
-  if (dtype := { 0: dtypes.float32, 1: dtypes.float16, 16: dtypes.int8, 17: dtypes.int16, 18: dtypes.int32 }.get(ggml_type)) is not None:
+  if (dtype := ggml_native_dtypes.get(ggml_type)) is not None:
     return t[:dtype.itemsize * n].bitcast(dtype)
 
   def q_to_uint8(t: Tensor, b: int) -> Tensor:
@@ -274,53 +356,95 @@ def ggml_data_to_tensor(t: Tensor, n: int, ggml_type: int) -> Tensor:
     shift_tensor, bitmask = Tensor.stack(*[ Tensor(2**(i*b), device=t.device, dtype=t.dtype) for i in range(8//b) ]), 0xff >> (8 - b)
     return t.unsqueeze(-1).expand((*t.shape,8//b)).idiv(shift_tensor).bitwise_and(bitmask).transpose(-1, -2).flatten(-2)
 
-  # map to (number of elements, number of bytes)
-  if (nelements_nbytes := { 2: (32, 18), 3: (32, 20), 14: (256, 210), 8: (32, 34) }.get(ggml_type)) is not None:
+  # NOTE: the scheduler realizes a computed tensor before it's expanded, so the bytes of the scales are expanded to every weight before they're
+  # decoded. with only loads of the blocks expanded, the dequantization fuses into the kernel using the weights (e.g. a matmul)
+  def rep(x: Tensor, n: int) -> Tensor: return x.unsqueeze(-1).expand((*x.shape, n)).flatten(-2)
+  def const(vals: list[int]) -> Tensor: return Tensor.stack(*[ Tensor(v, device=t.device, dtype=dtypes.uint8) for v in vals ])
+  def f16(blocks: Tensor, s: int, n: int) -> Tensor:
+    return blocks[:,s:s+2].unsqueeze(1).expand((-1, n, 2)).bitcast(dtypes.float16).cast(dtypes.float32).flatten(1)
+
+  # the 6 bit scales and mins of every 32 weights of Q4_K and Q5_K, the first 4 are the low bits of bytes 0-7, the last 4 are the nibbles of
+  # bytes 8-11 with the top 2 bits of bytes 0-7 as their high bits
+  def k4_scale_min(s: Tensor) -> tuple[Tensor, Tensor]:
+    hi = rep(const([0]*4 + [48]*4), 32)
+    sc = rep(s[:,:12].reshape((-1, 3, 4))[:,::2].flatten(1), 32).bitwise_and(rep(const([63]*4 + [15]*4), 32))
+    mn = rep(s[:,4:12], 32).idiv(rep(const([1]*4 + [16]*4), 32)).bitwise_and(63)
+    return (sc.bitwise_or(rep(s[:,:4].repeat((1, 2)), 32).rshift(6).lshift(4).bitwise_and(hi)),
+            mn.bitwise_or(rep(s[:,:8], 32).rshift(6).lshift(4).bitwise_and(hi)))
+
+  if (nelements_nbytes := ggml_blocks.get(ggml_type)) is not None:
     blocks = t[:(n//nelements_nbytes[0])*nelements_nbytes[1]].reshape((-1, nelements_nbytes[1]))
-    if ggml_type == 2: return (q_to_uint8(blocks[:,2:], 4).bitcast(dtypes.int8) - 8) * blocks[:,:2].bitcast(dtypes.float16).cast(dtypes.float32)
-    if ggml_type == 3:
-      d, m = (blocks[:,s:s+2].bitcast(dtypes.float16).cast(dtypes.float32) for s in [ 0, 2 ])
-      return q_to_uint8(blocks[:,4:], 4).bitcast(dtypes.int8) * d + m
-    if ggml_type == 8: return blocks[:,:2].bitcast(dtypes.float16).cast(dtypes.float32) * blocks[:,2:].bitcast(dtypes.int8)
+    if ggml_type == 2: return (q_to_uint8(blocks[:,2:], 4).bitcast(dtypes.int8) - 8) * f16(blocks, 0, 32)
+    if ggml_type == 3: return q_to_uint8(blocks[:,4:], 4).bitcast(dtypes.int8) * f16(blocks, 0, 32) + f16(blocks, 2, 32)
+    if ggml_type == 8: return f16(blocks, 0, 32) * blocks[:,2:].bitcast(dtypes.int8)
+    if ggml_type == 10:
+      # scales[16] (4 bit scale and min of every 16 weights), qs[64], d, dmin
+      sc = rep(blocks[:,:16], 16)
+      return f16(blocks, 80, 256) * sc.bitwise_and(0xF) * q_to_uint8(blocks[:,16:80].reshape((-1, 2, 32)), 2).flatten(-2) - \
+        f16(blocks, 82, 256) * sc.rshift(4)
+    if ggml_type == 11:
+      # hmask[32], qs[64], scales[12] (6 bit scale of every 16 weights, the nibbles of bytes 0-7 then 2 bit pairs of bytes 8-11), d
+      lo = rep(blocks[:,96:104].repeat((1, 2)), 16).idiv(rep(const([1]*8 + [16]*8), 16)).bitwise_and(0xF)
+      hi = rep(blocks[:,104:108].repeat((1, 4)), 16).idiv(rep(const([1]*4 + [4]*4 + [16]*4 + [64]*4), 16)).bitwise_and(3).lshift(4)
+      q = q_to_uint8(blocks[:,32:96].reshape((-1, 2, 32)), 2).flatten(-2).bitwise_or(q_to_uint8(blocks[:,:32], 1).lshift(2))
+      return f16(blocks, 108, 256) * (lo.bitwise_or(hi).bitcast(dtypes.int8) - 32) * (q.bitcast(dtypes.int8) - 4)
+    if ggml_type in (12, 13):
+      # d, dmin, scales[12], (Q5_K: qh[32]), qs[128]
+      sc, mn = k4_scale_min(blocks[:,4:16])
+      q = q_to_uint8(blocks[:,-128:].reshape((-1, 4, 32)), 4).flatten(-2)
+      if ggml_type == 13: q = q.bitwise_or(q_to_uint8(blocks[:,16:48], 1).lshift(4))
+      return f16(blocks, 0, 256) * sc * q - f16(blocks, 2, 256) * mn
     if ggml_type == 14:
       xl, xh = q_to_uint8(blocks[:,:128].reshape((-1, 2, 64)), 4), q_to_uint8(blocks[:,128:192].reshape((-1, 2, 32)), 2).lshift(4)
-      scales = blocks[:,192:208].bitcast(dtypes.int8).unsqueeze(-1).expand((-1, 16, 16)).reshape((-1, 256))
-      d = blocks[:,-2:].bitcast(dtypes.float16).cast(dtypes.float32).expand((-1, 256))
-      return d * (xl.bitwise_or(xh).bitcast(dtypes.int8) - 32).flatten(-2) * scales
+      scales = rep(blocks[:,192:208], 16).bitcast(dtypes.int8)
+      return f16(blocks, 208, 256) * (xl.bitwise_or(xh).bitcast(dtypes.int8) - 32).flatten(-2) * scales
   raise ValueError(f"GGML type '{ggml_type}' is not supported!")
 
 @accept_filename
-def gguf_load(tensor: Tensor) -> tuple[dict, dict[str, Tensor]]:
+def gguf_load(tensor: Tensor, quantized=False) -> tuple[dict, dict[str, Tensor]]:
   """
   Loads a gguf file from a tensor.
 
   ```python
   fn = "Meta-Llama-3-8B-Instruct.Q4_0.gguf"
-  gguf_tensor = Tensor.empty(os.stat(fn).st_size, dtype=dtypes.uint8, device=f"disk:{fn}").to(Device.DEFAULT)
-  kv_data, state_dict = gguf_load(gguf_tensor)
+  kv_data, state_dict = gguf_load(fn)
   ```
+
+  Only the header is read from the file, a weight is read when it's used. DISK can't dequantize, so the quantized weights are copied to and
+  dequantized on `Device.DEFAULT`.
+  With `quantized=True`, the bytes of every weight are realized on `Device.DEFAULT` and the weights are left as their (unrealized)
+  dequantization, which fuses into the kernels using them. Use `load_state_dict(..., realize=False)` to keep them quantized in a model.
   """
-  reader, kv_data, state_dict = io.BufferedReader(TensorIO(tensor), 1_000_000), {}, {}
-  def read_unpack(fmt: str, n: int): return struct.unpack(fmt, reader.read(n))[0]
-  def read_str(): return str(reader.read(read_uint64()), "utf-8")
-  def read_arr():
-    reader, n = readers[read_int32()], read_uint64()
-    return [ reader() for _ in range(n) ]
-
-  readers: dict[int, Callable[[], Any]] = { 8: read_str, 9: read_arr, **{ t: functools.partial(read_unpack, "<"+f, nb) for t,f,nb in \
-    [ (0,"c",1), (1,"b",1), (2,"H",2), (3,"h",2), (4,"I",4), (5,"i",4), (6,"f",4), (7,"?",1), (10,"Q",8), (11,"q",8), (12,"d",8) ] } }
-  read_uint32, read_int32, read_uint64, read_int64 = readers[4], readers[5], readers[10], readers[11]
-
-  magic, version, n_tensors, n_kv = reader.read(4), read_int32(), read_int64(), read_int64()
-  if magic != b"GGUF" or version not in [2, 3]: raise ValueError("Invalid GGUF format!")
-  for _ in range(n_kv):
-    k, typ = read_str(), read_int32()
-    kv_data[k] = readers[typ]()
-
-  t_infos = [ (read_str(), tuple(read_uint64() for _ in range(read_uint32())), read_int32(), read_uint64()) for _ in range(n_tensors) ]
-  alignment, pos = kv_data.get("general.alignment", 32), reader.tell()
-  data_start = round_up(pos, alignment)
-
-  for name, dims, typ, off in t_infos: state_dict[name] = ggml_data_to_tensor(tensor[data_start + off:], prod(dims), typ).reshape(*reversed(dims))
+  kv_data, state_dict = {}, {}
+  with (io.BufferedReader(TensorIO(tensor), 1_000_000) if (fn:=_disk_file(tensor)) is None else open(fn, "rb")) as reader:
+    def read_unpack(fmt: str, n: int): return struct.unpack(fmt, reader.read(n))[0]
+    def read_str(): return str(reader.read(read_uint64()), "utf-8")
+    def read_arr():
+      reader, n = readers[read_int32()], read_uint64()
+      return [ reader() for _ in range(n) ]
+
+    readers: dict[int, Callable[[], Any]] = { 8: read_str, 9: read_arr, **{ t: functools.partial(read_unpack, "<"+f, nb) for t,f,nb in \
+      [ (0,"c",1), (1,"b",1), (2,"H",2), (3,"h",2), (4,"I",4), (5,"i",4), (6,"f",4), (7,"?",1), (10,"Q",8), (11,"q",8), (12,"d",8) ] } }
+    read_uint32, read_int32, read_uint64, read_int64 = readers[4], readers[5], readers[10], readers[11]
+
+    magic, version, n_tensors, n_kv = reader.read(4), read_int32(), read_int64(), read_int64()
+    if magic != b"GGUF" or version not in [2, 3]: raise ValueError("Invalid GGUF format!")
+    for _ in range(n_kv):
+      k, typ = read_str(), read_int32()
+      kv_data[k] = readers[typ]()
+
+    t_infos = [ (read_str(), tuple(read_uint64() for _ in range(read_uint32())), read_int32(), read_uint64()) for _ in range(n_tensors) ]
+    alignment, pos = kv_data.get("general.alignment", 32), reader.tell()
+    data_start = round_up(pos, alignment)
+
+  on_disk = isinstance(tensor.device, str) and tensor.device.startswith("DISK")
+  for name, dims, typ, off in t_infos:
+    if typ in ggml_native_dtypes: nbytes = prod(dims) * ggml_native_dtypes[typ].itemsize
+    elif typ in ggml_blocks: nbytes = prod(dims) // ggml_blocks[typ][0] * ggml_blocks[typ][1]
+    else: raise ValueError(f"GGML type '{typ}' is not supported!")
+    data = tensor[data_start + off:data_start + off + nbytes]
+    if (on_disk and typ in ggml_blocks) or quantized: data = data.to(None)
+    if quantized: data = data.contiguous().realize()
+    state_dict[name] = ggml_data_to_tensor(data, prod(dims), typ).reshape(*reversed(dims))
 
   return kv_data, state_dict
@@ -795,9 +795,88 @@ def deconstruct_function(fxn:Callable) -> tuple:
   ret = fxn.__code__, new_globals, fxn.__name__, fxn.__defaults__
   return pickle.loads(pickle.dumps(ret)) if getenv("TEST_PICKLE") else ret
 
+# *** pattern compiler ***
+
+# PatternMatcher.rewrite dispatches on (op, dtype, src ops) to the patterns that can match, each compiled to a python function
+UPAT_COMPILE = ContextVar("UPAT_COMPILE", 1)
+
+def _upat_alternatives(p:UPat) -> list[tuple[UPat, Any]]:
+  # expand UPatAny and src permutations into deterministic alternatives, in the order UPat.match yields their stores
+  # an alternative is (UPat, None | tuple of the src alternatives | [alternative every src matches])
+  if isinstance(p, UPatAny): return flatten([_upat_alternatives(x) for x in p.src[0]])
+  if p.src is None: return [(p, None)]
+  ret: list[tuple[UPat, Any]] = []
+  for vp in p.src:
+    if isinstance(vp, itertools.repeat):
+      if len(alts:=_upat_alternatives(next(vp))) != 1: raise NotImplementedError("repeated src must match one way")
+      ret.append((p, alts))
+      continue
+    children = [_upat_alternatives(x) for x in vp]
+    # with allow_any_len, missing srcs aren't matched at all, so an unnamed child can't be expanded into alternatives
+    if p.allowed_len == -1 and any(len(alts) != 1 and not _upat_names(x) for x,alts in zip(vp, children)): raise NotImplementedError("any len src")
+    ret.extend((p, tuple(c)) for c in itertools.product(*children))
+  if len(ret) > 64: raise NotImplementedError("too many alternatives")
+  return ret
+
+def _upat_names(p:UPat) -> bool:
+  if p.name is not None: return True
+  if p.src is None: return False
+  return any(_upat_names(x) for vp in p.src for x in ([next(vp)] if isinstance(vp, itertools.repeat) else vp))
+
+def _upat_conds(alt:tuple[UPat, Any], x:str, names:dict[str, str], consts:dict[str, Any], depth:int=0) -> list[str]:
+  def const(v) -> str:
+    consts[k:=f"c{len(consts)}"] = v
+    return k
+  p, src = alt
+  conds = []
+  if p.op is not None: conds.append(f"{x}.op is {const(p.op[0])}" if len(p.op) == 1 else f"{x}.op in {const(frozenset(p.op))}")
+  if p.dtype is not None: conds.append(f"({x}.dtype in {(dt:=const(p.dtype))} or {x}.dtype.scalar() in {dt})")
+  if p.arg is not None: conds.append(f"not ({const(p.arg)} != {x}.arg)")
+  if p.name is not None:
+    if p.name in names: conds.append(f"{x} is {names[p.name]}")
+    else: names[p.name] = x
+  if p.allowed_len != -1: conds.append(f"len({x}.src) == {p.allowed_len}")
+  if isinstance(src, tuple):
+    for i,c in enumerate(src):
+      sub = " and ".join(_upat_conds(c, f"{x}.src[{i}]", names, consts, depth+1)) or "True"
+      if p.allowed_len != -1: conds.append(f"({sub})")
+      # a missing src that would bind names leaves them out of the call, only the names can't be missing
+      else: conds.append(f"(len({x}.src) > {i} and ({sub}))" if _upat_names(c[0]) else f"(len({x}.src) <= {i} or ({sub}))")
+  elif src is not None:
+    # names in a repeated src are bound by the first one, the rest must match them
+    if _upat_names(src[0][0]): conds += [f"len({x}.src) > 0"] + _upat_conds(src[0], f"{x}.src[0]", names, consts, depth+1)
+    sub = " and ".join(_upat_conds(src[0], f"_x{depth}", names.copy(), consts, depth+1)) or "True"
+    conds.append(f"all({sub} for _x{depth} in {x}.src)")
+  return conds
+
+def upat_compile(p:UPat, fxn:Callable, has_ctx:bool) -> Callable[[UOp, Any], UOp|None]:
+  """Compiles the match of `p` followed by the call to `fxn` into one function of (uop, ctx), falling back to UPat.match if it can't."""
+  def interpreted(uop:UOp, ctx) -> UOp|None:
+    for match in p.match(uop, {}):
+      if (ret:=(fxn(ctx=ctx, **match) if has_ctx else fxn(**match))) is not None: return ret
+    return None
+  # a missing name falls back to the default of its argument when interpreted
+  if not UPAT_COMPILE or any(x.default is not inspect.Parameter.empty for x in inspect.signature(fxn).parameters.values()): return interpreted
+  try: alts = _upat_alternatives(p)
+  except NotImplementedError: return interpreted
+  consts: dict[str, Any] = {"fxn": fxn}
+  lines = ["def compiled_match(uop, ctx):"]
+  for alt in alts:
+    names: dict[str, str] = {}
+    conds = _upat_conds(alt, "uop", names, consts)
+    args = ", ".join((["ctx=ctx"] if has_ctx else []) + [f"{k}={v}" for k,v in names.items()])
+    lines += [f"  if {' and '.join(conds) or 'True'}:", f"    if (ret:=fxn({args})) is not None: return ret"]
+  try: exec(compile("\n".join(lines + ["  return None"]), f"<upat {p.location[0]}:{p.location[1]}>", "exec"), consts)  # pylint: disable=exec-used
+  except SyntaxError: return interpreted  # a name that isn't a valid keyword argument
+  return consts["compiled_match"]
+
+def _upat_can_match(p:UPat, op:Optional[Ops]) -> bool:
+  if isinstance(p, UPatAny): return any(_upat_can_match(x, op) for x in p.src[0])
+  return p.op is None or op in p.op
+
 class PatternMatcher:
-  def __init__(self, patterns:list[tuple[UPat, Callable]]):
-    self.patterns = patterns
+  def __init__(self, patterns:list[tuple[UPat, Callable]], memoize:bool=False):
+    self.patterns, self.memoize = patterns, memoize
     # NOTE: use of DefaultDict here is very dangerous! all keys will live for the lifetime of the PatternMatcher!
     self.pdict: dict[Ops, list[tuple[UPat, Callable, set, bool]]] = {}
     # uop is required, arg is optional
@@ -806,18 +885,33 @@ class PatternMatcher:
       tuple_fxn = fxn if isinstance(fxn, tuple) else deconstruct_function(fxn)
       real_fxn = types.FunctionType(*tuple_fxn)
       for uop in p.op: self.pdict.setdefault(uop, []).append((p, real_fxn, p.early_reject, 'ctx' in inspect.signature(real_fxn).parameters))
+    # (op, dtype, src ops) -> compiled matchers of the patterns that can match it, in order
+    self.dispatch: dict[tuple[Ops, DType, tuple[Ops, ...]], list[Callable[[UOp, Any], UOp|None]]] = {}
+    self.compiled: dict[tuple[UPat, Callable], Callable[[UOp, Any], UOp|None]] = {}
+    # if the patterns are pure functions of the UOp, graph_rewrite without ctx shares its results across calls (top down, bottom up)
+    self.memo: tuple[RewriteMemo, RewriteMemo]|None = (RewriteMemo(), RewriteMemo()) if memoize else None
 
-  def __reduce__(self): return PatternMatcher, ([(x,deconstruct_function(fxn) if fxn.__name__ == "<lambda>" else fxn) for x,fxn in self.patterns],)
+  def __reduce__(self):
+    return PatternMatcher, ([(x,deconstruct_function(fxn) if fxn.__name__ == "<lambda>" else fxn) for x,fxn in self.patterns], self.memoize)
 
   @functools.lru_cache(None)  # pylint: disable=method-cache-max-size-none
-  def __add__(self, more:PatternMatcher): return PatternMatcher(self.patterns+more.patterns)
+  def __add__(self, more:PatternMatcher): return PatternMatcher(self.patterns+more.patterns, self.memoize and more.memoize)
+
+  def _dispatch(self, key:tuple[Ops, DType, tuple[Ops, ...]]) -> list[Callable[[UOp, Any], UOp|None]]:
+    op, dtype, src_ops = key
+    ret = []
+    for p,fxn,early_reject,has_ctx in self.pdict.get(op, []):
+      if not early_reject.issubset(src_ops) or (p.dtype is not None and dtype not in p.dtype and dtype.scalar() not in p.dtype): continue
+      if p.allowed_len != -1 and len(src_ops) != p.allowed_len: continue
+      if p.src is not None and not any(all(_upat_can_match(x, o) for x,o in zip(vp, src_ops)) for vp in p.src): continue
+      if (p, fxn) not in self.compiled: self.compiled[(p, fxn)] = upat_compile(p, fxn, has_ctx)
+      ret.append(self.compiled[(p, fxn)])
+    return ret
 
   def rewrite(self, uop:UOp, ctx=None) -> UOp|None:
-    ler = {u.op for u in uop.src}
-    for p,fxn,early_reject,has_ctx in self.pdict.get(uop.op, []):
-      if not early_reject.issubset(ler): continue
-      for match in p.match(uop, {}):
-        if (ret:=(fxn(ctx=ctx, **match) if has_ctx else fxn(**match))) is not None: return ret
+    if (fxns:=self.dispatch.get(key:=(uop.op, uop.dtype, tuple([u.op for u in uop.src])))) is None: fxns = self.dispatch[key] = self._dispatch(key)
+    for fxn in fxns:
+      if (ret:=fxn(uop, ctx)) is not None: return ret
     return None
 
 # *** tracking pattern matcher ***
@@ -892,11 +986,22 @@ def launch_viz(env_str:str, data:str):
 
 # *** simple graph rewrite engine ***
 
+REWRITE_CACHE_SIZE = ContextVar("REWRITE_CACHE_SIZE", 1 << 18)
+class RewriteMemo:
+  """The replace dict of a memoized PatternMatcher, shared by all its graph_rewrites. It's weak on the UOp, and bounded by REWRITE_CACHE_SIZE."""
+  def __init__(self): self.cache: weakref.WeakKeyDictionary[UOp, UOp|None] = weakref.WeakKeyDictionary()
+  # an unchanged UOp is stored as None, it would keep itself alive as its own value
+  def get(self, n:UOp) -> UOp|None: return n if (rn:=self.cache.get(n, n)) is None else (None if rn is n else rn)
+  def __setitem__(self, n:UOp, rn:UOp):
+    if len(self.cache) >= REWRITE_CACHE_SIZE.value: self.cache.clear()
+    self.cache[n] = None if rn is n else rn
+
 class RewriteContext:
-  def __init__(self, pm, ctx=None):
+  def __init__(self, pm, ctx=None, bottom_up=False):
     self.pm: PatternMatcher = pm
     self.ctx = ctx
-    self.replace: dict[UOp, UOp] = {}
+    self.replace: dict[UOp, UOp]|RewriteMemo = {}
+    if pm.memo is not None and ctx is None and REWRITE_CACHE_SIZE and not TRACK_MATCH_STATS: self.replace = pm.memo[bottom_up]
   def top_down_rewrite(self, n:UOp) -> UOp:
     if (rn := self.replace.get(n)) is not None: return rn
     new_src = tuple([self.top_down_rewrite(x) for x in n.src])
@@ -914,12 +1019,12 @@ class RewriteContext:
 def graph_rewrite(sink:UOp, pm:PatternMatcher, ctx=None, bottom_up=False) -> UOp:
   if TRACK_MATCH_STATS >= 2 and not bottom_up and len(tracked_ctxs) != 0: # TODO: make viz work with bottom_up=True
     tracked_ctxs[-1].append(TrackedGraphRewrite(((frm:=sys._getframe(1)).f_code.co_filename, frm.f_lineno), sink))
-  return RewriteContext(pm, ctx).bottom_up_rewrite(sink) if bottom_up else RewriteContext(pm, ctx).top_down_rewrite(sink)
+  return RewriteContext(pm, ctx, True).bottom_up_rewrite(sink) if bottom_up else RewriteContext(pm, ctx).top_down_rewrite(sink)
 
 def graph_rewrite_map(sink:UOp, pm:PatternMatcher, ctx=None, bottom_up=False) -> dict[UOp, UOp]:
   if TRACK_MATCH_STATS >= 2 and not bottom_up and len(tracked_ctxs) != 0: # TODO: make viz work with bottom_up=True
     tracked_ctxs[-1].append(TrackedGraphRewrite(((frm:=sys._getframe(1)).f_code.co_filename, frm.f_lineno), sink))
-  rewrite_ctx = RewriteContext(pm, ctx)
+  rewrite_ctx = RewriteContext(pm, ctx, bottom_up)
   return {k:(rewrite_ctx.bottom_up_rewrite(k) if bottom_up else rewrite_ctx.top_down_rewrite(k)) for k in list(sink.toposort)[::-1]}
 
 
@@ -1137,7 +1242,7 @@ symbolic_simple = PatternMatcher([
   # *** cast ***
   (UPat(Ops.CAST, name="root", src=UPat.cvar("c")), lambda root, c: root.const_like(c.arg)),
   (UPat(Ops.CAST, name="root"), lambda root: root.src[0] if root.dtype == root.src[0].dtype else None),
-])
+], memoize=True)
 
 symbolic = symbolic_simple+PatternMatcher([
   # ** COMMUTATIVE flipping **
@@ -1199,7 +1304,7 @@ symbolic = symbolic_simple+PatternMatcher([
   # ** mod **
   # mod folding
   (UPat.var("x") % UPat.var("y"), lambda x,y: div_and_mod_folding(x,y,Ops.MOD)),
-])
+], memoize=True)
 
 
 symbolic_flat = symbolic+PatternMatcher([
@@ -1207,7 +1312,7 @@ symbolic_flat = symbolic+PatternMatcher([
   (-1 * (UPat.var("x") + UPat.var("y")), lambda x,y: (-x)+(-y)),  # -(x+y) -> -x + -y
   # (x+y)*c -> x*c+y*c. only for int, float has inf*0=nan issue
   ((UPat.var("x", dtypes.ints) + UPat.var("y")) * UPat.cvar("c"), lambda x,y,c: x*c+y*c),
-])
+], memoize=True)
 
 _substitute = PatternMatcher([(UPat(tuple(Ops), name="x"), lambda ctx,x: ctx.get(x,None))])
 
@@ -56,7 +56,8 @@ class Estimates:
     for u in uops:
       if u.op is Ops.RANGE:
         mult_stack.append(mults)
-        mults *= (u.src[1] - u.src[0]).ssimplify()
+        # NOTE: the last chunk of a threaded loop is shorter, it's counted as a full one
+        mults *= int(rng.vmax) if isinstance(rng:=(u.src[1] - u.src[0]).ssimplify(), UOp) and any(x.op is Ops.SPECIAL for x in rng.toposort) else rng
       elif u.op is Ops.ENDRANGE: mults = mult_stack.pop(-1)
       elif u.op is Ops.SPECIAL: mults *= u.arg[1] # NOTE: we don't push to the mult_stack here, you can't end these
       elif u.op is Ops.LOAD: lds += u.dtype.itemsize * mults
@@ -120,6 +121,8 @@ class Renderer:
   supports_float4: bool = True
   has_local: bool = True
   has_shared: bool = True
+  # if it has no locals, the global loop can be split across CPU_THREADS threads with a "core" SPECIAL
+  has_threads: bool = False
   # NOTE: these two should be in (x,y,z) order to match the max_sizes argument in get_grouped_dims
   global_max: Optional[tuple[int, ...]] = (0x8FFFFFFF,) * (3) # TODO: UOps.SPECIAL int32 indexes right now
   local_max: Optional[tuple[int, ...]] = (0x8FFFFFFF,) * (3) # TODO: UOps.SPECIAL int32 indexes right now
@@ -71,7 +71,7 @@ class CStyleLanguage(Renderer):
   smem_prefix_for_cast: bool = True
   arg_int_prefix: str = "const int"
   barrier: str = ""
-  code_for_workitem: dict[Union[Literal["g"], Literal["l"], Literal["i"]], Callable] = {}
+  code_for_workitem: dict[Union[Literal["g"], Literal["l"], Literal["i"], Literal["c"]], Callable] = {}
   extra_args: list[str] = []
   float4: Optional[str] = None
   type_map: dict[DType, str] = {}
@@ -161,12 +161,14 @@ class ClangRenderer(CStyleLanguage):
   device = "CLANG"
   float4 = "(float4)"
   has_local = False
+  has_threads = True
   global_max = None
   infinity = "__builtin_inff()"
   nan = '__builtin_nanf("")'
 
   # language options
   buffer_suffix = " restrict"
+  code_for_workitem = {"c": lambda x: "core_id"}
   type_map = {dtypes.bool:"_Bool", dtypes.half:"__fp16"}
   code_for_op = {**({k:v for k,v in CStyleLanguage.code_for_op.items() if k not in [Ops.EXP2, Ops.SIN, Ops.LOG2]}),
                  Ops.SQRT: lambda x,dtype: f"__builtin_sqrt({x})" if dtype == dtypes.float64 else f"__builtin_sqrtf({x})"}
@@ -184,6 +186,8 @@ class ClangRenderer(CStyleLanguage):
     return f"typedef {self.render_dtype(dt.scalar())} {self.render_dtype(dt)} __attribute__((aligned({(sz:=dt.itemsize)}),vector_size({sz})));"
 
   def render_kernel(self, function_name, kernel, bufs, uops, prefix=None) -> str:
+    # the thread index is the last arg, after the vars
+    if any(u.op is Ops.SPECIAL for u in uops): bufs = bufs + [("core_id", (dtypes.int, False))]
     prefix = [self.render_vector_prefix(dt) for dt in uops_to_dtypes(uops) if dt.count > 1]
     # https://github.com/corsix/amx
     for name, (N, M, _), dtype_in, _, _, _, _, _ in dedup([uop.arg for uop in uops if uop.op is Ops.WMMA]):
@@ -82,6 +82,7 @@ class LLVMRenderer(Renderer):
   supports_float4 = False
   has_local = False
   has_shared = False
+  has_threads = True
   global_max = None
 
   extra_matcher = PatternMatcher([
@@ -98,6 +99,7 @@ class LLVMRenderer(Renderer):
   def render(self, name: str, uops: list[UOp]) -> str:
     r: dict[UOp, str] = {}
     args: list[str] = []
+    thread_args: list[str] = []
     kernel: list[str] = []
     end_lines: dict[str, None] = {}
     vc = -1
@@ -118,6 +120,10 @@ class LLVMRenderer(Renderer):
       if u.op in (Ops.DEFINE_GLOBAL, Ops.DEFINE_VAR):
         r[u] = f"%data{u.arg}" if u.op is Ops.DEFINE_GLOBAL else f"%{u.arg[0]}"
         args.append(f"{ldt(u.dtype)}{' noalias' if isinstance(u.dtype, PtrDType) else ''} {r[u]}")
+      elif u.op is Ops.SPECIAL:
+        # the thread index is the last arg, after the vars
+        r[u] = f"%{u.arg[0]}"
+        thread_args.append(f"{ldt(u.dtype)} {r[u]}")
       elif u.op is Ops.ASSIGN: pass  # assign is already handled by the first pass
       elif u.op is Ops.DEFINE_ACC: r[u] = r[u.src[0]]  # a define acc can be used and never be assigned to
       elif u.op is Ops.CONST: r[u] = lconst(u.arg, u.dtype)
@@ -141,4 +147,4 @@ class LLVMRenderer(Renderer):
               r[x] = f"%acc{vc}"
 
     # output the function
-    return f"define void @{name}({','.join(args)}) {{\n" + '\n'.join(kernel) + "\n  ret void\n}\n"+'\n'.join(end_lines.keys())
+    return f"define void @{name}({','.join(args+thread_args)}) {{\n" + '\n'.join(kernel) + "\n  ret void\n}\n"+'\n'.join(end_lines.keys())
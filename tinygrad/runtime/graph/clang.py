@@ -0,0 +1,50 @@
+from typing import cast
+import ctypes
+from tinygrad.helpers import DEBUG, dedup, cpu_time_execution
+from tinygrad.device import Buffer, CPUProgram, cpu_launch
+from tinygrad.engine.realize import ExecItem, CompiledRunner
+from tinygrad.engine.jit import GraphRunner, GraphException
+from tinygrad.ops import Variable
+
+class ClangGraph(GraphRunner):
+  def __init__(self, jit_cache: list[ExecItem], input_rawbuffers: list[Buffer], var_vals: dict[Variable, int]):
+    super().__init__(jit_cache, input_rawbuffers, var_vals)
+    if not all(isinstance(ji.prg, CompiledRunner) and isinstance(ji.prg._prg, CPUProgram) for ji in jit_cache): raise GraphException
+
+    # the kernels are called through tables of their function pointers, buffers and vars, so the source of the batch has no addresses and is
+    # compiled once. the inputs are the first buffers in the table, they and the vars are patched before every call
+    prgs = [cast(CompiledRunner, ji.prg) for ji in jit_cache]
+    self.fxns = (ctypes.c_void_p * len(prgs))(*[ctypes.cast(cast(CPUProgram, prg._prg).fxn, ctypes.c_void_p).value for prg in prgs])
+    bufs = dedup([b for j,ji in enumerate(jit_cache) for i,b in enumerate(ji.bufs) if (j,i) not in self.input_replace])
+    buf_idx = {id(b):len(input_rawbuffers)+k for k,b in enumerate(bufs)}
+    self.bufs = (ctypes.c_void_p * (len(input_rawbuffers) + len(bufs)))(*[None]*len(input_rawbuffers),
+                                                                          *[ctypes.addressof(cast(Buffer, b)._buf) for b in bufs])
+    self.vals = (ctypes.c_int32 * max(len(self.vars), 1))()
+
+    def call(j:int, ji:ExecItem, core_id:bool) -> str:
+      args = [f"bufs[{self.input_replace[(j,i)] if (j,i) in self.input_replace else buf_idx[id(b)]}]" for i,b in enumerate(ji.bufs)]
+      args += [f"vals[{self.vars.index(v)}]" for v in prgs[j].p.vars] + (["core_id"] if core_id else [])
+      types = ["void*"]*len(ji.bufs) + ["int"]*(len(prgs[j].p.vars) + core_id)
+      return f"  ((void (*)({', '.join(types)}))fxns[{j}])({', '.join(args)});"
+
+    # a kernel split across CPU_THREADS is its own step, run on every thread. the kernels between them are one native call
+    steps: list[list[int]] = []
+    for j,prg in enumerate(prgs):
+      if cpu_threads(prg) > 1 or not steps or cpu_threads(prgs[steps[-1][0]]) > 1: steps.append([j])
+      else: steps[-1].append(j)
+    self.steps: list[tuple[CPUProgram, int]] = []
+    for step in steps:
+      threads = cpu_threads(prgs[step[0]])
+      src = "\n".join([f"void batched(void **fxns, void **bufs, int *vals{', int core_id' if threads > 1 else ''}) {{",
+                       *[call(j, jit_cache[j], threads > 1) for j in step], "}"])
+      if DEBUG >= 4: print(src)
+      self.steps.append((CPUProgram("batched", self.dev.compiler.compile_cached(src)), threads))
+
+  def __call__(self, rawbufs: list[Buffer], var_vals: dict[Variable, int], wait=False):
+    for i,b in enumerate(rawbufs): self.bufs[i] = ctypes.addressof(b._buf)
+    for i,v in enumerate(self.vars): self.vals[i] = var_vals[v]
+    def run():
+      for prg,threads in self.steps: cpu_launch(lambda *core_id: prg.fxn(self.fxns, self.bufs, self.vals, *core_id), threads)
+    return cpu_time_execution(run, enable=wait)
+
+def cpu_threads(prg:CompiledRunner) -> int: return prg.p.global_size[0] if prg.p.global_size is not None else 1
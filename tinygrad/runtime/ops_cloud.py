@@ -5,13 +5,14 @@
 # it should be a secure (example: no use of pickle) boundary. HTTP is used for RPC
 
 from __future__ import annotations
-from typing import Optional, Any
+from typing import Optional, Any, Sequence
 from collections import defaultdict
-from dataclasses import dataclass, field
-import multiprocessing, functools, http.client, hashlib, json, time, os, binascii, struct, ast, contextlib
+from concurrent.futures import Future
+from dataclasses import dataclass, field, fields
+import multiprocessing, functools, hashlib, json, time, os, binascii, struct, contextlib, socket, io, threading, queue, urllib.parse
 from http.server import HTTPServer, BaseHTTPRequestHandler
 from tinygrad.renderer import Renderer
-from tinygrad.dtype import dtypes
+from tinygrad.dtype import dtypes, ImageDType
 from tinygrad.helpers import getenv, DEBUG, fromimport, unwrap, Timing
 from tinygrad.device import Compiled, Allocator, Compiler, Device, BufferSpec
 
@@ -26,13 +27,13 @@ class BufferAlloc(CloudRequest): buffer_num: int; size: int; options: BufferSpec
 class BufferFree(CloudRequest): buffer_num: int # noqa: E702
 
 @dataclass(frozen=True)
-class CopyIn(CloudRequest): buffer_num: int; datahash: str # noqa: E702
+class CopyIn(CloudRequest): buffer_num: int; data: bytes = field(repr=False) # noqa: E702
 
 @dataclass(frozen=True)
 class CopyOut(CloudRequest): buffer_num: int
 
 @dataclass(frozen=True)
-class ProgramAlloc(CloudRequest): name: str; datahash: str # noqa: E702
+class ProgramAlloc(CloudRequest): name: str; datahash: str; lib: bytes = field(repr=False) # noqa: E702
 
 @dataclass(frozen=True)
 class ProgramFree(CloudRequest): name: str; datahash: str # noqa: E702
@@ -42,33 +43,64 @@ class ProgramExec(CloudRequest):
   name: str; datahash: str; bufs: tuple[int, ...]; vals: tuple[int, ...] # noqa: E702
   global_size: Optional[tuple[int, ...]]; local_size: Optional[tuple[int, ...]]; wait: bool # noqa: E702
 
-# for safe deserialization
-whitelist = {x.__name__:x for x in [BufferAlloc, BufferFree, CopyIn, CopyOut, ProgramAlloc, ProgramFree, ProgramExec, BufferSpec]}
-eval_fxns = {ast.Constant: lambda x: x.value, ast.Tuple: lambda x: tuple(map(safe_eval, x.elts)), ast.List: lambda x: list(map(safe_eval, x.elts)),
-  ast.Call: lambda x: safe_eval(x.func)(*[safe_eval(arg) for arg in x.args], **{kwarg.arg: safe_eval(kwarg.value) for kwarg in x.keywords}),
-  ast.Name: lambda x: whitelist[x.id], ast.Attribute: lambda x: {"imagef": dtypes.imagef, "imageh": dtypes.imageh}[x.attr]}
-def safe_eval(node): return eval_fxns[node.__class__](node)
+# ***** binary framing *****
+# every value is a one byte tag and its data, only these dataclasses (and the image dtypes) can be sent, there's no eval on the server
+
+sendable = [BufferAlloc, BufferFree, CopyIn, CopyOut, ProgramAlloc, ProgramFree, ProgramExec, BufferSpec]
+
+def pack(x, out:list[bytes]) -> list[bytes]:
+  if x is None or isinstance(x, bool): out.append({None: b"n", True: b"t", False: b"f"}[x])
+  elif isinstance(x, int): out.append(b"i"+struct.pack("<q", x))
+  elif isinstance(x, float): out.append(b"d"+struct.pack("<d", x))
+  elif isinstance(x, str): out.append(b"s"+struct.pack("<I", len(b:=x.encode()))+b)
+  # the payload is its own chunk, it's sent without being copied into the frame
+  elif isinstance(x, bytes): out.extend([b"b"+struct.pack("<Q", len(x)), x])
+  elif isinstance(x, tuple):
+    out.append(b"T"+struct.pack("<I", len(x)))
+    for y in x: pack(y, out)
+  elif isinstance(x, ImageDType):
+    out.append(b"I")
+    pack(x.shape, pack(x.name, out))
+  elif type(x) in sendable:
+    out.append(b"D"+bytes([sendable.index(type(x))]))
+    for f in fields(x): pack(getattr(x, f.name), out)
+  else: raise TypeError(f"can't send {x!r}")
+  return out
+
+def read_exact(f, n:int) -> bytearray:
+  if f.readinto(ret:=bytearray(n)) != n: raise ConnectionError(f"stream ended before {n} bytes")
+  return ret
+
+def unpack(f) -> Any:
+  def read(fmt:str) -> tuple: return struct.unpack(fmt, read_exact(f, struct.calcsize(fmt)))
+  match bytes(read_exact(f, 1)):
+    case b"n": return None
+    case b"t": return True
+    case b"f": return False
+    case b"i": return read("<q")[0]
+    case b"d": return read("<d")[0]
+    case b"s": return read_exact(f, read("<I")[0]).decode()
+    case b"b": return read_exact(f, read("<Q")[0])
+    case b"T": return tuple(unpack(f) for _ in range(read("<I")[0]))
+    case b"I": return {"imagef": dtypes.imagef, "imageh": dtypes.imageh}[unpack(f)](unpack(f))
+    case b"D": return (cls:=sendable[read_exact(f, 1)[0]])(*[unpack(f) for _ in fields(cls)])
+    case tag: raise ValueError(f"bad tag {tag!r}")
 
 class BatchRequest:
   def __init__(self):
     self._q: list[CloudRequest] = []
-    self._h: dict[str, bytes] = {}
-  def h(self, d:bytes) -> str:
-    binhash = hashlib.sha256(d).digest()
-    self._h[datahash:=binascii.hexlify(binhash).decode()] = binhash+struct.pack("<Q", len(d))+d
-    return datahash
-  def q(self, x:CloudRequest): self._q.append(x)
-  def serialize(self) -> bytes:
-    self.h(repr(self._q).encode())
-    return b''.join(self._h.values())
-  def deserialize(self, dat:bytes) -> BatchRequest:
-    ptr = 0
-    while ptr < len(dat):
-      datahash, datalen = binascii.hexlify(dat[ptr:ptr+0x20]).decode(), struct.unpack("<Q", dat[ptr+0x20:ptr+0x28])[0]
-      self._h[datahash] = dat[ptr+0x28:ptr+0x28+datalen]
-      ptr += 0x28+datalen
-    self._q = safe_eval(ast.parse(self._h[datahash], mode="eval").body)
-    return self
+    self.nbytes = 0
+  def q(self, x:CloudRequest):
+    self._q.append(x)
+    self.nbytes += sum(len(getattr(x, f)) for f in ("data", "lib") if hasattr(x, f))
+  # a batch is the number of requests and the requests, the server runs each one as soon as it's read
+  def serialize(self) -> list[bytes]:
+    out = [struct.pack("<I", len(self._q))]
+    for x in self._q: pack(x, out)
+    return out
+  @staticmethod
+  def deserialize(f):
+    for _ in range(struct.unpack("<I", read_exact(f, 4))[0]): yield unpack(f)
 
 # ***** backend *****
 
@@ -80,6 +112,8 @@ class CloudSession:
 
 class CloudHandler(BaseHTTPRequestHandler):
   protocol_version = 'HTTP/1.1'
+  # the headers and the body are separate writes, with Nagle every small response waits for the delayed ACK of the client
+  disable_nagle_algorithm = True
   device: str
   sessions: defaultdict[str, CloudSession] = defaultdict(CloudSession)
 
@@ -91,10 +125,8 @@ class CloudHandler(BaseHTTPRequestHandler):
     session = CloudHandler.sessions[unwrap(self.headers.get("Cookie")).split("session=")[1]]
     ret, status_code = b"", 200
     if self.path == "/batch" and method == "POST":
-      # TODO: streaming deserialize?
-      req = BatchRequest().deserialize(self.rfile.read(int(unwrap(self.headers.get('Content-Length')))))
-      # the cmds are always last (currently in datahash)
-      for c in req._q:
+      # the requests are run while the rest of the batch is still being read
+      for c in BatchRequest.deserialize(self.rfile):
         if DEBUG >= 1: print(c)
         match c:
           case BufferAlloc():
@@ -104,12 +136,12 @@ class CloudHandler(BaseHTTPRequestHandler):
             buf,sz,buffer_options = session.buffers[c.buffer_num]
             Device[CloudHandler.device].allocator.free(buf,sz,buffer_options)
             del session.buffers[c.buffer_num]
-          case CopyIn(): Device[CloudHandler.device].allocator._copyin(session.buffers[c.buffer_num][0], memoryview(bytearray(req._h[c.datahash])))
+          case CopyIn(): Device[CloudHandler.device].allocator._copyin(session.buffers[c.buffer_num][0], memoryview(c.data))
           case CopyOut():
             buf,sz,_ = session.buffers[c.buffer_num]
             Device[CloudHandler.device].allocator._copyout(memoryview(ret:=bytearray(sz)), buf)
           case ProgramAlloc():
-            lib = Device[CloudHandler.device].compiler.compile_cached(req._h[c.datahash].decode())
+            lib = Device[CloudHandler.device].compiler.compile_cached(c.lib.decode())
             session.programs[(c.name, c.datahash)] = Device[CloudHandler.device].runtime(c.name, lib)
           case ProgramFree(): del session.programs[(c.name, c.datahash)]
           case ProgramExec():
@@ -138,6 +170,9 @@ def cloud_server(port:int):
 
 # ***** frontend *****
 
+# the copyins of a batch send it once they're this big
+CLOUD_BATCH_BYTES = getenv("CLOUD_BATCH_BYTES", 1<<24)
+
 class CloudAllocator(Allocator):
   def __init__(self, dev:CloudDevice):
     self.device = dev
@@ -149,24 +184,33 @@ class CloudAllocator(Allocator):
     return self.device.buffer_num
   # TODO: options should not be here in any Allocator
   def _free(self, opaque:int, options): self.device.req.q(BufferFree(opaque))
-  def _copyin(self, dest:int, src:memoryview): self.device.req.q(CopyIn(dest, self.device.req.h(bytes(src))))
+  def _copyin(self, dest:int, src:memoryview):
+    self.device.req.q(CopyIn(dest, bytes(src)))
+    # big copies are sent right away, they don't wait for the next copyout or wait
+    if self.device.req.nbytes >= CLOUD_BATCH_BYTES: self.device.batch_submit()
   def _copyout(self, dest:memoryview, src:int):
     self.device.req.q(CopyOut(src))
-    resp = self.device.batch_submit()
+    resp = self.device.batch_submit().result()
     assert len(resp) == len(dest), f"buffer length mismatch {len(resp)} != {len(dest)}"
     dest[:] = resp
 
 class CloudProgram:
   def __init__(self, dev:CloudDevice, name:str, lib:bytes):
     self.dev, self.name = dev, name
-    self.datahash = self.dev.req.h(lib)
-    self.dev.req.q(ProgramAlloc(self.name, self.datahash))
+    self.datahash = binascii.hexlify(hashlib.sha256(lib).digest()).decode()
+    self.dev.req.q(ProgramAlloc(self.name, self.datahash, lib))
     super().__init__()
   def __del__(self): self.dev.req.q(ProgramFree(self.name, self.datahash))
 
   def __call__(self, *bufs, global_size=None, local_size=None, vals:tuple[int, ...]=(), wait=False):
     self.dev.req.q(ProgramExec(self.name, self.datahash, bufs, vals, global_size, local_size, wait))
-    if wait: return float(self.dev.batch_submit())
+    if wait: return float(self.dev.batch_submit().result())
+
+def cloud_address(host:str) -> tuple[str, int]:
+  # like HTTPConnection, the port is 80 if it's not given and IPv6 addresses are in brackets
+  url = urllib.parse.urlsplit("//"+host)
+  if url.hostname is None: raise ValueError(f"bad cloud host {host!r}")
+  return url.hostname, url.port or 80
 
 class CloudDevice(Compiled):
   def __init__(self, device:str):
@@ -181,16 +225,16 @@ class CloudDevice(Compiled):
     self.session = binascii.hexlify(os.urandom(0x10)).decode()
     self.buffer_num = 0
     self.req: BatchRequest = BatchRequest()
+    # the requests are pipelined on one connection, the responses come back in order and complete these futures
+    self.inflight: queue.Queue[Optional[tuple[Future[bytes], socket.socket, io.BufferedReader]]] = queue.Queue()
+    self.last: Optional[Future[bytes]] = None
+    # like HTTPConnection, the connection is opened by the first request and opened again by the request after it broke
+    self.sock: Optional[socket.socket] = None
+    self.lock = threading.Lock()
 
     if DEBUG >= 1: print(f"cloud with host {self.host}")
-    while 1:
-      try:
-        self.conn = http.client.HTTPConnection(self.host, timeout=60.0)
-        clouddev = json.loads(self.send("GET", "renderer").decode())
-        break
-      except Exception as e:
-        print(e)
-        time.sleep(0.1)
+    threading.Thread(target=self._recv, daemon=True).start()
+    clouddev = json.loads(self.send("GET", "renderer").result().decode())
     if DEBUG >= 1: print(f"remote has device {clouddev}")
     # TODO: how to we have BEAM be cached on the backend? this should just send a specification of the compute. rethink what goes in Renderer
     if not clouddev[0].startswith("tinygrad.renderer.") or not clouddev[1].endswith("Renderer"): raise RuntimeError(f"bad renderer {clouddev}")
@@ -201,20 +245,73 @@ class CloudDevice(Compiled):
   def __del__(self):
     # TODO: this is never being called
     # TODO: should close the whole session
-    with contextlib.suppress(ConnectionRefusedError, http.client.CannotSendRequest, http.client.RemoteDisconnected): self.batch_submit()
+    with contextlib.suppress(OSError): self.batch_submit()
+
+  def synchronize(self):
+    if len(self.req._q): self.batch_submit()
+    if self.last is not None: self.last.result()
 
-  def batch_submit(self):
+  def batch_submit(self) -> Future[bytes]:
     data = self.req.serialize()
-    with Timing(f"*** send {len(self.req._q):-3d} requests {len(self.req._h):-3d} hashes with len {len(data)/1024:.2f} kB in ", enabled=DEBUG>=1):
+    with Timing(f"*** send {len(self.req._q):-3d} requests with len {sum(len(x) for x in data)/1024:.2f} kB in ", enabled=DEBUG>=1):
       ret = self.send("POST", "batch", data)
     self.req = BatchRequest()
     return ret
 
-  def send(self, method, path, data:Optional[bytes]=None) -> bytes:
-    # TODO: retry logic
-    self.conn.request(method, "/"+path, data, headers={"Cookie": f"session={self.session}"})
-    response = self.conn.getresponse()
-    assert response.status == 200, f"failed on {method} {path}"
-    return response.read()
+  def _connect(self) -> socket.socket:
+    address = cloud_address(self.host)
+    while 1:
+      try:
+        sock = socket.create_connection(address, timeout=60.0)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        break
+      except Exception as e:
+        print(e)
+        time.sleep(0.1)
+    self.sock, self.rfile = sock, sock.makefile("rb")
+    return sock
+
+  def send(self, method, path, data:Sequence[bytes]=()) -> Future[bytes]:
+    hdr = f"{method} /{path} HTTP/1.1\r\nHost: {self.host}\r\nCookie: session={self.session}\r\nContent-Length: {sum(len(x) for x in data)}\r\n\r\n"
+    with self.lock:
+      sock = self.sock if self.sock is not None else self._connect()
+      self.inflight.put((ret:=Future[bytes](), sock, self.rfile))
+      try:
+        # the chunks are sent as they are, the payloads of copyins aren't joined into one big body
+        for x in [hdr.encode(), *data]: sock.sendall(x)
+      except OSError:
+        # the receiver fails the requests on this connection, the next one reconnects
+        self.sock = None
+        with contextlib.suppress(OSError): sock.shutdown(socket.SHUT_RDWR)
+        raise
+    self.last = ret
+    return ret
+
+  def _recv(self):
+    dead: Optional[socket.socket] = None
+    while (req:=self.inflight.get()) is not None:
+      fut, sock, rfile = req
+      if sock is dead:
+        fut.set_exception(ConnectionError(f"cloud connection to {self.host} broke before the response"))
+        continue
+      try:
+        if len(status:=rfile.readline().split()) < 2: raise ConnectionError(f"cloud connection to {self.host} closed")
+        headers: dict[str, str] = {}
+        while (line:=rfile.readline()) not in (b"\r\n", b""):
+          k, v = line.decode().split(":", 1)
+          headers[k.lower()] = v
+        body = read_exact(rfile, int(headers["content-length"]))
+      except Exception as e:
+        # after a timeout or a broken response the next bytes aren't the start of a response, so the requests after it on this connection fail too
+        dead = sock
+        with self.lock:
+          if self.sock is sock: self.sock = None
+          with contextlib.suppress(OSError):
+            rfile.close()
+            sock.close()
+        fut.set_exception(e)
+        continue
+      if status[1] != b"200": fut.set_exception(RuntimeError(f"cloud request failed with {status[1].decode()}"))
+      else: fut.set_result(bytes(body))
 
 if __name__ == "__main__": cloud_server(getenv("PORT", 6667))
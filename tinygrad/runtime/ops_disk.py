@@ -1,6 +1,7 @@
-import os, sys, mmap, io, ctypes, ctypes.util, contextlib
-from typing import Optional, Generator, Callable
-from tinygrad.helpers import OSX, round_up
+from __future__ import annotations
+import os, sys, mmap, io, ctypes, ctypes.util, contextlib, threading
+from typing import Optional, Generator, Callable, Any
+from tinygrad.helpers import OSX, round_up, getenv, mv_address, flat_mv
 from tinygrad.device import Compiled, Allocator
 with contextlib.suppress(ImportError):
   import _posixshmem
@@ -62,6 +63,67 @@ class DiskDevice(Compiled):
 
       DiskDevice.io_uring = io_uring.struct_io_uring(ring_fd=fd, sq=sqdesc, cq=cqdesc) # type: ignore
 
+DISK_QUEUE_DEPTH, DISK_SEG_SIZE = getenv("DISK_QUEUE_DEPTH", 32), getenv("DISK_SEG_SIZE", 2<<20)
+DISK_BATCHED_COPYOUT = getenv("DISK_BATCHED_COPYOUT", 0)
+class DiskReader:
+  """
+  Reads from files with DiskDevice.io_uring, with up to `depth` reads in flight. All the reads queued since the last poll are submitted with one
+  io_uring_enter.
+  """
+  _reader: Optional[DiskReader] = None
+  @staticmethod
+  def get() -> DiskReader:
+    if DiskReader._reader is None: DiskReader._reader = DiskReader(max(DISK_QUEUE_DEPTH, 1))
+    return DiskReader._reader
+
+  def __init__(self, depth:int):
+    self.depth, self.to_submit, self.next_id = depth, 0, 0
+    self.reqs: dict[int, tuple] = {}
+    assert hasattr(DiskDevice, "io_uring"), "DiskReader needs io_uring"
+    self.ring: Any = DiskDevice.io_uring
+  @property
+  def inflight(self) -> int: return len(self.reqs)
+
+  def submit(self, fd:int, offset:int, addr:int, size:int, need:int, tag:Any):
+    """Queues a read of up to `size` bytes at `offset` of `fd` to `addr`. It is done once `need` bytes are read, less at the end of a file."""
+    self.reqs[self.next_id] = req = (fd, offset, addr, size, need, tag)
+    self._submit(self.next_id, req)
+    self.next_id += 1
+  def _submit(self, rid:int, req:tuple):
+    fd, offset, addr, size, _, _ = req
+    sqe_index = (tail:=self.ring.sq.ktail[0]) & self.ring.sq.kring_mask[0]
+    sqe = self.ring.sq.sqes[sqe_index]
+    sqe.opcode, sqe.flags, sqe.fd, sqe.off, sqe.addr, sqe.len, sqe.user_data = io_uring.IORING_OP_READ, 0, fd, offset, addr, size, rid
+    self.ring.sq.array[sqe_index] = sqe_index
+    self.ring.sq.ktail[0] = tail + 1
+    self.to_submit += 1
+
+  def _complete(self, rid:int, res:int) -> list[Any]:
+    fd, offset, addr, size, need, tag = self.reqs[rid]
+    if res < 0: raise RuntimeError(f"read from disk failed, err: {res}")
+    if res < need and res != 0:
+      # a short read, the rest is read again
+      self.reqs[rid] = req = (fd, offset+res, addr+res, size-res, need-res, tag)
+      self._submit(rid, req)
+      return []
+    if res < need: raise RuntimeError(f"read from disk failed, {need} bytes missing at {offset}")
+    del self.reqs[rid]
+    return [tag]
+
+  def poll(self, wait:bool) -> list[Any]:
+    """Submits the queued reads and returns the tags of the finished ones. With `wait`, it waits for at least one if any are in flight."""
+    done: list[Any] = []
+    if self.to_submit or (wait and self.reqs):
+      libc.syscall(io_uring.NR_io_uring_enter, self.ring.ring_fd, self.to_submit, 1 if wait and self.reqs else 0,
+                   io_uring.IORING_ENTER_GETEVENTS if wait and self.reqs else 0)
+      self.to_submit = 0
+    while (head:=self.ring.cq.khead[0]) != self.ring.cq.ktail[0]:
+      cqe = self.ring.cq.cqes[head & self.ring.cq.kring_mask[0]]
+      rid, res = cqe.user_data, cqe.res
+      self.ring.cq.khead[0] = head + 1 # advance
+      done += self._complete(rid, res)
+    return done
+
 class DiskBuffer:
   def __init__(self, device:DiskDevice, size:int, offset=0):
     self.device, self.size, self.offset = device, size, offset
@@ -72,6 +134,9 @@ class DiskBuffer:
 
 MAP_LOCKED, MAP_POPULATE = 0 if OSX else 0x2000, getattr(mmap, "MAP_POPULATE", 0 if OSX else 0x008000)
 class DiskAllocator(Allocator):
+  # the bounce buffers and the reader are shared by all the disk devices
+  _bounce: list[memoryview] = []
+  _lock = threading.RLock()
   def __init__(self, dev:DiskDevice): self.dev = dev
   def _alloc(self, size:int, options):
     self.dev._might_open(size)
@@ -80,7 +145,11 @@ class DiskAllocator(Allocator):
   def _as_buffer(self, src:DiskBuffer): return src._buf()
   def _copyin(self, dest:DiskBuffer, src:memoryview): dest._buf()[:] = src
   def _copyout(self, dest:memoryview, src:DiskBuffer):
-    if OSX and self.dev.fd is not None:
+    if DISK_BATCHED_COPYOUT and self._batched_ok(len(dest)) and self._cached(src) < 0.5:
+      # big reads of a file that isn't in the page cache go through io_uring with a deep queue instead of faulting in the mmap page by page.
+      # NOTE: the reads skip the page cache, so a file read again stays slow. the memcpy from the mmap is faster for a file in the page cache
+      self._copyout_batched(flat_mv(dest), src)
+    elif OSX and self.dev.fd is not None:
       # OSX doesn't seem great at mmap, this is faster
       with io.FileIO(self.dev.fd, "a+b", closefd=False) as fo:
         fo.seek(src.offset)
@@ -88,36 +157,57 @@ class DiskAllocator(Allocator):
     else:
       dest[:] = src._buf()
 
-  def _copyout_sharded(self, src:DiskBuffer, size:int, _get_free_buf:Callable, seg_len:int) -> Generator[tuple[int, int, int, int], None, None]:
-    assert hasattr(DiskDevice, 'io_uring'), "function requires io uring support"
-
+  def _batched_ok(self, size:int) -> bool:
+    return hasattr(DiskDevice, 'io_uring') and self.dev.fd is not None and size >= DISK_SEG_SIZE and DISK_QUEUE_DEPTH > 0
+  def _cached(self, src:DiskBuffer) -> float:
+    """Returns the fraction of the pages of `src` that are in the page cache."""
+    st = src.offset - src.offset % mmap.PAGESIZE
+    vec = (ctypes.c_ubyte * (pages:=(src.offset + src.size - st + mmap.PAGESIZE - 1) // mmap.PAGESIZE))()
+    if libc.mincore(mv_address(self.dev.mem) + st, pages * mmap.PAGESIZE, vec) != 0: return 1.0
+    return (pages - bytes(vec).count(0)) / pages
+
+  def _copyout_sharded(self, src:DiskBuffer, size:int, _get_free_buf:Callable, seg_len:int) -> Generator[tuple[Any, int, int, int], None, None]:
+    """
+    Reads `size` bytes of `src` in page aligned segments of up to `seg_len` bytes into the buffers returned by `_get_free_buf` (address first),
+    which returns None while none is free. Yields (buffer, offset in dest, offset in buffer, size) for every segment as soon as it's read.
+    """
+    assert self.dev.fd is not None, "DiskBuffer wasn't opened with a file"
     fd_offset = src.offset - (minor_offset := src.offset % mmap.PAGESIZE)
-    processed_reqs_cnt, copied_in, next_read_offset, total_copy_size = 0, 0, 0, round_up(size + minor_offset, mmap.PAGESIZE)
-    reqs: list[tuple[int, int, int, int]] = []
-
-    while next_read_offset < total_copy_size or len(reqs) != processed_reqs_cnt:
-      if next_read_offset < total_copy_size and (copy_batch := _get_free_buf()) is not None:
-        # Prepare sqe
-        sqe_index = (tail:=DiskDevice.io_uring.sq.ktail[0]) & DiskDevice.io_uring.sq.kring_mask[0]
-        sqe = DiskDevice.io_uring.sq.sqes[sqe_index]
-        sqe.opcode, sqe.fd, sqe.off = io_uring.IORING_OP_READ, self.dev.fd, fd_offset + next_read_offset
-        sqe.addr, sqe.len, sqe.user_data = copy_batch[0], min(seg_len, total_copy_size - next_read_offset), len(reqs)
-
-        # Send sqe
-        DiskDevice.io_uring.sq.array[sqe_index] = sqe_index
-        DiskDevice.io_uring.sq.ktail[0] = tail + 1
-        libc.syscall(io_uring.NR_io_uring_enter, DiskDevice.io_uring.ring_fd, 1, 1, io_uring.IORING_ENTER_GETEVENTS)
-
-        reqs.append((copy_batch, copied_in, minor_offset, real_copy_size:=min(sqe.len - minor_offset, size - copied_in)))
-        next_read_offset += sqe.len
-        copied_in += real_copy_size
-        minor_offset = 0
-
-      if (head:=DiskDevice.io_uring.cq.khead[0]) != DiskDevice.io_uring.cq.ktail[0]:
-        cqe = DiskDevice.io_uring.cq.cqes[head & DiskDevice.io_uring.cq.kring_mask[0]]
-        assert cqe.res >= 0, f"read from disk failed, err: {cqe.res}"
-        yield reqs[cqe.user_data]
-        DiskDevice.io_uring.cq.khead[0] = head + 1 # advance
-        processed_reqs_cnt += 1
+    copied_in, next_read_offset, total_copy_size = 0, 0, round_up(size + minor_offset, mmap.PAGESIZE)
+    with DiskAllocator._lock:
+      reader = DiskReader.get()
+      while next_read_offset < total_copy_size or reader.inflight:
+        # queue every segment there is a free buffer for, they are all submitted at once in poll
+        while next_read_offset < total_copy_size and reader.inflight < reader.depth and (copy_batch := _get_free_buf()) is not None:
+          seg = min(seg_len, total_copy_size - next_read_offset)
+          real_copy_size = min(seg - minor_offset, size - copied_in)
+          reader.submit(self.dev.fd, fd_offset + next_read_offset, copy_batch[0], seg, minor_offset + real_copy_size,
+                        (copy_batch, copied_in, minor_offset, real_copy_size))
+          next_read_offset, copied_in, minor_offset = next_read_offset + seg, copied_in + real_copy_size, 0
+        yield from reader.poll(wait=True)
+
+  def _bounce_bufs(self, seg_len:int, cnt:int) -> list[memoryview]:
+    # page aligned host buffers for the reads, locked in memory if the limits allow it
+    if len(DiskAllocator._bounce) < cnt or len(DiskAllocator._bounce[0]) < seg_len:
+      try: mem = mmap.mmap(-1, seg_len*cnt, mmap.MAP_SHARED | mmap.MAP_ANONYMOUS | MAP_POPULATE | MAP_LOCKED)
+      except OSError: mem = mmap.mmap(-1, seg_len*cnt, mmap.MAP_SHARED | mmap.MAP_ANONYMOUS | MAP_POPULATE)
+      DiskAllocator._bounce = [memoryview(mem)[i*seg_len:(i+1)*seg_len] for i in range(cnt)]
+    return DiskAllocator._bounce[:cnt]
+
+  def _copyout_batched(self, dest:memoryview, src:DiskBuffer, seg_len:int=DISK_SEG_SIZE):
+    with DiskAllocator._lock:
+      free = [(mv_address(b), b) for b in self._bounce_bufs(seg_len, DiskReader.get().depth)]
+      for (addr, buf), dst_off, src_off, sz in self._copyout_sharded(src, len(dest), lambda: free.pop() if free else None, seg_len):
+        dest[dst_off:dst_off+sz] = buf[src_off:src_off+sz]
+        free.append((addr, buf))
 
   def _offset(self, buf:DiskBuffer, size:int, offset:int): return DiskBuffer(buf.device, size, offset)
+  def _map(self, src:DiskBuffer, align:int=16):
+    """Returns a copy on write mapping of the file under src, None if the file can't be mapped at an address aligned to align."""
+    # the clean pages are the page cache pages of the file, so every process mapping the file shares one copy of it
+    # NOTE: the writes to the mapping stay private, but the pages that weren't written see later writes to the file
+    if self.dev.fd is None or src.offset % align or not hasattr(mmap, "MAP_PRIVATE"): return None
+    pad = src.offset % mmap.ALLOCATIONGRANULARITY
+    mem = mmap.mmap(self.dev.fd, src.size+pad, mmap.MAP_PRIVATE, mmap.PROT_READ|mmap.PROT_WRITE, offset=src.offset-pad)
+    # the ctypes array keeps the mmap alive, it's unmapped when the last buffer using it is gone
+    return (ctypes.c_uint8 * src.size).from_buffer(mem, pad)
@@ -4,7 +4,10 @@ from dataclasses import dataclass
 from typing import Optional, cast, Sequence
 from tinygrad.dtype import dtypes
 from tinygrad.ops import resolve, UOp, Variable, sint, sym_infer, smax, smin, sint_to_uop
-from tinygrad.helpers import prod, all_int, argsort, flatten, ceildiv
+from tinygrad.helpers import prod, all_int, argsort, flatten, ceildiv, getenv
+
+# merge/reshape/invert see the same few views over and over, but a long-running process sees unboundedly many
+VIEW_CACHE_SIZE = getenv("VIEW_CACHE_SIZE", 1 << 16)
 
 @functools.lru_cache(maxsize=None)
 def canonicalize_strides(shape:tuple[sint, ...], strides:tuple[sint, ...]) -> tuple[sint, ...]:
@@ -38,7 +41,7 @@ def merge_dims(shape:tuple[int, ...], strides:tuple[int, ...], mask:Optional[tup
     merging = (mask[i][1] - mask[i][0] == 1) if mask is not None else s == 1
   return tuple(ret)
 
-@functools.lru_cache(maxsize=None)
+@functools.lru_cache(maxsize=VIEW_CACHE_SIZE)
 def _reshape_mask(_mask:Optional[tuple[tuple[sint, sint], ...]], old_shape:tuple[sint, ...], new_shape:tuple[sint, ...]) \
   -> Optional[tuple[tuple[sint, sint], ...]]:
   """Returns the new mask if reshape is possible, and None if not possible."""
@@ -79,6 +82,37 @@ def unravel(shape:tuple[sint, ...], offset:sint) -> list[sint]:
     acc *= d
   return idxs[::-1]
 
+def _merge_extents(shape1:tuple[int, ...], shape2:tuple[sint, ...], terms:list[list[tuple[int, sint]]], origin:list[sint]) \
+  -> Optional[list[tuple[sint, sint, sint]]]:
+  # returns (merged_size, min, max) of the index into each group of merged vm2 dims, innermost first
+  idxs: list[UOp] = [UOp.variable(f"idx{i}", 0, s-1) for i,s in enumerate(shape1)]
+  merged_size, merged_term = 1, UOp.const(dtypes.int, 0)
+  extents: list[tuple[sint, sint, sint]] = []
+  for term, s, o in zip(reversed(terms), reversed(shape2), reversed(origin)):
+    merged_term += (sum([idxs[d1] * s1 for d1, s1 in term]) + o) * merged_size
+    merged_size *= s
+    if resolve(merged_term < merged_size, False) and resolve(0 <= merged_term, False):
+      extents.append((merged_size, merged_term.vmin, merged_term.vmax))
+      merged_size, merged_term = 1, UOp.const(dtypes.int, 0)
+  return None if resolve(merged_term != 0) else extents
+
+def _merge_extents_int(shape1:tuple[int, ...], shape2:tuple[int, ...], terms:list[list[tuple[int, int]]], origin:list[int]) \
+  -> Optional[list[tuple[sint, sint, sint]]]:
+  # same as _merge_extents, but the merged term is a plain linear form in the idxs so its bounds are computed without building UOps
+  extents: list[tuple[sint, sint, sint]] = []
+  merged_size, coeffs, const = 1, [0] * len(shape1), 0
+  lo = hi = 0
+  for term, s, o in zip(reversed(terms), reversed(shape2), reversed(origin)):
+    for d1, s1 in term: coeffs[d1] += s1 * merged_size
+    const += o * merged_size
+    merged_size *= s
+    lo = const + sum(min(0, c * (n-1)) for c,n in zip(coeffs, shape1))
+    hi = const + sum(max(0, c * (n-1)) for c,n in zip(coeffs, shape1))
+    if hi < merged_size and 0 <= lo:
+      extents.append((merged_size, lo, hi))
+      merged_size, coeffs, const, lo, hi = 1, [0] * len(shape1), 0, 0, 0
+  return None if lo != 0 or hi != 0 else extents
+
 @dataclass(frozen=True)
 class View:
   shape:tuple[sint, ...]
@@ -148,7 +182,7 @@ class View:
     new_mask = tuple((substitute(x[0]), substitute(x[1])) for x in self.mask) if self.mask is not None else None
     return View.create(new_shape, new_strides, new_offset, new_mask), dict(x[1] for x in var_unboundvar_val)
 
-  @functools.lru_cache(maxsize=None)  # pylint: disable=method-cache-max-size-none
+  @functools.lru_cache(maxsize=VIEW_CACHE_SIZE)
   def __add__(self, vm1:View) -> Optional[View]:
     vm2 = self
     if vm2.contiguous: return vm1
@@ -172,17 +206,11 @@ class View:
 
     # Merge dimensions in vm2 if required.
     # NB: Merging too many dimensions can make it difficult to project vm2's mask, hence only combining when required.
-    idxs: list[UOp] = [UOp.variable(f"idx{i}", 0, s-1) for i,s in enumerate(vm1.shape)]
-    merged_size, merged_term = 1, UOp.const(dtypes.int, 0)
-    extents: list[tuple[sint, UOp]] = []
-    for term, s, o in zip(reversed(terms), reversed(vm2.shape), reversed(origin)):
-      merged_term += (sum([idxs[d1] * s1 for d1, s1 in term]) + o) * merged_size
-      merged_size *= s
-      if resolve(merged_term < merged_size, False) and resolve(0 <= merged_term, False):
-        extents.append((merged_size, merged_term))
-        merged_size, merged_term = 1, UOp.const(dtypes.int, 0)
-    if resolve(merged_term != 0): return None
-    if (vm2_shape := tuple(s for s,_ in reversed(extents))) != vm2.shape:
+    if all_int(vm2.shape+vm1.strides+(vm1.offset,)):
+      extents = _merge_extents_int(vm1.shape, cast(tuple[int, ...], vm2.shape), cast(list[list[tuple[int, int]]], terms), cast(list[int], origin))
+    else: extents = _merge_extents(vm1.shape, vm2.shape, terms, origin)
+    if extents is None: return None
+    if (vm2_shape := tuple(s for s,_,_ in reversed(extents))) != vm2.shape:
       if (reshaped_vm2 := vm2.reshape(vm2_shape)) is None: return None
       # NOTE: this != to prevent infinite loop
       if reshaped_vm2.shape != vm2.shape: return reshaped_vm2 + vm1
@@ -190,8 +218,8 @@ class View:
     if vm2.mask:
       # Try to project vm2's mask on to vm1.
       newb, newe, bad = [0] * len(vm1.shape), list(vm1.shape), False
-      for (b, e), o, term, (_, t) in zip(vm2.mask, origin, terms, reversed(extents)):
-        if resolve(b <= t.vmin and t.vmax < e, False): continue
+      for (b, e), o, term, (_, tmin, tmax) in zip(vm2.mask, origin, terms, reversed(extents)):
+        if resolve(b <= tmin and tmax < e, False): continue
         if len(term) != 1:
           if not term and newe: newe[0] = 0
           else: bad = True
@@ -208,7 +236,7 @@ class View:
 
     return View.create(vm1.shape, tuple(strides), sum(o * s for o, s in zip(origin, vm2.strides)) + vm2.offset)
 
-  @functools.lru_cache(maxsize=None)  # pylint: disable=method-cache-max-size-none
+  @functools.lru_cache(maxsize=VIEW_CACHE_SIZE)
   def invert(self, out_shape:tuple[sint, ...]) -> Optional[View]:
     ret = View.create(self.shape)
     if self.mask: ret = ret.shrink(self.mask)
@@ -270,7 +298,7 @@ class View:
     mask = tuple((s-my,s-mx) if f else (mx,my) for (mx,my),s,f in zip(self.mask, self.shape, arg)) if self.mask is not None else None
     return View.create(self.shape, tuple(-z if f else z for z,f in zip(self.strides, arg)), self.offset+offset, mask)
 
-  @functools.lru_cache(maxsize=None)  # pylint: disable=method-cache-max-size-none
+  @functools.lru_cache(maxsize=VIEW_CACHE_SIZE)
   def reshape(self, new_shape: tuple[sint, ...]) -> Optional[View]:
     if self.shape == new_shape: return self
 
@@ -1,6 +1,6 @@
 # inspired by https://github.com/karpathy/micrograd/blob/master/micrograd/engine.py
 from __future__ import annotations
-import time, math, itertools, functools, struct, sys, inspect, pathlib, string, hashlib, weakref
+import time, math, itertools, functools, struct, sys, inspect, pathlib, string, hashlib, weakref, dataclasses, concurrent.futures
 from contextlib import ContextDecorator
 from typing import List, Tuple, Callable, Optional, ClassVar, Union, Sequence, cast, get_args, Literal, TYPE_CHECKING, SupportsIndex
 from tinygrad.dtype import DType, DTypeLike, dtypes, ImageDType, ConstType, least_upper_float, least_upper_dtype, sum_acc_dtype, to_dtype, truncate
@@ -11,9 +11,9 @@ from tinygrad.gradient import compute_gradient
 from tinygrad.ops import smax, smin, resolve, UOp, Ops, sint, Variable, SimpleMathTrait, identity_element
 from tinygrad.spec import tensor_uop_spec, type_verify
 from tinygrad.device import Device, BufferSpec
-from tinygrad.engine.realize import run_schedule
+from tinygrad.engine.realize import run_schedule, run_schedule_async, wait_buffers
 from tinygrad.engine.memory import memory_planner
-from tinygrad.engine.schedule import ScheduleItem, create_schedule_with_vars
+from tinygrad.engine.schedule import ScheduleItem, create_schedule_with_vars_cached
 
 # *** all in scope Tensors are here. this gets relevant UOps ***
 
@@ -251,8 +251,10 @@ class Tensor(SimpleMathTrait):
     # verify Tensors match the spec
     if __debug__: type_verify(list(big_sink.toposort), tensor_uop_spec)
 
-    schedule, var_vals, becomes_map = create_schedule_with_vars(big_sink)
+    schedule, var_vals, becomes_map = create_schedule_with_vars_cached(big_sink)
     _apply_map_to_tensors(becomes_map)
+    # the BUFFER UOps no Tensor points to anymore are freed here, which lets the memory planner reuse their buffers
+    del becomes_map, big_sink
     return memory_planner(schedule), var_vals
 
   def schedule(self, *lst:Tensor) -> list[ScheduleItem]:
@@ -266,6 +268,14 @@ class Tensor(SimpleMathTrait):
     run_schedule(*self.schedule_with_vars(*lst), do_update_stats=do_update_stats)
     return self
 
+  def realize_async(self, *lst:Tensor, do_update_stats=True) -> concurrent.futures.Future:
+    """
+    Schedules these Tensor(s) and runs the schedule on a background thread, returning a Future to wait on.
+
+    Reading the data of the Tensor(s) or realizing anything that uses their buffers waits for the schedule to finish.
+    """
+    return run_schedule_async(*self.schedule_with_vars(*lst), do_update_stats=do_update_stats)
+
   def replace(self, x:Tensor) -> Tensor:
     """
     Replaces the data of this tensor with the data of another tensor. Only the shape of the tensors must match.
@@ -301,10 +311,14 @@ class Tensor(SimpleMathTrait):
   def _data(self) -> memoryview:
     if 0 in self.shape: return memoryview(bytearray(0))
     # NOTE: this realizes on the object from as_buffer being a Python object
-    cpu = self.cast(self.dtype.base).contiguous().to("CLANG").realize()
+    # NOTE: DISK can't run the movement ops of a view that isn't contiguous (e.g. a permuted torch_load weight), they run after the copy
+    src = self.to("CLANG") if isinstance(self.device, str) and self.device.startswith("DISK") and not unwrap(self.lazydata.st).contiguous else self
+    cpu = src.cast(self.dtype.base).contiguous().to("CLANG").realize()
     buf = cast(UOp, cpu.lazydata).base.realized
     assert buf is not None, f"{cast(UOp, cpu.lazydata).base} was not realized"
-    if self.device != "CLANG": buf.options = BufferSpec(nolru=True)
+    wait_buffers([buf])
+    # NOTE: the external_ptr of a DISK_MMAP mapping is kept, it must not be freed
+    if self.device != "CLANG": buf.options = dataclasses.replace(buf.options, nolru=True) if buf.options else BufferSpec(nolru=True)
     return buf.as_buffer(allow_zero_copy=True if self.device != "CLANG" else False)
 
   def data(self) -> memoryview: